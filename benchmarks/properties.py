@@ -0,0 +1,170 @@
+"""
+Times the calc_* properties of Response and Cell (and the per-cell pulse and
+spike indexes) on representative responses of example cells, and saves the
+timings as JSON so that two runs can be compared. Run from the repository
+root:
+
+    python -m benchmarks.properties --output before.json
+    python -m benchmarks.properties --output after.json --compare before.json
+
+Each property is timed on fresh responses (or with an empty cell cache), so
+its timing includes the properties it depends on.
+"""
+from neurospyke.query import Query
+from neurospyke.utils import load_cells
+import argparse
+import datetime
+import json
+import numpy as np
+import pandas as pd
+import platform
+import subprocess
+import time
+
+default_data_dir_path = "docs/example_cells/*.mat"
+
+spiking_criteria = [('curr_duration', .3), ('num_spikes', '>2')]
+hyperpolarizing_criteria = [('curr_duration', .12), ('curr_amplitude', -400)]
+
+response_benchmarks = {
+        'spiking': (spiking_criteria, [
+            'spike_points', 'num_spikes', 'APmax_vals', 'AHP_vals', 
+            'threshold_vals', 'threshold_timing', 'AP_width__50', 
+            'dVdt_pct_APamp__20__rising', 'delta_thresh', 'doublet_index']),
+        'hyperpolarizing': (hyperpolarizing_criteria, [
+            'baseline', 'peak_sag_val', 'sag_abs_amplitude', 'sag_fit_amplitude', 
+            'max_rebound_time', 'reb_delta_t']),
+        }
+
+cell_benchmarks = {
+        'hyperpolarizing': (hyperpolarizing_criteria, [
+            'average_response', 'sag_fit_amplitude', 'reb_delta_t', 'max_rebound_time']),
+        }
+
+def time_repeats(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def summarize(timings, **counts):
+    summary = {
+            'min': min(timings), 
+            'median': float(np.median(timings)), 
+            'repeats': len(timings)}
+    summary.update(counts)
+    return summary
+
+def set_query(cells, response_criteria):
+    query = Query(cells, response_criteria=response_criteria)
+    for cell in cells:
+        cell.query = query
+
+def reset_indexes(cells):
+    for cell in cells:
+        cell._pulse_index = None
+        cell._pulse_index_sweeps = np.zeros(0, dtype=int)
+        cell._spike_index = None
+
+def run_benchmarks(cells, repeats=5):
+    """
+    Returns a dict with the timings (in seconds, summed over all cells and
+    responses) of every benchmark.
+    """
+    results = {}
+
+    def build_indexes():
+        reset_indexes(cells)
+        for cell in cells:
+            cell.pulse_index()
+    results['cell.pulse_index'] = summarize(time_repeats(build_indexes, repeats), cells=len(cells))
+
+    for response_type, (response_criteria, property_names) in response_benchmarks.items():
+        set_query(cells, response_criteria)
+        num_responses = sum(len(list(cell.valid_responses())) for cell in cells)
+        for property_name in property_names:
+            def calc_property():
+                for cell in cells:
+                    for response in cell.valid_responses():
+                        response._cache.clear()
+                        response.calc_or_read_from_cache(property_name)
+            results[f"response.{response_type}.{property_name}"] = summarize(
+                    time_repeats(calc_property, repeats), responses=num_responses)
+
+    for response_type, (response_criteria, property_names) in cell_benchmarks.items():
+        set_query(cells, response_criteria)
+        for property_name in property_names:
+            def calc_property():
+                for cell in cells:
+                    cell._cache.clear()
+                    if property_name == 'average_response':
+                        cell.average_response()
+                    else:
+                        cell.calc_or_read_from_cache(property_name)
+            results[f"cell.{response_type}.{property_name}"] = summarize(
+                    time_repeats(calc_property, repeats), cells=len(cells))
+    return results
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'], 
+                stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine()}
+
+def compare(old_results, new_results, tolerance=.1):
+    """
+    Returns a dataframe with the median timings of both runs for each
+    benchmark in either, and whether it got faster or slower by more than
+    tolerance (as a fraction).
+    """
+    names = sorted(set(old_results['benchmarks']) | set(new_results['benchmarks']))
+    rows = []
+    for name in names:
+        old = old_results['benchmarks'].get(name, {}).get('median', np.nan)
+        new = new_results['benchmarks'].get(name, {}).get('median', np.nan)
+        ratio = new / old
+        if ratio > 1 + tolerance:
+            change = 'slower'
+        elif ratio < 1 - tolerance:
+            change = 'faster'
+        else:
+            change = ''
+        rows.append({'benchmark': name, 'old': old, 'new': new, 'ratio': ratio, 'change': change})
+    return pd.DataFrame(rows, columns=['benchmark', 'old', 'new', 'ratio', 'change']).set_index('benchmark')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--data', default=default_data_dir_path, 
+            help="glob of .mat cell files")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', help="JSON file to save the results in")
+    parser.add_argument('--compare', help="JSON file of an earlier run to compare with")
+    args = parser.parse_args()
+
+    cells = load_cells(args.data, to_cache=False)
+    results = {'environment': environment(), 'benchmarks': run_benchmarks(cells, args.repeats)}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old_results = json.load(f)
+        print(compare(old_results, results).to_string())
+    else:
+        timings = pd.DataFrame(results['benchmarks']).T
+        print(timings.to_string())
+
+if __name__ == '__main__':
+    main()
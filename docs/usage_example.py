@@ -1,4 +1,7 @@
 from neurospyke.classify_cell import classify_cell
+from neurospyke.classify_cell import classify_cells
+from neurospyke.online import OnlineAnalyzer
+from neurospyke.online import replay_cell
 from neurospyke.plot_df_utils import D1_D3_scatter_subplots
 from neurospyke.query import Query
 from neurospyke.utils import concat_dfs_by_index 
@@ -73,3 +76,14 @@ D1_D3_scatter_subplots(example_cells_df, comparisons, 'EGTA',  output_path=outpu
 cell_to_classify = load_cell('docs/example_cells/082615-8.mat')
 cell_type = classify_cell(cell_to_classify, filepath=output_dir + 'example_classified_cell.png')
 print(f"Cell {cell_to_classify.calc_cell_name()} is Type {cell_type}")
+
+
+""" Classify all example cells at once """
+classification_df = classify_cells(example_cells)
+print(classification_df.groupby('cell_name')['cell_ID'].first())
+
+
+""" Analyze a cell's sweeps as if they were being recorded """
+online_analyzer = OnlineAnalyzer(response_criteria=[('curr_amplitude', '>0')])
+for row in replay_cell(cell_to_classify, chunk_size=2000, analyzer=online_analyzer):
+    print(f"sweep {row['sweep_index']}, {row['amplitude']} pA: {row['num_spikes']} spikes")
@@ -1,15 +1,7 @@
-# set up module defaults across project
+"""
+NeuroSpyke: analysis of electrophysiological recordings.
 
-import numpy as np
-print("Setting defaults for numpy")
-np.set_printoptions(precision=2, linewidth=40, suppress=True)
-
-import matplotlib as mpl
-print("Setting defaults for matplotlib") 
-mpl.use('TkAgg')
-mpl.rcParams['axes.spines.right'] = False
-mpl.rcParams['axes.spines.top'] = False
-
-import pandas as pd
-print("Settings defaults for pandas")
-pd.set_option('precision', 3)
+Importing the package has no side effects. Plot defaults are applied when
+something is first plotted (see plotting.pyplot), and the printing defaults
+for numpy and pandas can be set with plotting.set_display_options().
+"""
@@ -0,0 +1,213 @@
+"""
+In-memory caches of calculated properties (Response._cache and Cell._cache).
+All caches share a byte budget: entries of at least min_evictable_bytes (full
+traces such as dVdt_mV_per_ms, windowed dataframes) are evicted, least
+recently used first, when the caches together hold more than max_bytes of
+them. Smaller values (scalars, per-spike arrays) are cheap to keep and are
+never evicted. An evicted property is simply recalculated when it is used
+again.
+"""
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import sys
+import weakref
+
+def value_nbytes(value):
+    """
+    Returns an estimate of the memory used by a cached value.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(value_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_nbytes(item) for item in value.values())
+    if hasattr(value, 'cache_nbytes'):
+        # e.g. an averaged Response, which holds its own waveform
+        return value.cache_nbytes()
+    return sys.getsizeof(value)
+
+class CacheBudget(object):
+    """
+    Byte budget shared by PropertyCaches. Keeps the evictable entries of all
+    caches in least recently used order. max_bytes=None means no limit.
+    """
+    def __init__(self, max_bytes=None, min_evictable_bytes=100000):
+        self.max_bytes = max_bytes
+        self.min_evictable_bytes = min_evictable_bytes
+        self.nbytes = 0
+        self.evictions = 0
+        # (cache id, key) -> nbytes, least recently used first
+        self._entries = OrderedDict()
+        # cache id -> (weak reference to the cache, keys of its entries)
+        self._caches = {}
+
+    def is_evictable(self, nbytes):
+        return nbytes >= self.min_evictable_bytes
+
+    def add(self, cache, key, nbytes):
+        cache_id = id(cache)
+        if cache_id not in self._caches:
+            cache_ref = weakref.ref(cache, lambda ref, cache_id=cache_id: self.forget(cache_id))
+            self._caches[cache_id] = (cache_ref, set())
+        self.remove(cache, key)
+        self._entries[(cache_id, key)] = nbytes
+        self._caches[cache_id][1].add(key)
+        self.nbytes += nbytes
+        self.evict()
+
+    def touch(self, cache, key):
+        if (id(cache), key) in self._entries:
+            self._entries.move_to_end((id(cache), key))
+
+    def remove(self, cache, key):
+        nbytes = self._entries.pop((id(cache), key), None)
+        if nbytes is not None:
+            self.nbytes -= nbytes
+            self._caches[id(cache)][1].discard(key)
+
+    def forget(self, cache_id):
+        """
+        Drops the entries of a cache that has been garbage collected (e.g. the
+        cache of a response that is no longer used).
+        """
+        _, keys = self._caches.pop(cache_id, (None, set()))
+        for key in keys:
+            self.nbytes -= self._entries.pop((cache_id, key))
+
+    def evict(self):
+        """
+        Evicts least recently used entries until the budget is met.
+        """
+        while self.max_bytes is not None and self.nbytes > self.max_bytes and self._entries:
+            (cache_id, key), nbytes = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+            cache_ref, keys = self._caches[cache_id]
+            keys.discard(key)
+            cache = cache_ref()
+            if cache is not None:
+                cache.evict(key)
+            self.evictions += 1
+
+    def stats(self):
+        return {
+                'max_bytes': self.max_bytes,
+                'evictable_nbytes': self.nbytes,
+                'evictable_entries': len(self._entries),
+                'evictions': self.evictions}
+
+# Budget of all caches, unless a cache is given its own.
+default_budget = CacheBudget(max_bytes=512 * 2**20)
+
+def set_cache_budget(max_bytes=None, min_evictable_bytes=None):
+    """
+    Configures the budget shared by all caches; entries over a smaller
+    max_bytes are evicted right away.
+    """
+    default_budget.max_bytes = max_bytes
+    if min_evictable_bytes is not None:
+        default_budget.min_evictable_bytes = min_evictable_bytes
+    default_budget.evict()
+
+class PropertyCache(object):
+    """
+    Calculated properties by their full name, including __ args (e.g.
+    'dVdt_pct_APamp__20__rising'), with counts of hits and misses of
+    lookups, evictions and the bytes held.
+    """
+    def __init__(self, budget=None):
+        self.budget = default_budget if budget is None else budget
+        self._values = {}
+        self._nbytes = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        """
+        Caches are pickled along with cells sent to worker processes, where
+        they join the worker's default budget.
+        """
+        state = self.__dict__.copy()
+        state['budget'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.budget = default_budget
+        for key, nbytes in self._nbytes.items():
+            if self.budget.is_evictable(nbytes):
+                self.budget.add(self, key, nbytes)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, key):
+        self.budget.touch(self, key)
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def keys(self):
+        return self._values.keys()
+
+    def get(self, key, default=None):
+        if key in self._values:
+            return self[key]
+        return default
+
+    def lookup(self, key):
+        """
+        Returns (True, value) if key is cached, otherwise (False, None), and
+        counts the hit or miss.
+        """
+        if key in self._values:
+            self.hits += 1
+            return True, self[key]
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        nbytes = value_nbytes(value)
+        self._values[key] = value
+        self._nbytes[key] = nbytes
+        if self.budget.is_evictable(nbytes):
+            self.budget.add(self, key, nbytes)
+        else:
+            self.budget.remove(self, key)
+
+    def evict(self, key):
+        """
+        Drops key (called by the budget).
+        """
+        self._values.pop(key, None)
+        self._nbytes.pop(key, None)
+        self.evictions += 1
+
+    def clear(self):
+        for key in list(self._values):
+            self.budget.remove(self, key)
+        self._values = {}
+        self._nbytes = {}
+
+    def nbytes(self):
+        return sum(self._nbytes.values())
+
+    def stats(self):
+        """
+        Returns a dict with the number of entries, bytes held, hits, misses
+        and evictions of this cache.
+        """
+        return {
+                'entries': len(self._values),
+                'nbytes': self.nbytes(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
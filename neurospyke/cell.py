@@ -1,58 +1,294 @@
+from neurospyke.cache import PropertyCache
+from neurospyke.mat_file import read_mat_cell
+from neurospyke.plotting import pyplot
+from neurospyke.profiling import profile_stage
+from neurospyke.provenance import file_fingerprint
+from neurospyke.provenance import is_current
+from neurospyke.pulse_index import calc_pulse_index
+from neurospyke.pulse_index import criteria_mask
+from neurospyke.pulse_index import pulse_columns
 from neurospyke.response import Response
+from neurospyke.response import meets_condition
+from neurospyke.spike_index import SpikeIndex
 from neurospyke.sweep import Sweep
-import matplotlib.pyplot as plt
+from neurospyke.sweep_store import SweepStore
+import json
 import numpy as np
+import os
 import pandas as pd
-import scipy.io
 
 class Cell(object):
+    metadata_filename = 'cell.json'
+    descriptive_cell_properties = [
+            'genetic_marker', 
+            'ca_buffer', 
+            'mouse_genotype']
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, metadata=None, store_dir=None, fingerprint=None):
+        """
+        Creates a cell from a MATLAB file, or, when metadata is given, from a
+        cell saved in store_dir with self.save(). fingerprint identifies the
+        version of the MATLAB file the cell was read from.
+        """
         self.file_path = file_path
-        self.mat = scipy.io.loadmat(file_path)
-        self.cell = self.mat['Cell']
-        self.descriptive_cell_properties = [
-                'genetic_marker', 
-                'ca_buffer', 
-                'mouse_genotype']
-        self._cache = {}
+        self.store_dir = store_dir
+        self._sweep_store = None
+        self._fingerprint = fingerprint
+        if metadata is None:
+            self._fingerprint = file_fingerprint(file_path)
+            metadata, self._sweep_store = read_mat_cell(file_path)
+        self.metadata = metadata
+        self._cache = PropertyCache()
+        self._spike_index = None
+        self._pulse_index = None
+        self._pulse_index_sweeps = np.zeros(0, dtype=int)
+        self.property_store = None
+        self.profiler = None
+        # responses shared by the queries of Query.run_many, by pulse
+        self._response_memo = None
+
+    def __getstate__(self):
+        """
+        Cells are pickled to be sent to worker processes. The query is not
+        sent along, and a memory-mapped store is re-opened by the worker
+        rather than copied.
+        """
+        state = self.__dict__.copy()
+        state.pop('query', None)
+        state['_response_memo'] = None
+        if self.store_dir is not None:
+            state['_sweep_store'] = None
+        return state
+
+    @classmethod
+    def open(cls, store_dir):
+        """
+        Opens a cell saved with self.save(). Only the small metadata file is
+        read here; sweep arrays are memory mapped when first used.
+        """
+        with open(os.path.join(store_dir, cls.metadata_filename)) as f:
+            saved = json.load(f)
+        return cls(saved['file_path'], metadata=saved['metadata'], store_dir=store_dir, 
+                fingerprint=saved.get('fingerprint'))
+
+    @classmethod
+    def is_saved(cls, store_dir):
+        return os.path.isfile(os.path.join(store_dir, cls.metadata_filename))
+
+    def save(self, store_dir):
+        """
+        Saves sweep arrays as .npy files and the metadata as a JSON sidecar.
+        The sidecar is written last, so an interrupted save is not reused.
+        """
+        self.sweep_store().save(store_dir)
+        with open(os.path.join(store_dir, self.metadata_filename), 'w') as f:
+            json.dump({
+                'file_path': self.file_path, 
+                'fingerprint': self.fingerprint(),
+                'metadata': self.metadata}, f)
+
+    # cell properties that are only cached in memory, not in the property store
+    memory_only_properties = ('average_response', 'matching_responses')
 
     def calc_or_read_from_cache(self, attr_name_with_args):
         """
         This method either calculates the given attribute or gets it from the
-        cache if it has already been calculated.
+        cache if it has already been calculated. Calls are recorded if the
+        cell has a profiler (see Query.run(profile=True)).
         """
+        profiler = getattr(self, 'profiler', None)
+        if profiler is None:
+            return self._calc_or_read_from_cache(attr_name_with_args)
+        hit = self.is_in_cache(attr_name_with_args)
+        with profiler.property_call(self.calc_cell_name(), attr_name_with_args, hit):
+            return self._calc_or_read_from_cache(attr_name_with_args)
+
+    def cache_key(self, attr_name_with_args):
+        """
+        Calculated cell properties average the responses meeting the query's
+        criteria, so they are cached per criteria (a cell can be run with
+        several queries, see Query.run_many).
+        """
+        if getattr(self, 'query', None) is None:
+            return attr_name_with_args
+        return f"{attr_name_with_args}|{sorted(self.query.response_criteria)}"
+
+    def is_in_cache(self, attr_name_with_args):
+        return self.cache_key(attr_name_with_args) in self._cache
+
+    def _calc_or_read_from_cache(self, attr_name_with_args):
         attr_pieces = attr_name_with_args.split('__') 
         attr_name = attr_pieces[0]
         args = attr_pieces[1:]
 
-        if not attr_name in self._cache:
-            fn = getattr(self, f"calc_{attr_name}")
-            value = fn(*args)
-            self._cache[attr_name_with_args] = value
-        return self._cache[attr_name_with_args]
-
-    def debug_cache(self):
-        print(f"Cache has {len(self._cache)} items.")
-        for key, value in self._cache.items():
-            print(f"key: {key} value: {value}")
-
-    def valid_responses(self):
-        self.analyzed_sweep_ids = []
-        for sweep in self.sweeps():
-            for response in sweep.responses():
-                if response.meets_criteria():
-                    # save references to analyzed sweeps for later plot/analysis
-                    self.analyzed_sweep_ids.append(sweep.sweep_index())
-                    yield response
- 
+        cache_key = self.cache_key(attr_name_with_args)
+        found, value = self._cache.lookup(cache_key)
+        if not found:
+            store_key = self.property_store_key(attr_name_with_args)
+            found, value = (False, None) if store_key is None else self.property_store.get(store_key)
+            if not found:
+                fn = getattr(self, f"calc_{attr_name}")
+                value = fn(*args)
+                if store_key is not None:
+                    self.property_store.put(store_key, value)
+            self._cache.put(cache_key, value)
+        return value
+
+    def property_store_key(self, attr_name_with_args):
+        """
+        Returns the key of this cell property in the persistent property store,
+        or None if it is not stored. Calculated cell properties average the
+        responses meeting the query's criteria, so the criteria are part of the
+        key. The *_df properties depend on the query's property lists and are
+        not stored, nor are memory_only_properties.
+        """
+        if getattr(self, 'property_store', None) is None or self.fingerprint() is None:
+            return None
+        if attr_name_with_args.endswith('_df') or \
+                attr_name_with_args.startswith(self.memory_only_properties):
+            return None
+        response_criteria = sorted(self.query.response_criteria) if hasattr(self, 'query') else []
+        return self.property_store.key(self.fingerprint(), response_criteria, attr_name_with_args)
+
+    def fingerprint(self):
+        """
+        Returns the fingerprint of the cell's source file when the cell was
+        read from it (see provenance.file_fingerprint).
+        """
+        if getattr(self, '_fingerprint', None) is None:
+            self._fingerprint = file_fingerprint(self.file_path)
+        return self._fingerprint
+
+    def is_current(self, file_path=None):
+        """
+        Returns True if file_path (by default the cell's own source file) is
+        the file the cell was read from and it has not changed since. A file
+        that no longer exists is not current.
+        """
+        if file_path is None:
+            file_path = self.file_path
+        if os.path.abspath(file_path) != os.path.abspath(self.file_path):
+            return False
+        fingerprint = getattr(self, '_fingerprint', None)
+        if fingerprint is None:
+            # saved before fingerprints were recorded
+            return False
+        return is_current(fingerprint, file_path)
+
+    def cache_stats(self):
+        """
+        Returns a dict with the entries, bytes, hits, misses and evictions of
+        this cell's property cache.
+        """
+        return self._cache.stats()
+
+    def profile_stage(self, stage_name):
+        """
+        Returns a context manager that times a stage of the query run if the
+        cell has a profiler.
+        """
+        return profile_stage(getattr(self, 'profiler', None), stage_name)
+
+    def pulse_index(self, sweep_indices=None):
+        """
+        Returns a dataframe with one row per current injection of the given
+        sweeps (by default all sweeps of this cell), see
+        pulse_index.calc_pulse_index. Sweeps are indexed the first time they
+        are asked for, so sweeps no query selects are never read.
+        """
+        if sweep_indices is None:
+            sweep_indices = np.arange(self.nsweeps())
+        sweep_indices = np.unique(np.asarray(sweep_indices, dtype=int))
+        indexed_sweeps = getattr(self, '_pulse_index_sweeps', np.zeros(0, dtype=int))
+        missing_sweeps = np.setdiff1d(sweep_indices, indexed_sweeps)
+        if getattr(self, '_pulse_index', None) is None:
+            self._pulse_index = calc_pulse_index(self, missing_sweeps)
+            self._pulse_index_sweeps = missing_sweeps
+        elif len(missing_sweeps) > 0:
+            pulse_index = pd.concat([self._pulse_index, calc_pulse_index(self, missing_sweeps)])
+            self._pulse_index = pulse_index.sort_values(
+                    ['sweep_index', 'onset_pnt'], kind='mergesort').reset_index(drop=True)
+            self._pulse_index_sweeps = np.union1d(indexed_sweeps, missing_sweeps)
+
+        if len(self._pulse_index_sweeps) == len(sweep_indices):
+            return self._pulse_index
+        return self._pulse_index[np.isin(self._pulse_index['sweep_index'].values, sweep_indices)]
+
+    def query_sweep_indices(self, query=None):
+        """
+        Returns the sweeps meeting the sweep_time criteria of the query (by
+        default the cell's query; all sweeps if there are none), which are
+        the only sweeps it reads.
+        """
+        query = self.query if query is None else query
+        mask = np.ones(self.nsweeps(), dtype=bool)
+        for attr_name, condition in query.response_criteria:
+            if attr_name == 'sweep_time':
+                mask &= meets_condition(self.sweep_times(), condition)
+        return np.nonzero(mask)[0]
+
+    def calc_matching_responses(self):
+        """
+        Returns the responses meeting the query's response_criteria. Criteria
+        on pulse index columns are resolved for all pulses at once, so
+        Response objects are only created for pulses that meet them, and the
+        remaining criteria are checked on these. Like other cell properties,
+        the responses are cached per criteria, so they are selected once per
+        query, and properties calculated to check the criteria are not
+        calculated again when the responses are analyzed.
+        """
+        pulse_index = self.pulse_index(self.query_sweep_indices())
+        with self.profile_stage('criteria_filtering'):
+            mask, remaining_criteria = criteria_mask(pulse_index, self.query.response_criteria)
+            pulses = pulse_index.loc[mask, pulse_columns].to_records(index=False)
+            responses = [self.response(pulse) for pulse in pulses]
+            if remaining_criteria:
+                responses = [response for response in responses 
+                        if all(response.meets_criterion(criterion) for criterion in remaining_criteria)]
+        return responses
+
+    def valid_responses(self, sweep_ids=None):
+        """
+        Yields the responses meeting the query's response_criteria (see
+        calc_matching_responses). If sweep_ids is given, only responses of
+        these sweeps are yielded.
+        """
+        responses = self.calc_or_read_from_cache('matching_responses')
+        if sweep_ids is not None:
+            sweep_ids = set(sweep_ids)
+        for response in responses:
+            if sweep_ids is None or response.sweep.sweep_index() in sweep_ids:
+                yield response
+
+    def matching_sweep_ids(self):
+        """
+        Returns the sweep id of each response meeting the query's
+        response_criteria.
+        """
+        return [int(response.sweep.sweep_index()) 
+                for response in self.calc_or_read_from_cache('matching_responses')]
+
+    def response(self, pulse):
+        """
+        Returns the Response of a pulse (a row of the pulse index). While
+        several queries are run on the cell (see Query.run_many), a pulse
+        selected by more than one of them has a single Response, so its
+        properties are calculated once.
+        """
+        if getattr(self, '_response_memo', None) is None:
+            return Response(pulse, self.sweep(int(pulse['sweep_index'])))
+        key = (int(pulse['sweep_index']), int(pulse['onset_pnt']), int(pulse['offset_pnt']))
+        if key not in self._response_memo:
+            self._response_memo[key] = Response(pulse, self.sweep(key[0]))
+        return self._response_memo[key]
+
     def analyzed_sweeps(self):
         """
         Returns all sweeps analyzed for given query.
         """
         analyzed_sweeps = []
         for sweep_id in self.analyzed_sweep_ids:
-            analyzed_sweeps.append(Sweep(self.sweep_df(sweep_id), self))
+            analyzed_sweeps.append(self.sweep(sweep_id))
         return analyzed_sweeps
 
 ##########################################################################################
@@ -60,53 +296,60 @@ class Cell(object):
 ##########################################################################################
 
     def cell_property_names(self):
-        return self.descriptive_cell_properties + self.query.cell_properties
+        """
+        Returns the descriptive cell properties and the query's cell_properties,
+        each once (a descriptive property can also be a query cell property).
+        """
+        property_names = self.descriptive_cell_properties + self.query.cell_properties
+        return sorted(set(property_names), key=property_names.index)
+
+    def metadata_value(self, field):
+        """
+        Returns the value of a metadata field, or nan if the cell has no such field.
+        """
+        value = self.metadata.get(field, np.nan)
+        if isinstance(value, list):
+            return value[0]
+        return value
 
     def calc_cell_name(self):
-        return self.cell['name'][0, 0][0]
+        return self.metadata['name']
 
     def calc_genetic_marker(self):
-        try:
-            return self.cell['genetic_marker'][0,0][0]
-        except ValueError as e:
-            assert "no field of name genetic_marker" in str(e)
-            return np.nan
+        return self.metadata_value('genetic_marker')
 
     def calc_mouse_genotype(self):
-        try:
-            return self.cell['mouse_genotype'][0,0][0]
-        except ValueError as e:
-            assert "no field of name mouse_genotype" in str(e)
-            return np.nan
+        return self.metadata_value('mouse_genotype')
 
     def calc_ca_buffer(self):
-        return self.cell['CaBuffer'][0,0][0]
+        return self.metadata['CaBuffer']
 
     def calc_age(self):
-        try:
-            return self.cell['age'][0,0][0]
-        except ValueError as e:
-            assert "no field of name age" in str(e)
-            return np.nan
+        return self.metadata_value('age')
 
     def calc_experimenter(self):
-        try:
-            return self.cell['Experimenter'][0,0][0]
-        except ValueError as e:
-            assert "no field of name Experimenter" in str(e)
-            return np.nan
+        return self.metadata_value('Experimenter')
+
+    def sweep_store(self):
+        """
+        Returns the columnar SweepStore holding time, data and commands for
+        all sweeps of this cell.
+        """
+        if self._sweep_store is None:
+            self._sweep_store = SweepStore.open(self.store_dir)
+        return self._sweep_store
 
     def time(self):
-        return self.cell['time'][0,0].T
+        return self.sweep_store().time
 
     def data(self):
-        return self.cell['data'][0,0].T
+        return self.sweep_store().data
 
     def commands(self):
-        return self.cell['commands'][0, 0].T
+        return self.sweep_store().commands
 
     def nsweeps(self):
-        return np.shape(self.data())[0]
+        return self.sweep_store().nsweeps()
 
     def sweep_index_iter(self):
         return range(self.nsweeps())
@@ -115,29 +358,47 @@ class Cell(object):
         """
         Return time after cell break-in for each sweep (in seconds)
         """
-        return self.cell['sweep_time'][0, 0].flatten()
+        return self.sweep_store().sweep_times()
 
     def sweep_time(self, sweep_index):
-        return self.sweep_times()[sweep_index]
+        return self.sweep_store().sweep_time(sweep_index)
+
+    def spike_index(self, sweep_indices=None):
+        """
+        Returns the SpikeIndex of this cell, which includes at least the given
+        sweeps (by default all sweeps). Spikes are detected for all sweeps
+        that are not in the index yet at once.
+        """
+        if sweep_indices is None:
+            sweep_indices = np.arange(self.nsweeps())
+        sweep_indices = np.unique(np.asarray(sweep_indices, dtype=int))
+        if getattr(self, '_spike_index', None) is None:
+            self._spike_index = SpikeIndex.from_data(
+                    self.sweep_store().sweep_rows('data', sweep_indices), sweep_indices=sweep_indices)
+        else:
+            missing_sweeps = sweep_indices[~self._spike_index.has_sweeps(sweep_indices)]
+            if len(missing_sweeps) > 0:
+                self._spike_index = self._spike_index.merge(SpikeIndex.from_data(
+                    self.sweep_store().sweep_rows('data', missing_sweeps), sweep_indices=missing_sweeps))
+        return self._spike_index
 
     def sweep_df(self, sweep_index):
         """
-        Return specific values for given sweep# as a dataframe (time, data, commands).
+        Return specific values for given sweep# as a dataframe (time, data,
+        commands). Analysis code uses the zero-copy views of self.sweep()
+        instead; this is kept for plotting and inspection.
         """
-        time = self.time()[sweep_index,:]
-        data = self.data()[sweep_index,:]
-        commands = self.commands()[sweep_index,:]
-        sweep_time = self.sweep_time(sweep_index)
+        store = self.sweep_store()
         return pd.DataFrame(data = {
             'sweep_index':sweep_index,
-            'sweep_time':sweep_time,
-            'time':time,
-            'data':data, 
-            'commands':commands
+            'sweep_time':store.sweep_time(sweep_index),
+            'time':store.sweep_view('time', sweep_index),
+            'data':store.sweep_view('data', sweep_index), 
+            'commands':store.sweep_view('commands', sweep_index)
             })
 
     def sweep(self, sweep_index):
-        return Sweep(self.sweep_df(sweep_index), self)
+        return Sweep(cell=self, sweep_index=sweep_index)
 
     def sweeps(self):
         for i in self.sweep_index_iter():
@@ -153,16 +414,22 @@ class Cell(object):
         averaged response_properties data and the calculated cell_properties
         data.
         """
+        # save references to analyzed sweeps for later plot/analysis
+        self.analyzed_sweep_ids = self.matching_sweep_ids()
         return self.combine_dfs(
                 self.calc_cell_properties_df(),
                 self.calc_mean_response_properties_df())
 
     def response_properties_df(self):
-        df_list = [response.run() for response in self.valid_responses()]
+        df_list = []
+        for response in self.valid_responses():
+            with self.profile_stage('response_properties'):
+                df_list.append(response.run())
         if len(df_list) == 0:
             return None
         else:
-            return pd.concat(df_list)
+            with self.profile_stage('aggregation'):
+                return pd.concat(df_list)
 
     def calc_mean_response_properties_df(self):
         """
@@ -170,6 +437,9 @@ class Cell(object):
         all response_properties. It uses a dataframe that has one row per
         response.
         """
+        if self.query.response_property_spike_categories and not self.query.cell_criteria['rheobase']:
+            return self.spike_category_means_df()
+
         response_df = self.response_properties_df()
 
         if response_df is not None:
@@ -188,24 +458,50 @@ class Cell(object):
 
                 rheo_thresh_timing_idx = response_df['threshold_timing0'].argmax()
 
-                #TODO: make sure this will always overwrite
-                #self.analyzed_sweeps from self.valid_responses()
-
                 self.analyzed_sweep_ids = [rheo_thresh_timing_idx]
 
                 rheobase_df = response_df.loc[[rheo_thresh_timing_idx]]
                 rheobase_df.index = [self.calc_cell_name()]
                 return rheobase_df
             else:
-                mean_series = response_df.mean()
-                mean_response_df = pd.DataFrame(
-                        [list(mean_series.values)], columns=list(mean_series.index), 
-                        index=[self.calc_cell_name()]
-                        )
+                with self.profile_stage('aggregation'):
+                    mean_series = response_df.mean()
+                    mean_response_df = pd.DataFrame(
+                            [list(mean_series.values)], columns=list(mean_series.index), 
+                            index=[self.calc_cell_name()]
+                            )
                 return mean_response_df
         else: 
             return None
 
+    def spike_category_means_df(self):
+        """
+        Returns the same single row dataframe as
+        calc_mean_response_properties_df for a query with spike categories.
+        Each response only calculates the properties of its own spike count
+        (the others would be None), and responses are averaged in groups by
+        spike count, so there is no dataframe of mostly empty columns.
+        """
+        properties_by_num_spikes = self.query.spike_category_properties()
+        rows_by_num_spikes = {}
+        num_responses = 0
+        for response in self.valid_responses():
+            num_responses += 1
+            with self.profile_stage('response_properties'):
+                num_spikes = response.calc_or_read_from_cache('num_spikes')
+                if num_spikes in properties_by_num_spikes:
+                    rows_by_num_spikes.setdefault(num_spikes, []).append(
+                            response.calc_properties(properties_by_num_spikes[num_spikes]))
+        if num_responses == 0:
+            return None
+
+        with self.profile_stage('aggregation'):
+            mean_values = {}
+            for rows in rows_by_num_spikes.values():
+                mean_values.update(pd.DataFrame(rows).astype(float).mean().to_dict())
+            return pd.DataFrame([mean_values], columns=self.query.response_properties, 
+                    index=[self.calc_cell_name()])
+
     def calc_cell_properties_df(self):
         """
         Returns a single row dataframe with all Cell properties, including both
@@ -213,11 +509,42 @@ class Cell(object):
         """
         property_names = self.cell_property_names()
         property_dict = {}
-        for property_name in property_names:
-            property_dict[property_name] = self.calc_or_read_from_cache(property_name)
+        with self.profile_stage('cell_properties'):
+            for property_name in property_names:
+                property_dict[property_name] = self.calc_or_read_from_cache(property_name)
         cell_properties_df = pd.DataFrame(property_dict, index=[self.calc_cell_name()])
         return cell_properties_df[property_names] 
 
+    def added_properties_df(self, response_properties, cell_properties):
+        """
+        Returns a single row dataframe with only the given properties, for the
+        responses analyzed in an earlier run of the query
+        (self.analyzed_sweep_ids). This is used to add properties to a cached
+        query without selecting the responses again.
+        """
+        property_dict = {}
+        for property_name in cell_properties:
+            property_dict[property_name] = self.calc_or_read_from_cache(property_name)
+        cell_properties_df = pd.DataFrame(property_dict, index=[self.calc_cell_name()])
+
+        analyzed_sweep_ids = self.analyzed_sweep_ids
+        if not response_properties or not analyzed_sweep_ids:
+            return cell_properties_df[cell_properties]
+
+        response_df = pd.concat([response.run(response_properties) 
+                for response in self.valid_responses(sweep_ids=analyzed_sweep_ids)])
+        if self.query.cell_criteria['rheobase']:
+            # the single analyzed sweep is the rheobase response
+            response_df = response_df.loc[[analyzed_sweep_ids[0]]]
+        mean_series = response_df.mean()
+        mean_response_df = pd.DataFrame(
+                [list(mean_series.values)], columns=list(mean_series.index), 
+                index=[self.calc_cell_name()]
+                )
+        if not cell_properties:
+            return mean_response_df
+        return self.combine_dfs(cell_properties_df[cell_properties], mean_response_df)
+
     def combine_dfs(self, df1, df2):
         """
         This method returns a combined dataframe, with index values being cell names.
@@ -236,15 +563,26 @@ class Cell(object):
 
     def average_response(self, left_window = 100, right_window = 100):
         """
-        Takes a mean of response data for all responses meeting the
+        Returns the response averaged over all responses meeting the
         response_criteria, used to calculate properties which need an 'average'
-        waveform.
+        waveform. It is calculated once per criteria and window and cached, so
+        all sag/rebound properties share it (and the values calculated on it).
+        """
+        return self.calc_or_read_from_cache(
+                f"average_response__{int(left_window)}__{int(right_window)}")
+
+    def calc_average_response(self, left_window = 100, right_window = 100):
+        """
+        Takes a mean of response data for all responses meeting the
+        response_criteria. The windows are stacked into one array (padded with
+        nan if their lengths differ) and averaged at once.
         """
 
         left_window = int(left_window)
         right_window = int(right_window)
 
-        waveforms_list = []
+        windows = []
+        sweep_times = []
 
         consistency_dict = {}
 
@@ -262,14 +600,29 @@ class Cell(object):
             verify_consistency('onset_time', response.onset_time)
             verify_consistency('offset_time', response.offset_time)
 
-            window_df = response.window(left_window, right_window)
-            window_df['sweep_index'] = np.nan
-            waveforms_list.append(window_df)
-
-        windows_df = pd.concat(waveforms_list)
-
-        by_row_index = windows_df.groupby(windows_df.index)
-        window_df_means = by_row_index.mean()
+            window = response.window_slice(left_window, right_window)
+            time = response.time().values[window]
+            windows.append((time - time[0], response.data().values[window], 
+                response.commands().values[window]))
+            sweep_times.append(response.sweep.sweep_time())
+
+        if not windows:
+            raise Exception("No responses meeting the response_criteria to average")
+
+        # (windows x points x [time, data, commands])
+        npoints = max(len(time) for time, _, _ in windows)
+        stacked_windows = np.full((len(windows), npoints, 3), np.nan)
+        for i, window_columns in enumerate(windows):
+            for j, values in enumerate(window_columns):
+                stacked_windows[i, :len(values), j] = values
+        mean_windows = np.nanmean(stacked_windows, axis=0)
+
+        window_df_means = pd.DataFrame({
+            'sweep_index': np.nan,
+            'sweep_time': np.mean(sweep_times),
+            'time': mean_windows[:, 0],
+            'data': mean_windows[:, 1],
+            'commands': mean_windows[:, 2]})
  
         pts_per_ms = response.calc_points_per_ms()
         ms_per_pnt = response.calc_ms_per_point()
@@ -290,25 +643,25 @@ class Cell(object):
 ##########################################################################################
 
     def calc_sag_onset_time(self):
-        return self.average_response().calc_sag_onset_time()
+        return self.average_response().calc_or_read_from_cache('sag_onset_time')
 
     def calc_peak_sag_val(self):
-        return self.average_response().calc_peak_sag_val()
+        return self.average_response().calc_or_read_from_cache('peak_sag_val')
 
     def calc_sag_abs_amplitude(self):
-        return self.average_response().calc_sag_abs_amplitude()
+        return self.average_response().calc_or_read_from_cache('sag_abs_amplitude')
 
     def calc_sag_fit_amplitude(self):
-        return self.average_response().calc_sag_fit_amplitude()
+        return self.average_response().calc_or_read_from_cache('sag_fit_amplitude')
 
     def calc_reb_delta_t(self):
-        return self.average_response().calc_reb_delta_t()
+        return self.average_response().calc_or_read_from_cache('reb_delta_t')
 
     def calc_max_rebound_time(self, right_window=230):
-        return self.average_response(right_window=right_window).calc_max_rebound_time()
+        return self.average_response(right_window=right_window).calc_or_read_from_cache('max_rebound_time')
     
     def calc_max_rebound_val(self, right_window=230):
-        return self.average_response(right_window=right_window).calc_max_rebound_val()
+        return self.average_response(right_window=right_window).calc_or_read_from_cache('max_rebound_val')
 
 ##########################################################################################
 ###################################   PLOT   #############################################
@@ -316,6 +669,7 @@ class Cell(object):
 
     def sweep_plot_setup(self, filepath=None, ylim_commands=None, 
             ylim_output=None):
+        plt = pyplot()
 
         fig, (ax1, ax2) = plt.subplots(2, sharex=True)
 
@@ -345,9 +699,9 @@ class Cell(object):
         for fig, (ax1, ax2) in self.sweep_plot_setup(filepath, ylim_commands=ylim_commands, ylim_output=ylim_output):
             x_max = 0
             for sweep in sweeps:
-                ax1.plot(sweep.sweep_df.time, sweep.sweep_df.data)
-                ax2.plot(sweep.sweep_df.time, sweep.sweep_df.commands)
-                x_max = max([x_max, max(sweep.sweep_df.time)])
+                ax1.plot(sweep.time(), sweep.data())
+                ax2.plot(sweep.time(), sweep.commands())
+                x_max = max([x_max, max(sweep.time())])
             ax1.set_xlim([0, x_max])
             ax1.set_title(self.calc_cell_name())
     
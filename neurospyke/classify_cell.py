@@ -1,183 +1,243 @@
-from neurospyke.plot_df_utils import rgb_colors
 from neurospyke.query import Query
-from neurospyke.utils import concat_dfs_by_index 
-from neurospyke.utils import reorder_df 
-from scipy.stats import norm
-from sklearn.discriminant_analysis import LinearDiscriminantAnalysis as LDA
-import matplotlib.patches as patches
-import matplotlib.pyplot as plt
+from neurospyke.utils import concat_dfs_by_index
+from neurospyke.utils import reorder_df
 import numpy as np
+import os
 import pandas as pd
 
+lda_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# variables of the published classifier, in the order of the coefficients
+classifier_variables = ['reb_delta_t', 'sag_fit_amplitude',
+        'log_doublet_index_by_num_spikes',
+        'delta_thresh_last_spike',
+        'dVdt_pct_APamp_last_spike__20__rising']
+classifier_spike_counts = list(range(3, 9))
+
+# cells with a faster rebound are Type 2 and are not scored by the classifier
+type2_max_rebound_time = 90
+
+_lda_parameters = None
+
+def spike_count_variables(num_spikes):
+    """
+    Returns the mean_df columns of the classifier variables for responses
+    with num_spikes spikes.
+    """
+    return [variable + f'__{num_spikes}' if 'spike' in variable
+            else variable for variable in classifier_variables]
+
+def lda_parameters():
+    """
+    Returns the published classifier as a dataframe indexed by (ca_buffer,
+    num_spikes), with the LDA coefficients, intercept, the means and stds
+    used to standardize the variables (columns 'coef', 'mean' and 'std' of a
+    column MultiIndex), the D1 and D3 score distributions and the borders of
+    the exclusion zone. The CSV files are read once.
+    """
+    global _lda_parameters
+    if _lda_parameters is not None:
+        return _lda_parameters
+
+    def read_lda_csv(filename):
+        df = pd.read_csv(os.path.join(lda_data_dir, filename))
+        return df.set_index(['ca_buffer', 'num_spikes'])
+
+    coefficients = read_lda_csv("LDA_coefficients.csv")
+    parameters = pd.concat({
+        'coef': coefficients[classifier_variables],
+        'mean': read_lda_csv("LDA_mean_values.csv")[classifier_variables],
+        'std': read_lda_csv("LDA_std_values.csv")[classifier_variables]}, axis=1)
+    parameters['intercept'] = coefficients['intercept']
+
+    distributions = read_lda_csv("LDA_distributions.csv")
+    for genetic_marker in ['D1', 'D3']:
+        marker_distributions = distributions[distributions.genetic_marker == genetic_marker]
+        parameters[f'{genetic_marker}_mean'] = marker_distributions['mean']
+        parameters[f'{genetic_marker}_std'] = marker_distributions['std']
+
+    # scores between the borders of the exclusion zone are not classified
+    parameters['left_exclusion_border'] = np.minimum(
+            parameters['D1_mean'] - 1.64 * parameters['D1_std'], 0)
+    parameters['right_exclusion_border'] = np.maximum(
+            parameters['D3_mean'] + 1.64 * parameters['D3_std'], 0)
+
+    _lda_parameters = parameters
+    return _lda_parameters
+
+def classifier_df(cells):
+    """
+    Returns a dataframe with one row per cell with the variables of the
+    published classifier for every spike count and max_rebound_time. The
+    queries are run (or loaded from the cache) once for all cells.
+    """
+    if not isinstance(cells, list):
+        cells = [cells]
+
+    """ Run queries for 5 properties used in published classifier """
+    spike_query_kwargs = {
+        'response_criteria': [('sweep_time', '<150'), ('curr_duration', .3), ('curr_amplitude', '>0')],
+        'response_property_spike_categories': [
+            'log_doublet_index_by_num_spikes',
+            'delta_thresh_last_spike',
+            'dVdt_pct_APamp_last_spike__20__rising'
+            ]}
+
+    """ max_rebound_time (Type 2 check) uses the same responses as sag/rebound """
+    sag_reb_query_kwargs = {
+        'response_criteria': [('curr_duration', .12), ('curr_amplitude', -400)],
+        'cell_properties': ['reb_delta_t', 'sag_fit_amplitude', 'max_rebound_time']}
+
+    """ Both queries are run in one pass over the cells """
+    spike_query, sag_reb_query = Query.create_or_load_many_from_cache(
+            cells, [spike_query_kwargs, sag_reb_query_kwargs])
+
+    """ Combine resulting dataframes """
+    combined_df = concat_dfs_by_index(spike_query.mean_df, sag_reb_query.mean_df)
+    cell_df = reorder_df(combined_df, ['genetic_marker', 'ca_buffer'])
+
+    return cell_df
+
+def score_cells(cell_df):
+    """
+    Applies the published classifier to every cell of cell_df (see
+    classifier_df) and every spike count at once. Returns a tidy dataframe
+    with one row per cell and spike count, with the discriminant score, the
+    exclusion zone and the resulting type (1, 3 or nan). Scores are nan for
+    spike counts without responses.
+    """
+    cell_names = np.array(cell_df.index)
+    num_cells = len(cell_names)
+    num_counts = len(classifier_spike_counts)
+
+    # (cells x spike counts x variables), flattened to one row per cell and spike count
+    X = np.stack([cell_df.reindex(columns=spike_count_variables(num_spikes)).values.astype(float)
+        for num_spikes in classifier_spike_counts], axis=1)
+    X = X.reshape(num_cells * num_counts, len(classifier_variables))
+
+    scores_df = pd.DataFrame({
+        'cell_name': np.repeat(cell_names, num_counts),
+        'genetic_marker': np.repeat(cell_df['genetic_marker'].values, num_counts),
+        'ca_buffer': np.repeat(cell_df['ca_buffer'].values, num_counts),
+        'num_spikes': np.tile(classifier_spike_counts, num_cells)})
+
+    # parameters of each row's ca_buffer and spike count (nan for unknown buffers)
+    parameters = lda_parameters().reindex(
+            pd.MultiIndex.from_arrays([scores_df['ca_buffer'], scores_df['num_spikes']]))
+    Xs = (X - parameters['mean'].values) / parameters['std'].values
+    scores = -(np.sum(Xs * parameters['coef'].values, axis=1) + parameters['intercept'].values)
+
+    left_exclusion_border = parameters['left_exclusion_border'].values
+    right_exclusion_border = parameters['right_exclusion_border'].values
+    scores_df['score'] = scores
+    scores_df['left_exclusion_border'] = left_exclusion_border
+    scores_df['right_exclusion_border'] = right_exclusion_border
+    scores_df['spike_count_type'] = np.where(scores < left_exclusion_border, 3,
+            np.where(scores > right_exclusion_border, 1, np.nan))
+    scores_df['spike_count_ID'] = np.where(np.isnan(scores), "Unidentified (no sweep)",
+            np.where(np.isnan(scores_df['spike_count_type']), "Unidentified",
+                "Type " + scores_df['spike_count_type'].fillna(0).astype(int).astype(str)))
+    return scores_df
+
+def final_cell_type(spike_count_types, max_rebound_time):
+    """
+    Returns the type of a cell from the types of its spike counts: 2 if it
+    has a fast rebound, otherwise the type all classified spike counts agree
+    on (nan if they disagree or none was classified).
+    """
+    if max_rebound_time < type2_max_rebound_time:
+        return 2
+    cell_types = set(spike_count_types[~np.isnan(spike_count_types)])
+    if len(cell_types) == 1:
+        return int(cell_types.pop())
+    return np.nan
+
+def classify_cells(cells, plot=False, output_dir=None):
+    """
+    Classifies all cells with the published classifier. Returns the tidy
+    dataframe of score_cells, with the final cell_type and cell_ID of each
+    cell added to its rows. If plot, the scores of each cell are plotted
+    (see plot_classification), and saved to output_dir if it is given.
+    """
+    cell_df = classifier_df(cells)
+    scores_df = score_cells(cell_df)
+
+    max_rebound_times = cell_df['max_rebound_time'] if 'max_rebound_time' in cell_df \
+            else pd.Series(np.nan, index=cell_df.index)
+    cell_types = {cell_name: final_cell_type(
+        cell_scores['spike_count_type'].values, max_rebound_times[cell_name])
+        for cell_name, cell_scores in scores_df.groupby('cell_name', sort=False)}
+    scores_df['cell_type'] = scores_df['cell_name'].map(cell_types)
+    scores_df['cell_ID'] = np.where(np.isnan(scores_df['cell_type']), "Unidentified",
+            "Type " + scores_df['cell_type'].fillna(0).astype(int).astype(str))
+
+    if plot:
+        for cell_name, cell_scores in scores_df.groupby('cell_name', sort=False):
+            filepath = None if output_dir is None else os.path.join(output_dir, f"{cell_name}.png")
+            plot_classification(cell_scores, filepath=filepath)
+    return scores_df
+
 def classify_cell(cell_to_classify, plot=True, filepath=None):
-    
-    """ Check if cell is Type 2 """
-    response_criteria = [('curr_duration', .12), ('curr_amplitude', -400)]
-    calculated_cell_properties = ['max_rebound_time']
-    Type2_query = Query.create_or_load_from_cache(
-            [cell_to_classify],
-            response_criteria=response_criteria, 
-            cell_properties=calculated_cell_properties,
-            )
-    
-    if Type2_query.mean_df.max_rebound_time.values < 90:
-        cell_type = 2
-    
-    """ Get df with variables used for published classifier """
-    cell_df = classifier_df(cell_to_classify)
-    
-    """ Apply published classifier to this data """
-    LDA_coeff = pd.read_csv("neurospyke/data/LDA_coefficients.csv")
-    LDA_mean_values = pd.read_csv("neurospyke/data/LDA_mean_values.csv")
-    LDA_std_values = pd.read_csv("neurospyke/data/LDA_std_values.csv")
-    LDA_dist_values = pd.read_csv("neurospyke/data/LDA_distributions.csv")
-    
+    """
+    Classifies a single cell (see classify_cells) and returns its type.
+    """
+    scores_df = classify_cells([cell_to_classify])
+    if plot:
+        plot_classification(scores_df, filepath=filepath)
+    cell_type = scores_df['cell_type'].values[0]
+    return cell_type if np.isnan(cell_type) else int(cell_type)
+
+def plot_classification(cell_scores, filepath=None):
+    """
+    Plots the score of a cell (the rows of one cell in the output of
+    classify_cells) for every spike count on the D1 and D3 score
+    distributions that established the published classifier.
+    """
+    # plotting and distribution dependencies are only imported when plotting
+    from neurospyke.plot_df_utils import rgb_colors
+    from neurospyke.plotting import pyplot
+    from scipy.stats import norm
+    import matplotlib.patches as patches
+    plt = pyplot()
+
+    parameters = lda_parameters()
+    ca_buffer = cell_scores['ca_buffer'].values[0]
     fig = plt.figure()
-    i = 1
-    cell_type = []
-    def get_LDA_data(df):
-        ca_buffer_rows = df['ca_buffer']==ca_buffer
-        num_spikes_rows = df['num_spikes']==num_spikes
-        return df.loc[ca_buffer_rows & num_spikes_rows]
-
-    for num_spikes in range(3, 9):
-    
+    for i, row in enumerate(cell_scores.itertuples(), start=1):
         ax = fig.add_subplot(2, 3, i)
-    
-        all_variables = ['reb_delta_t', 'sag_fit_amplitude',
-                'log_doublet_index_by_num_spikes', 
-                'delta_thresh_last_spike', 
-                'dVdt_pct_APamp_last_spike__20__rising']
-    
-        current_variables = [variable + f'__{num_spikes}' if 'spike' in variable 
-                else variable for variable in all_variables]
-    
-        ca_buffer = cell_df['ca_buffer'].values[0]
-    
-         
-        lda_coeff = get_LDA_data(LDA_coeff)[all_variables].as_matrix()
-        lda_intercept = get_LDA_data(LDA_coeff)['intercept'].as_matrix()
-        lda_mean = get_LDA_data(LDA_mean_values)[all_variables].as_matrix()
-        lda_std = get_LDA_data(LDA_std_values)[all_variables].as_matrix()
-    
-        cell_vals = cell_df[['genetic_marker', 'ca_buffer'] + current_variables].copy()
-        cell_vals.dropna(inplace=True)
-        X = cell_vals[current_variables].as_matrix()
-    
-        # Get linear discriminant fit 
-        lda = LDA()
-        lda.coef_ = lda_coeff
-        lda.intercept_ = lda_intercept
-    
-        current_LDA_dist_values = LDA_dist_values[(LDA_dist_values.num_spikes == num_spikes) & 
-                (LDA_dist_values.ca_buffer == ca_buffer)]
-        D1_dist_mean = current_LDA_dist_values[current_LDA_dist_values.genetic_marker == 'D1']['mean']
-        D3_dist_mean = current_LDA_dist_values[current_LDA_dist_values.genetic_marker == 'D3']['mean']
-        D1_dist_std = current_LDA_dist_values[current_LDA_dist_values.genetic_marker == 'D1']['std']
-        D3_dist_std = current_LDA_dist_values[current_LDA_dist_values.genetic_marker == 'D3']['std']
-    
-        # plot the score distributions that established the published classifier
-        x_vals = np.arange(-10, 10, .01) 
-        ax.plot(x_vals, norm.pdf(x_vals, D1_dist_mean, D1_dist_std),color='k')
-        ax.plot(x_vals, norm.pdf(x_vals, D3_dist_mean, D3_dist_std), color=rgb_colors['dodgerblue'])
-    
-        # plot the decision boundary and exclusion zone
-        left_exclusion_border = D1_dist_mean.values - 1.64 * D1_dist_std.values
-        right_exclusion_border = D3_dist_mean.values + 1.64 * D3_dist_std.values
-        if left_exclusion_border > 0:
-            left_exclusion_border = 0
-    
-        if right_exclusion_border < 0:
-            right_exclusion_border = 0
-    
-        ax.axvline(x=0,color= 'r') 
-        patch = ax.add_patch(patches.Rectangle(
-            (left_exclusion_border, 0),
-            abs(left_exclusion_border - right_exclusion_border),
-            100)) 
-        patch.set_color('grey')
-        patch.set_zorder(0)
-    
-        if not cell_df[current_variables].isnull().values.any():
-            # if none of the current values are nan, classifier for current conditions:
-    
-            # standardize cell 
-            X = X.astype(float)
-            if ~np.isnan(X).any():
-                Xs = (X-lda_mean)/lda_std
-                discriminant_score = -lda.decision_function(Xs)
-            else:
-                discriminant_score = np.nan 
-    
+        if (ca_buffer, row.num_spikes) in parameters.index:
+            distributions = parameters.loc[(ca_buffer, row.num_spikes)]
+            # plot the score distributions that established the published classifier
+            x_vals = np.arange(-10, 10, .01)
+            ax.plot(x_vals, norm.pdf(x_vals, distributions['D1_mean'], distributions['D1_std']),
+                    color='k')
+            ax.plot(x_vals, norm.pdf(x_vals, distributions['D3_mean'], distributions['D3_std']),
+                    color=rgb_colors['dodgerblue'])
+
+            # plot the decision boundary and exclusion zone
+            ax.axvline(x=0,color= 'r')
+            patch = ax.add_patch(patches.Rectangle(
+                (row.left_exclusion_border, 0),
+                abs(row.left_exclusion_border - row.right_exclusion_border),
+                100))
+            patch.set_color('grey')
+            patch.set_zorder(0)
+
+        if not np.isnan(row.score):
             # plot the score of the current cell
-            ax.scatter(discriminant_score,  .2, edgecolors='r', s=50, color='None', zorder=6)
-    
-            if discriminant_score < left_exclusion_border:
-                cell_type.append(3)
-                cell_ID = "Type 3"
-            elif discriminant_score > right_exclusion_border:
-                cell_type.append(1)
-                cell_ID = "Type 3"
-            else:
-                cell_type.append(np.nan)
-                cell_ID = "Unidentified"
-        else:
-            cell_ID = "Unidentified (no sweep)"
-    
+            ax.scatter(row.score,  .2, edgecolors='r', s=50, color='None', zorder=6)
+
         ax.set_xlabel('score')
         ax.set_ylabel('probability')
         ax.set_xlim([-10, 8]); ax.set_ylim([0, .5])
-        ax.set_title(f"{num_spikes} APs: {cell_ID}")
-    
-        i +=1
-    
-    cell_type = [x for x in cell_type if not np.isnan(x)]
-    if len(set(cell_type)) > 1:
-        cell_type_final = np.nan
-        cell_ID_final = "Unidentified"
-    elif set(cell_type) == {1}:
-        cell_type_final = 1
-        cell_ID_final = "Type 1"
-    elif set(cell_type) == {3}:
-        cell_type_final = 3
-        cell_ID_final = "Type 3"
-
-    plt.suptitle(f"{cell_to_classify.calc_cell_name()}: {cell_ID_final}, {ca_buffer}", fontsize=15)
+        ax.set_title(f"{row.num_spikes} APs: {row.spike_count_ID}")
+
+    cell_name = cell_scores['cell_name'].values[0]
+    cell_ID = cell_scores['cell_ID'].values[0]
+    plt.suptitle(f"{cell_name}: {cell_ID}, {ca_buffer}", fontsize=15)
     fig.set_size_inches(18.5, 10.5, forward=True)
     if filepath:
         plt.savefig(filepath, bbox_inches="tight")
+        plt.close(fig)
     else:
         plt.show()
-
-    return cell_type_final 
-
-def classifier_df(cell_to_classify):
-    if cell_to_classify is not list:
-        cell_to_classify = [cell_to_classify]
-
-    """ Run queries for 5 properties used in published classifier """
-    response_criteria = [('sweep_time', '<150'), ('curr_duration', .3), ('curr_amplitude', '>0')]
-    response_property_spike_categories = [
-        'log_doublet_index_by_num_spikes', 
-        'delta_thresh_last_spike', 
-        'dVdt_pct_APamp_last_spike__20__rising'
-        ]
-    
-    spike_query = Query.create_or_load_from_cache(
-            cell_to_classify,
-            response_criteria=response_criteria,
-            response_property_spike_categories=response_property_spike_categories)
-    
-    response_criteria = [('curr_duration', .12), ('curr_amplitude', -400)]
-    calculated_cell_properties = ['reb_delta_t', 'sag_fit_amplitude'] 
-    sag_reb_query = Query.create_or_load_from_cache(
-            cell_to_classify, 
-            response_criteria=response_criteria, 
-            cell_properties=calculated_cell_properties,
-            )
-
-    """ Combine resulting dataframes """
-    combined_df = concat_dfs_by_index(spike_query.mean_df, sag_reb_query.mean_df)
-    cell_df = reorder_df(combined_df, ['genetic_marker', 'ca_buffer'])
-
-    return cell_df
@@ -0,0 +1,95 @@
+import numpy as np
+
+def exponential(x, a, b):
+    return a * np.exp(b*x)
+
+def goodness_of_fit(y, y_fit, mask=None):
+    """
+    Returns R^2 of each row of y_fit (only for points in mask).
+    """
+    y = np.atleast_2d(y)
+    if mask is None:
+        mask = np.ones(y.shape, dtype=bool)
+    y_mean = np.sum(y * mask, axis=1) / np.sum(mask, axis=1)
+    ss_res = np.sum(((y - y_fit) * mask) ** 2, axis=1)
+    ss_tot = np.sum(((y - y_mean[:, None]) * mask) ** 2, axis=1)
+    return 1 - (ss_res / ss_tot)
+
+def log_linear_guess(x, y, mask):
+    """
+    Closed form estimate of (a, b) in y = a * exp(b*x) for each row: a linear
+    regression of log|y| on x, weighted by y^2 so that points near zero (where
+    the log is noisy) count little.
+    """
+    sign = np.where(np.sum(y * mask, axis=1) < 0, -1.0, 1.0)
+    abs_y = y * sign[:, None]
+    weights = np.where(mask & (abs_y > 0), abs_y ** 2, 0)
+    log_y = np.log(np.where(weights > 0, abs_y, 1))
+
+    sum_w = np.sum(weights, axis=1)
+    sum_wx = np.sum(weights * x, axis=1)
+    sum_wy = np.sum(weights * log_y, axis=1)
+    sum_wxx = np.sum(weights * x * x, axis=1)
+    sum_wxy = np.sum(weights * x * log_y, axis=1)
+
+    b = (sum_w * sum_wxy - sum_wx * sum_wy) / (sum_w * sum_wxx - sum_wx ** 2)
+    log_a = (sum_wy - b * sum_wx) / sum_w
+    return sign * np.exp(log_a), b
+
+def fit_exponentials(x, y, mask=None, max_iterations=200, tolerance=1e-12):
+    """
+    Least squares fit of y = a * exp(b*x) to every row of the 2-D x and y
+    arrays at once (only points in mask are used). Starts from
+    log_linear_guess and refines all rows together with Levenberg-Marquardt
+    steps, each solving the 2x2 normal equations in closed form. Returns
+    arrays of a and b.
+    """
+    x = np.atleast_2d(np.asarray(x, dtype=float))
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    if mask is None:
+        mask = np.ones(y.shape, dtype=bool)
+    x = np.where(mask, x, 0)
+    y = np.where(mask, y, 0)
+
+    def sum_sq_residuals(a, b):
+        return np.sum(((y - exponential(x, a[:, None], b[:, None])) * mask) ** 2, axis=1)
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        _, b = log_linear_guess(x, y, mask)
+        b = np.where(np.isfinite(b), b, 0)
+        # for a given b, the best a is a linear least squares solution
+        exp_bx = np.exp(b[:, None] * x) * mask
+        a = np.sum(y * exp_bx, axis=1) / np.sum(exp_bx ** 2, axis=1)
+
+        cost = sum_sq_residuals(a, b)
+        damping = np.full(len(a), 1e-3)
+        done = np.zeros(len(a), dtype=bool)
+        for _ in range(max_iterations):
+            exp_bx = np.exp(b[:, None] * x) * mask
+            residuals = (y - a[:, None] * exp_bx) * mask
+            jac_a = exp_bx
+            jac_b = a[:, None] * x * exp_bx
+
+            g_aa = np.sum(jac_a ** 2, axis=1)
+            g_bb = np.sum(jac_b ** 2, axis=1)
+            g_ab = np.sum(jac_a * jac_b, axis=1)
+            r_a = np.sum(jac_a * residuals, axis=1)
+            r_b = np.sum(jac_b * residuals, axis=1)
+
+            h_aa = g_aa * (1 + damping)
+            h_bb = g_bb * (1 + damping)
+            det = h_aa * h_bb - g_ab ** 2
+            new_a = a + (h_bb * r_a - g_ab * r_b) / det
+            new_b = b + (h_aa * r_b - g_ab * r_a) / det
+            new_cost = sum_sq_residuals(new_a, new_b)
+
+            improved = ~done & np.isfinite(new_cost) & (new_cost < cost)
+            converged = improved & (cost - new_cost <= tolerance * cost)
+            a = np.where(improved, new_a, a)
+            b = np.where(improved, new_b, b)
+            cost = np.where(improved, new_cost, cost)
+            damping = np.where(improved, damping / 10, damping * 10)
+            done |= converged | (damping > 1e16)
+            if np.all(done):
+                break
+    return a, b
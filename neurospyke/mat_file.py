@@ -0,0 +1,134 @@
+"""
+Reading of the 'Cell' struct of MATLAB files. Per-cell metadata and sweep
+times are read eagerly. In v7.3 (HDF5) files, sweep arrays are read lazily,
+one sweep (a contiguous row of the HDF5 dataset) at a time. v5 files are
+zlib compressed per variable, so they cannot be read per sweep; only the
+'Cell' variable is read from them, and saving the cell (see Cell.save) makes
+later loads lazy.
+"""
+from neurospyke.sweep_store import SweepStore
+import numpy as np
+
+def is_hdf5_mat(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read(10) == b'MATLAB 7.3'
+
+def mat_cell_metadata(mat_cell):
+    """
+    Returns a dict with all non-sweep fields of a MATLAB 'Cell' struct (name,
+    CaBuffer, genetic_marker, ...), with strings as str and numbers as lists.
+    """
+    metadata = {}
+    for field in mat_cell.dtype.names:
+        if field in SweepStore.columns or field == 'sweep_time':
+            continue
+        value = mat_cell[field][0, 0]
+        if value.size == 0:
+            continue
+        if value.dtype.kind in 'US':
+            metadata[field] = str(value[0])
+        else:
+            metadata[field] = value.flatten().tolist()
+    return metadata
+
+def hdf5_cell_metadata(cell_group):
+    """
+    Returns the same dict as mat_cell_metadata for the 'Cell' group of a v7.3
+    file. MATLAB saves strings as uint16 character codes.
+    """
+    metadata = {}
+    for field, dataset in cell_group.items():
+        if field in SweepStore.columns or field == 'sweep_time':
+            continue
+        if not hasattr(dataset, 'dtype') or dataset.attrs.get('MATLAB_empty', 0):
+            continue
+        if dataset.dtype.kind not in 'biuf':
+            continue
+        value = dataset[()]
+        matlab_class = dataset.attrs.get('MATLAB_class', b'')
+        if isinstance(matlab_class, bytes):
+            matlab_class = matlab_class.decode()
+        if matlab_class == 'char':
+            metadata[field] = ''.join(chr(code) for code in value.flatten())
+        else:
+            metadata[field] = value.flatten().tolist()
+    return metadata
+
+def read_mat_cell(file_path):
+    """
+    Returns the metadata dict and the SweepStore of the 'Cell' struct of a
+    MATLAB file.
+    """
+    if is_hdf5_mat(file_path):
+        import h5py
+        with h5py.File(file_path, 'r') as f:
+            cell_group = f['Cell']
+            metadata = hdf5_cell_metadata(cell_group)
+            sweep_times = cell_group['sweep_time'][()].flatten()
+        store = SweepStore(
+                time=LazySweepArray(file_path, 'Cell/time'),
+                data=LazySweepArray(file_path, 'Cell/data'),
+                commands=LazySweepArray(file_path, 'Cell/commands'),
+                sweep_times=sweep_times)
+        return metadata, store
+
+    import scipy.io
+    mat_cell = scipy.io.loadmat(file_path, variable_names=['Cell'])['Cell']
+    return mat_cell_metadata(mat_cell), SweepStore.from_mat_cell(mat_cell)
+
+class LazySweepArray(object):
+    """
+    A (sweeps x points) array in a v7.3 MATLAB file (MATLAB's points x sweeps
+    array, transposed by HDF5) that reads sweeps only when they are used.
+    Sweeps that have been read are kept, so each sweep is read once.
+    """
+    def __init__(self, file_path, dataset_name):
+        self.file_path = file_path
+        self.dataset_name = dataset_name
+        self._file = None
+        self._rows = {}
+        dataset = self.dataset()
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_rows'] = {}
+        return state
+
+    def dataset(self):
+        if self._file is None:
+            import h5py
+            self._file = h5py.File(self.file_path, 'r')
+        return self._file[self.dataset_name]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, sweep_index):
+        if isinstance(sweep_index, (int, np.integer)):
+            sweep_index = int(sweep_index)
+            if sweep_index not in self._rows:
+                self._rows[sweep_index] = self.dataset()[sweep_index]
+            return self._rows[sweep_index]
+        return self.rows(np.arange(self.shape[0])[sweep_index])
+
+    def rows(self, sweep_indices):
+        """
+        Returns a 2-D array with the given sweeps, reading those that have not
+        been read yet in one pass.
+        """
+        sweep_indices = np.asarray(sweep_indices, dtype=int)
+        missing = np.array(sorted(set(sweep_indices.tolist()) - set(self._rows)), dtype=int)
+        if len(missing) > 0:
+            # h5py reads a list of rows if it is increasing
+            for sweep_index, row in zip(missing, self.dataset()[missing.tolist()]):
+                self._rows[int(sweep_index)] = row
+        if len(sweep_indices) == 0:
+            return np.zeros((0, self.shape[1]), dtype=self.dtype)
+        return np.stack([self._rows[int(sweep_index)] for sweep_index in sweep_indices])
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.rows(np.arange(self.shape[0]))
+        return values if dtype is None else values.astype(dtype)
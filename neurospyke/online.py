@@ -0,0 +1,278 @@
+"""
+Analysis of sweeps while they are being recorded. Samples of the current
+sweep are fed in chunks of any size; current pulses (command steps) and spike
+points (-10 mV crossings) are found incrementally, with the state needed
+across chunk boundaries (last command value, unpaired step, last voltage
+sample) carried over. As soon as a pulse has ended, its properties are
+calculated by a Response on the samples recorded so far, so the features
+are those of the offline analysis of the saved sweep.
+"""
+from neurospyke.response import Response
+from neurospyke.spike_index import SPIKE_THRESHOLD
+from neurospyke.spike_index import detect_crossings
+import numpy as np
+import pandas as pd
+
+default_online_properties = ['num_spikes', 'threshold_vals', 'APmax_vals', 'AHP_vals',
+        'dVdt_pct_APamp__20__rising']
+
+class SampleBuffer(object):
+    """
+    Growing 1-D array of samples, with capacity doubled as needed so that
+    appending chunks takes amortized constant time per sample.
+    """
+    def __init__(self, capacity=4096):
+        self._values = np.empty(capacity)
+        self.size = 0
+
+    def append(self, chunk):
+        chunk = np.asarray(chunk, dtype=float).ravel()
+        needed = self.size + len(chunk)
+        if needed > len(self._values):
+            values = np.empty(max(needed, 2 * len(self._values)))
+            values[:self.size] = self._values[:self.size]
+            self._values = values
+        self._values[self.size:needed] = chunk
+        self.size = needed
+
+    def values(self):
+        return self._values[:self.size]
+
+class StreamingSweep(object):
+    """
+    The sweep currently being recorded, with the sweep interface used by
+    Response (time, data, commands, sweep_index, sweep_time). Columns hold
+    the samples received so far, without copying them.
+    """
+    def __init__(self, sweep_index, sweep_time=np.nan):
+        self._sweep_index = sweep_index
+        self._sweep_time = sweep_time
+        self.cell = None
+        self.buffers = {'time': SampleBuffer(), 'data': SampleBuffer(), 'commands': SampleBuffer()}
+
+    def npoints(self):
+        return self.buffers['data'].size
+
+    def column(self, name):
+        return pd.Series(self.buffers[name].values(), name=name, copy=False)
+
+    def time(self):
+        return self.column('time')
+
+    def data(self):
+        return self.column('data')
+
+    def commands(self):
+        return self.column('commands')
+
+    def sweep_index(self):
+        return self._sweep_index
+
+    def sweep_time(self):
+        return self._sweep_time
+
+class OnlineAnalyzer(object):
+    """
+    Analyzes sweeps as their samples arrive. Call start_sweep() before each
+    sweep, feed() with each chunk of samples, and end_sweep() when the sweep
+    is done. feed() and end_sweep() return a dict of response properties
+    (expanded as in Response.calc_properties) for each pulse that has ended
+    in the samples received, along with its current injection parameters.
+
+    Pulses are found as in detect_current_injections: the sweep must start
+    at 0, and a pair of command steps is a pulse only if the second step
+    undoes the first. Only pulses meeting all response_criteria are
+    analyzed. A pulse is analyzed once emit_delay_ms of samples past its
+    offset have been received (at least one sample, so that dV/dt at the
+    offset is the same as for the whole sweep); properties of the
+    response after the offset (e.g. the rebound) need a longer delay.
+    """
+    def __init__(self, response_properties=None, response_criteria=None, emit_delay_ms=0,
+            thresh=SPIKE_THRESHOLD):
+        if response_properties is None:
+            response_properties = default_online_properties
+        self.response_properties = response_properties
+        self.response_criteria = [] if response_criteria is None else response_criteria
+        self.emit_delay_ms = emit_delay_ms
+        self.thresh = thresh
+        self.rows = []
+        self.sweep = None
+        self._next_sweep_index = 0
+
+    def start_sweep(self, sweep_index=None, sweep_time=np.nan):
+        """
+        Starts a new sweep (by default numbered after the previous one). A
+        sweep that has not been ended is ended first.
+        """
+        if self.sweep is not None:
+            self.end_sweep()
+        if sweep_index is None:
+            sweep_index = self._next_sweep_index
+        self._next_sweep_index = sweep_index + 1
+        self.sweep = StreamingSweep(sweep_index, sweep_time)
+        # carried over between chunks
+        self._last_command = None
+        self._num_valid_commands = 0
+        self._unpaired_step = None
+        self._last_data_point = None
+        self._spike_points = []
+        self._pending_pulses = []
+
+    def feed(self, time, data, commands):
+        """
+        Adds a chunk of samples to the current sweep. Returns the rows of the
+        pulses that can be analyzed with the samples received so far.
+        """
+        assert self.sweep is not None, "start_sweep() must be called before feed()"
+        data = np.asarray(data, dtype=float).ravel()
+        commands = np.asarray(commands, dtype=float).ravel()
+        assert len(time) == len(data) == len(commands), "chunk columns differ in length"
+        if len(data) == 0:
+            return []
+
+        first_pnt = self.sweep.npoints()
+        self.sweep.buffers['time'].append(time)
+        self.sweep.buffers['data'].append(data)
+        self.sweep.buffers['commands'].append(commands)
+
+        self.find_spike_points(first_pnt, data)
+        self.find_pulses(commands)
+        return self.emit_rows(self.emit_delay_points())
+
+    def end_sweep(self):
+        """
+        Ends the current sweep. Returns the rows of the pulses that have not
+        been analyzed yet.
+        """
+        if self.sweep is None:
+            return []
+        assert self._unpaired_step is None, "sweep ended during a current pulse"
+        rows = self.emit_rows(delay_points=-1)
+        self.sweep = None
+        return rows
+
+    def find_spike_points(self, first_pnt, data):
+        """
+        Finds the -10 mV crossings of a chunk, including a crossing between
+        the last point of the previous chunk and the first point of this one.
+        """
+        if self._last_data_point is None:
+            _, crossings = detect_crossings(data, self.thresh)
+        else:
+            _, crossings = detect_crossings(np.append(self._last_data_point, data), self.thresh)
+            first_pnt -= 1
+        if len(crossings) > 0:
+            self._spike_points.append(crossings + first_pnt)
+        self._last_data_point = data[-1]
+
+    def find_pulses(self, commands):
+        """
+        Finds the command steps of a chunk, comparing every non-nan point
+        with the previous non-nan point (of this or an earlier chunk), and
+        pairs them up into pulses.
+        """
+        valid = ~np.isnan(commands)
+        if not np.any(valid):
+            return
+        valid_commands = commands[valid]
+        if self._last_command is None:
+            assert valid_commands[0] == 0, "sweep must start with a command of 0"
+            self._last_command = 0.
+        # position of each point among the non-nan points of the sweep
+        valid_pnts = self._num_valid_commands + np.arange(len(valid_commands))
+        delta_curr = np.diff(np.append(self._last_command, valid_commands))
+        self._last_command = valid_commands[-1]
+        self._num_valid_commands += len(valid_commands)
+
+        for step in np.nonzero(delta_curr)[0]:
+            step_pnt = valid_pnts[step]
+            if self._unpaired_step is None:
+                self._unpaired_step = (step_pnt, delta_curr[step], valid_commands[step])
+                continue
+            onset_pnt, onset_delta, amplitude = self._unpaired_step
+            self._unpaired_step = None
+            if onset_delta == -delta_curr[step]:
+                self._pending_pulses.append({'onset_pnt': onset_pnt, 'offset_pnt': step_pnt,
+                    'amplitude': amplitude})
+
+    def emit_delay_points(self):
+        if not self._pending_pulses:
+            return 0
+        time = self.sweep.buffers['time'].values()
+        points_per_ms = int(round(1/((time[1] - time[0]) * 1000))) if len(time) > 1 else 0
+        return max(int(self.emit_delay_ms * points_per_ms), 1)
+
+    def emit_rows(self, delay_points):
+        """
+        Analyzes the pending pulses with at least delay_points samples past
+        their offset (all pending pulses if delay_points is negative).
+        """
+        rows = []
+        npoints = self.sweep.npoints()
+        while self._pending_pulses and (delay_points < 0 or
+                npoints > self._pending_pulses[0]['offset_pnt'] + delay_points):
+            row = self.analyze_pulse(self._pending_pulses.pop(0))
+            if row is not None:
+                rows.append(row)
+        self.rows.extend(rows)
+        return rows
+
+    def pulse_spike_points(self, onset_pnt, offset_pnt):
+        """
+        Returns the spike points found so far with onset_pnt < point < offset_pnt.
+        """
+        if len(self._spike_points) > 1:
+            self._spike_points = [np.concatenate(self._spike_points)]
+        points = self._spike_points[0] if self._spike_points else np.array([], dtype=int)
+        start = np.searchsorted(points, onset_pnt, side='right')
+        stop = np.searchsorted(points, offset_pnt, side='left')
+        return points[start:stop]
+
+    def analyze_pulse(self, pulse):
+        """
+        Returns the row of a pulse, or None if it does not meet the
+        response_criteria.
+        """
+        time = self.sweep.buffers['time'].values()
+        curr_inj_params = dict(pulse,
+                onset_time=time[pulse['onset_pnt']],
+                offset_time=time[pulse['offset_pnt']])
+        response = Response(curr_inj_params, self.sweep)
+        # the crossings found while the pulse was recorded
+        response._cache.put('spike_points',
+                self.pulse_spike_points(pulse['onset_pnt'], pulse['offset_pnt']))
+        for criterion in self.response_criteria:
+            if not response.meets_criterion(criterion):
+                return None
+
+        row = {'sweep_index': self.sweep.sweep_index(), 'sweep_time': self.sweep.sweep_time()}
+        row.update(curr_inj_params)
+        row.update(response.calc_properties(self.response_properties))
+        return row
+
+    def results_df(self):
+        """
+        Returns a dataframe with all rows emitted so far, indexed by sweep.
+        """
+        return pd.DataFrame(self.rows).set_index('sweep_index') if self.rows else pd.DataFrame()
+
+def replay_cell(cell, sweep_indices=None, chunk_size=1000, analyzer=None):
+    """
+    Feeds the saved sweeps of a cell to an OnlineAnalyzer in chunks of
+    chunk_size points, as they would arrive during acquisition. Yields the
+    rows of each pulse as soon as they are emitted.
+    """
+    if analyzer is None:
+        analyzer = OnlineAnalyzer()
+    if sweep_indices is None:
+        sweep_indices = range(cell.nsweeps())
+    store = cell.sweep_store()
+    for sweep_index in sweep_indices:
+        analyzer.start_sweep(sweep_index, cell.sweep_time(sweep_index))
+        time = store.sweep_view('time', sweep_index)
+        data = store.sweep_view('data', sweep_index)
+        commands = store.sweep_view('commands', sweep_index)
+        for start in range(0, len(data), chunk_size):
+            stop = start + chunk_size
+            yield from analyzer.feed(time[start:stop], data[start:stop], commands[start:stop])
+        yield from analyzer.end_sweep()
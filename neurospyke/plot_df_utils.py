@@ -1,7 +1,8 @@
 from inflection import humanize
-import matplotlib.pyplot as plt
+from neurospyke.plotting import pyplot
 
 def D1_D3_scatter_subplots(df, xy_pairs, ca_buffer,  output_path=None):
+    plt = pyplot()
     number_of_subplots = len(xy_pairs)
     columns = 2
     rows = number_of_subplots%columns + number_of_subplots//columns
@@ -26,6 +27,7 @@ def D1_D3_scatter_plot(df, x_property, y_property, ca_buffer,  output_dir=None,
     Scatter plot of y_property vs. x_property with cells grouped by whether
     genetic marker is D1 or D3
     """
+    plt = pyplot()
     D1_cells = df[(df['genetic_marker'] == 'D1') & (df['ca_buffer'] == ca_buffer)]
     D3_cells = df[(df['genetic_marker'] == 'D3') & (df['ca_buffer'] == ca_buffer)]
 
@@ -0,0 +1,24 @@
+"""
+Matplotlib is only imported when something is plotted, so that the analysis
+modules can be imported (and run) without matplotlib or a display.
+"""
+
+def pyplot():
+    """
+    Returns matplotlib.pyplot, with the package's plot defaults applied. The
+    backend is left to matplotlib (e.g. the MPLBACKEND environment variable).
+    """
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    mpl.rcParams['axes.spines.right'] = False
+    mpl.rcParams['axes.spines.top'] = False
+    return plt
+
+def set_display_options():
+    """
+    Sets the package's defaults for printing numpy arrays and pandas dataframes.
+    """
+    import numpy as np
+    import pandas as pd
+    np.set_printoptions(precision=2, linewidth=40, suppress=True)
+    pd.set_option('display.precision', 3)
@@ -0,0 +1,118 @@
+from contextlib import contextmanager
+import pandas as pd
+import time
+
+@contextmanager
+def null_stage():
+    yield
+
+def profile_stage(profiler, stage_name):
+    """
+    Returns a context manager that times a stage with profiler, or does
+    nothing if profiler is None.
+    """
+    if profiler is None:
+        return null_stage()
+    return profiler.stage(stage_name)
+
+class Profiler(object):
+    """
+    Records where the time of a query run goes: for every property (per
+    cell) the number of calc_or_read_from_cache calls, cache hits and misses
+    and the cumulative time, and the time of each stage of the run (load,
+    pulse_detection, criteria_filtering, response_properties,
+    cell_properties, aggregation). Nested calls are also recorded as call
+    stacks, which can be saved in the collapsed format used by flamegraph
+    tools.
+    """
+    def __init__(self):
+        # (cell_name, property_name) -> [calls, hits, misses, cumulative_time]
+        self.property_records = {}
+        # stage -> cumulative time
+        self.stage_times = {}
+        # 'frame;frame;...' -> time spent in the last frame itself
+        self.stack_times = {}
+        self._stack = []
+
+    @contextmanager
+    def frame(self, name):
+        """
+        Times the enclosed block as a frame of the current call stack. Yields
+        a dict, in which 'elapsed' is set when the block is done.
+        """
+        frame = {'name': name, 'children_time': 0, 'elapsed': None}
+        self._stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield frame
+        finally:
+            elapsed = time.perf_counter() - start
+            frame['elapsed'] = elapsed
+            stack_name = ';'.join(stack_frame['name'] for stack_frame in self._stack)
+            self.stack_times[stack_name] = (self.stack_times.get(stack_name, 0) +
+                    elapsed - frame['children_time'])
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]['children_time'] += elapsed
+
+    @contextmanager
+    def stage(self, stage_name):
+        with self.frame(stage_name) as frame:
+            yield
+        self.stage_times[stage_name] = self.stage_times.get(stage_name, 0) + frame['elapsed']
+
+    @contextmanager
+    def property_call(self, cell_name, property_name, hit):
+        with self.frame(property_name) as frame:
+            yield
+        record = self.property_records.setdefault((cell_name, property_name), [0, 0, 0, 0])
+        record[0] += 1
+        record[1 if hit else 2] += 1
+        record[3] += frame['elapsed']
+
+    def merge(self, other):
+        """
+        Adds the records of another profiler (e.g. of a cell run in a worker
+        process) to this one.
+        """
+        for key, other_record in other.property_records.items():
+            record = self.property_records.setdefault(key, [0, 0, 0, 0])
+            for i, value in enumerate(other_record):
+                record[i] += value
+        for stage_name, stage_time in other.stage_times.items():
+            self.stage_times[stage_name] = self.stage_times.get(stage_name, 0) + stage_time
+        for stack_name, stack_time in other.stack_times.items():
+            self.stack_times[stack_name] = self.stack_times.get(stack_name, 0) + stack_time
+
+    def property_table(self, by_cell=False):
+        """
+        Returns a dataframe with calls, hits, misses and cumulative_time (in
+        seconds, including nested properties) per property, or per cell and
+        property if by_cell, slowest first.
+        """
+        columns = ['calls', 'hits', 'misses', 'cumulative_time']
+        index = pd.MultiIndex.from_tuples(list(self.property_records.keys()),
+                names=['cell', 'property'])
+        table = pd.DataFrame(list(self.property_records.values()), index=index, columns=columns)
+        if not by_cell:
+            table = table.groupby(level='property').sum()
+        return table.sort_values('cumulative_time', ascending=False)
+
+    def stage_table(self):
+        """
+        Returns a dataframe with the cumulative time (in seconds) of each stage.
+        """
+        table = pd.DataFrame({'cumulative_time': pd.Series(self.stage_times)})
+        return table.sort_values('cumulative_time', ascending=False)
+
+    def collapsed_stacks(self):
+        """
+        Returns the call stacks as lines of 'frame;frame;... microseconds',
+        the input format of flamegraph.pl and speedscope.
+        """
+        return [f"{stack_name} {int(round(stack_time * 1e6))}"
+                for stack_name, stack_time in sorted(self.stack_times.items())]
+
+    def save_collapsed_stacks(self, path):
+        with open(path, 'w') as f:
+            f.write('\n'.join(self.collapsed_stacks()) + '\n')
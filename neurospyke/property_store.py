@@ -0,0 +1,74 @@
+from neurospyke.provenance import ANALYSIS_VERSION
+import hashlib
+import numpy as np
+import os
+import pickle
+import sqlite3
+
+class PropertyStore(object):
+    """
+    Persistent store of calculated property values, shared by all queries.
+    Values are stored under a hash of everything they depend on (e.g. the
+    cell file fingerprint, sweep, pulse onset/offset and the property name
+    with its __ args, plus the analysis version), so any query reuses the
+    values of earlier queries. Each value is committed when it is put, so
+    the database is never left locked between calculations (e.g. for other
+    worker processes, or for properties calculated outside Query.run).
+    """
+    # large intermediates (e.g. a dVdt trace) are cheap to recompute and are not stored
+    max_value_size = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            # with a write-ahead log, readers are not blocked by a writer and
+            # commits are cheap enough to commit every value
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS properties (key TEXT PRIMARY KEY, value BLOB)")
+        return self._connection
+
+    @staticmethod
+    def key(*key_parts):
+        key_parts = (ANALYSIS_VERSION,) + key_parts
+        return hashlib.sha256(
+                '|'.join(str(part) for part in key_parts).encode()).hexdigest()
+
+    def is_storable(self, value):
+        if isinstance(value, np.ndarray):
+            return value.size <= self.max_value_size
+        if isinstance(value, (tuple, list)):
+            return all(self.is_storable(item) for item in value)
+        return True
+
+    def get(self, key):
+        """
+        Returns (True, value) if key is in the store, otherwise (False, None).
+        """
+        row = self.connection().execute(
+                "SELECT value FROM properties WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False, None
+        return True, pickle.loads(row[0])
+
+    def put(self, key, value):
+        if self.is_storable(value):
+            connection = self.connection()
+            with connection:
+                connection.execute(
+                        "INSERT OR REPLACE INTO properties (key, value) VALUES (?, ?)",
+                        (key, pickle.dumps(value)))
+
+    def __len__(self):
+        return self.connection().execute("SELECT COUNT(*) FROM properties").fetchone()[0]
@@ -0,0 +1,38 @@
+import hashlib
+import os
+
+# Bump when a change to the analysis code changes calculated values, so that
+# cached properties and queries from older code are not reused.
+ANALYSIS_VERSION = 1
+
+# Content hashes read the whole file, so by default files are identified by
+# size and modification time only.
+hash_file_contents = False
+
+def file_fingerprint(path, content_hash=None):
+    """
+    Returns a cheap fingerprint (name, size and modification time, and the
+    sha256 of the contents if content_hash) of a file, or None if the file
+    does not exist.
+    """
+    if content_hash is None:
+        content_hash = hash_file_contents
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    fingerprint = f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    if content_hash:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        fingerprint += f":sha256={h.hexdigest()}"
+    return fingerprint
+
+def is_current(fingerprint, path):
+    """
+    Returns True if the file at path still has the given fingerprint (False
+    if it no longer exists).
+    """
+    return file_fingerprint(path, content_hash=':sha256=' in fingerprint) == fingerprint
@@ -0,0 +1,105 @@
+from neurospyke.response import meets_condition
+import numpy as np
+import pandas as pd
+
+pulse_columns = ['sweep_index', 'onset_pnt', 'offset_pnt', 'onset_time', 'offset_time', 'amplitude']
+
+def detect_current_injections(commands, time, sweep_indices=None):
+    """
+    Finds the symmetrical square current pulses of all rows of a 2-D (sweeps
+    x points) commands array at once. As for a single sweep, nan points are
+    dropped before taking differences (so onset/offset points count only
+    non-nan points), each sweep must start at 0 and have an even number of
+    command steps, and a pair of steps is a pulse only if the second step
+    undoes the first. Returns a structured array with the fields of
+    pulse_columns, ordered by sweep and onset.
+    """
+    commands = np.atleast_2d(commands)
+    time = np.atleast_2d(time)
+    nrows, npoints = commands.shape
+    if sweep_indices is None:
+        sweep_indices = np.arange(nrows)
+    sweep_indices = np.asarray(sweep_indices)
+    assert np.all(commands[:, 0] == 0)
+
+    # compare every non-nan point with the previous non-nan point
+    float_commands = commands.astype(float)
+    valid = ~np.isnan(float_commands)
+    fill_idx = np.where(valid, np.arange(npoints), 0)
+    np.maximum.accumulate(fill_idx, axis=1, out=fill_idx)
+    filled = float_commands[np.arange(nrows)[:, None], fill_idx]
+    delta_curr = np.zeros_like(filled)
+    delta_curr[:, 1:] = np.diff(filled, axis=1)
+
+    rows, step_pnts = np.nonzero(delta_curr)
+    num_commands = np.bincount(rows, minlength=nrows)
+    assert np.all(num_commands % 2 == 0) # should have even number of command steps 
+
+    # steps pair up within each sweep, as every sweep has an even number of them
+    onset_rows = rows[0::2]; onset_pnts = step_pnts[0::2]; offset_pnts = step_pnts[1::2]
+    symmetric = delta_curr[onset_rows, onset_pnts] == -delta_curr[onset_rows, offset_pnts]
+    onset_rows = onset_rows[symmetric]
+    onset_pnts = onset_pnts[symmetric]; offset_pnts = offset_pnts[symmetric]
+
+    # position of each point among the non-nan points of its sweep
+    valid_position = np.cumsum(valid, axis=1) - 1
+    onsets = valid_position[onset_rows, onset_pnts]
+    offsets = valid_position[onset_rows, offset_pnts]
+
+    pulses = np.zeros(len(onsets), dtype=[
+        ('sweep_index', sweep_indices.dtype),
+        ('onset_pnt', int),
+        ('offset_pnt', int),
+        ('onset_time', time.dtype),
+        ('offset_time', time.dtype),
+        ('amplitude', commands.dtype)])
+    pulses['sweep_index'] = sweep_indices[onset_rows]
+    pulses['onset_pnt'] = onsets
+    pulses['offset_pnt'] = offsets
+    pulses['onset_time'] = time[onset_rows, onsets]
+    pulses['offset_time'] = time[onset_rows, offsets]
+    pulses['amplitude'] = commands[onset_rows, onset_pnts]
+    return pulses
+
+def calc_pulse_index(cell, sweep_indices=None):
+    """
+    Returns a dataframe with one row per current injection of the given
+    sweeps of the cell (by default all sweeps). Along with the current
+    injection parameters used to create a Response, each row has the values
+    of the response properties that are cheap to get for all pulses at once
+    (sweep_time, curr_duration, curr_amplitude, num_spikes).
+    """
+    if sweep_indices is None:
+        sweep_indices = np.arange(cell.nsweeps())
+    store = cell.sweep_store()
+    pulses = detect_current_injections(
+            store.sweep_rows('commands', sweep_indices), 
+            store.sweep_rows('time', sweep_indices),
+            sweep_indices)
+    pulse_index = pd.DataFrame.from_records(pulses, columns=pulse_columns)
+
+    pulse_sweep_indices = pulse_index['sweep_index'].values
+    pulse_index['sweep_time'] = cell.sweep_times()[pulse_sweep_indices]
+    pulse_index['curr_duration'] = pulse_index['offset_time'] - pulse_index['onset_time']
+    pulse_index['curr_amplitude'] = pulse_index['amplitude']
+    pulse_index['num_spikes'] = cell.spike_index(sweep_indices).count_between(
+            pulse_sweep_indices,
+            pulse_index['onset_pnt'].values,
+            pulse_index['offset_pnt'].values)
+    return pulse_index
+
+def criteria_mask(pulse_index, response_criteria):
+    """
+    Resolves all response criteria on properties that are columns of the
+    pulse index as one vectorized boolean mask. Returns the mask and the list
+    of criteria that still have to be checked on individual responses.
+    """
+    mask = np.ones(len(pulse_index.index), dtype=bool)
+    remaining_criteria = []
+    for criterion in response_criteria:
+        attr_name, condition = criterion
+        if attr_name in pulse_index.columns:
+            mask &= meets_condition(pulse_index[attr_name].values, condition)
+        else:
+            remaining_criteria.append(criterion)
+    return mask, remaining_criteria
@@ -1,17 +1,73 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from neurospyke.cell import Cell
+from neurospyke.profiling import Profiler
+from neurospyke.profiling import profile_stage
+from neurospyke.property_store import PropertyStore
+from neurospyke.provenance import ANALYSIS_VERSION
+from neurospyke.query_store import QueryStore
 from neurospyke.utils import query_cache_dir
+import copy
+import glob
 import hashlib
 import numpy as np
 import os
 import pandas as pd
-import pickle
+
+# spike counts of the properties a spike category expands to
+spike_category_counts = list(range(3, 9))
+
+def run_cell(cell, query):
+    """
+    Runs query on a single cell. Returns the one row dataframe for the cell,
+    the sweep ids it analyzed and, if the query is profiled, the Profiler of
+    the cell. This is a module level function so that it can be sent to
+    worker processes.
+    """
+    cell.query = query
+    cell.property_store = query.property_store
+    if getattr(query, 'profiler', None) is None:
+        cell.profiler = None
+        cell_df = cell.run()
+    else:
+        cell.profiler = Profiler()
+        with cell.profiler.frame(cell.calc_cell_name()):
+            with cell.profile_stage('load'):
+                cell.sweep_store()
+            with cell.profile_stage('pulse_detection'):
+                cell.pulse_index(cell.query_sweep_indices())
+            cell_df = cell.run()
+    profiler, cell.profiler = cell.profiler, None
+    return cell_df, cell.analyzed_sweep_ids, profiler
+
+def run_cell_queries(cell, queries):
+    """
+    Runs several queries on a single cell in one pass and returns the
+    run_cell result of each query. The sweeps selected by any of the queries
+    are read and indexed together, and a pulse selected by several queries
+    has a single Response shared by them, so properties of the pulse needed
+    by more than one query (e.g. its spikes) are calculated once.
+    """
+    sweep_indices = [cell.query_sweep_indices(query) for query in queries]
+    cell.pulse_index(np.unique(np.concatenate(sweep_indices)))
+    cell._response_memo = {}
+    try:
+        return [run_cell(cell, query) for query in queries]
+    finally:
+        cell._response_memo = None
 
 class Query(object):
     def __init__(self, cells, 
             response_criteria=None, response_properties=None, 
             response_property_spike_categories=None,
-            cell_criteria=None, cell_properties=None):
+            cell_criteria=None, cell_properties=None, property_store_path=None):
 
         self.cells = cells
+        self._mean_df = None
+        self.result_store = None
+        self.profiler = None
+        # if a store is given, values calculated by any earlier query using it are read from it
+        self.property_store = None if property_store_path is None else PropertyStore(property_store_path)
 
         self.response_criteria = response_criteria or {}
         self.response_properties = response_properties or []
@@ -25,13 +81,50 @@ class Query(object):
         self.validate_parameters()   
         self.process_log_parameter_names()
 
+    @property
+    def mean_df(self):
+        """
+        The query results, with one row per cell. For a query loaded from the
+        cache they are read from its QueryStore when first used.
+        """
+        if self._mean_df is None and self.result_store is not None:
+            self._mean_df = self.result_store.read_df()
+        return self._mean_df
+
+    @mean_df.setter
+    def mean_df(self, mean_df):
+        self._mean_df = mean_df
+
+    def read_columns(self, columns):
+        """
+        Returns only the given columns of mean_df. For a query loaded from the
+        cache, only these columns are read.
+        """
+        if self._mean_df is None and self.result_store is not None:
+            return self.result_store.read_df(columns)
+        return self.mean_df[columns]
+
     def calc_response_properties_from_spike_categories(self, spike_categories):
         calc_response_properties = []
         for property_name in spike_categories:
-            for num_spikes in range(3, 9):
+            for num_spikes in spike_category_counts:
                 calc_response_properties.append(f"{property_name}__{num_spikes}")
         return calc_response_properties
 
+    def spike_category_properties(self):
+        """
+        Returns a dict with, for each spike count, the response_properties
+        that spike categories expand to for that count (e.g. 5:
+        ['delta_thresh_last_spike__5', ...]). A response only has values for
+        the properties of its own spike count.
+        """
+        properties_by_num_spikes = {}
+        if self.response_property_spike_categories:
+            for property_name in self.response_properties:
+                num_spikes = int(property_name.split('__')[-1])
+                properties_by_num_spikes.setdefault(num_spikes, []).append(property_name)
+        return properties_by_num_spikes
+
     def process_log_parameter_names(self):
          
         def get_log_properties(property_list):
@@ -57,54 +150,268 @@ class Query(object):
             self.response_properties = self.calc_response_properties_from_spike_categories(
                     self.response_property_spike_categories)
 
+    def load_from_cache(self):
+        """
+        Returns the cached query with the same cells and parameters as this
+        query, or None if there is none or some of its cells have changed.
+        """
+        if not os.path.isfile(self.query_cache_filename()):
+            return None
+        query = self.load_query(self.query_cache_filename(), self.property_store)
+        if len(self.reusable_cell_names(query)) != len(self.cells):
+            return None
+        query.cells = self.cells
+        query.restore_analyzed_sweep_ids()
+        return query
+
     @classmethod
     def create_or_load_from_cache(cls, cells, overwrite=False,  **kwargs):
         """ 
         Make an instance of a query to have access to its instance methods.
         This will be the actual query object used if not in the cache.
+
+        If no query with these exact cells and properties is cached, but one
+        with the same criteria is cached for some of the cells and a subset of
+        the properties, only the missing cells and the missing properties of
+        the cached cells are analyzed and merged into the cached results.
+        Cached results of cells whose .mat file has changed since they were
+        cached are not reused.
         """
         tmp_query = cls(cells, **kwargs)
-        path_exists =  os.path.isfile(tmp_query.query_cache_filename())
-        if overwrite or not path_exists:
+        query = None if overwrite else tmp_query.load_from_cache()
+        if query is not None:
+            print(f"Loading query from cache")
+            return query
+
+        cached_query = None if overwrite else tmp_query.find_cached_query()
+        if cached_query is None:
             print(f"Making new query")
             tmp_query.run()
-            tmp_query.save_query()
-            return tmp_query
-        else: 
-            print(f"Loading query from cache")
-            query = cls.load_query(tmp_query.query_cache_filename())
-            query.cells = cells
+        else:
+            print(f"Extending cached query")
+            tmp_query.run_incremental(cached_query)
+        tmp_query.save_query()
+        return tmp_query
 
-            for cell in query.cells:
-                cell.query = query
-                cell.analyzed_sweep_ids = query.analyzed_sweeps_dict[cell.calc_cell_name()]
-            return query
+    @classmethod
+    def create_or_load_many_from_cache(cls, cells, kwargs_list, overwrite=False):
+        """
+        Returns one query per dict of query parameters in kwargs_list, like
+        create_or_load_from_cache. Queries that are neither cached nor an
+        extension of a cached query are run together in one pass over the
+        cells (see run_many).
+        """
+        queries = []
+        new_queries = []
+        for kwargs in kwargs_list:
+            tmp_query = cls(cells, **kwargs)
+            query = None if overwrite else tmp_query.load_from_cache()
+            if query is None:
+                query = tmp_query
+                cached_query = None if overwrite else tmp_query.find_cached_query()
+                if cached_query is None:
+                    new_queries.append(tmp_query)
+                else:
+                    print(f"Extending cached query")
+                    tmp_query.run_incremental(cached_query)
+                    tmp_query.save_query()
+            else:
+                print(f"Loading query from cache")
+            queries.append(query)
+
+        if new_queries:
+            print(f"Making {len(new_queries)} new queries")
+            cls.run_many(new_queries)
+            for query in new_queries:
+                query.save_query()
+        return queries
+
+    @staticmethod
+    def run_many(queries, workers=None, executor=None):
+        """
+        Runs several queries over the same cells in a single pass: each cell
+        is loaded once, its pulses are detected once for the sweeps of all
+        queries, each query's criteria are evaluated on these shared pulses,
+        and responses selected by more than one query share their calculated
+        properties. Returns the mean_df of each query, identical to running
+        the queries one by one.
+        """
+        cells = queries[0].cells
+        cell_names = [cell.calc_cell_name() for cell in cells]
+        for query in queries:
+            assert [cell.calc_cell_name() for cell in query.cells] == cell_names, \
+                    "run_many needs queries over the same cells"
+            query.profiler = None
+
+        if executor is None and (workers is None or workers <= 1):
+            cell_results = [run_cell_queries(cell, queries) for cell in cells]
+        else:
+            worker_queries = [query.worker_query() for query in queries]
+            if executor is not None:
+                cell_results = list(executor.map(run_cell_queries, cells, repeat(worker_queries)))
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    cell_results = list(executor.map(
+                        run_cell_queries, cells, repeat(worker_queries)))
 
-    def run(self): 
+        for i, query in enumerate(queries):
+            query.set_mean_df([results[i][0] for results in cell_results])
+            query.analyzed_sweeps_dict = {cell_name: results[i][1]
+                    for cell_name, results in zip(cell_names, cell_results)}
+            query.cell_fingerprints = query.create_cell_fingerprints_dict()
+        # cells are left with the last query, as after running the queries one by one
+        for cell, results in zip(cells, cell_results):
+            cell.query = queries[-1]
+            cell.analyzed_sweep_ids = results[-1][1]
+        return [query.mean_df for query in queries]
+
+    def run(self, workers=None, executor=None, profile=False): 
         """
         This method returns a dataframe with averaged Cell data for
         reponse_properties and cell_properties. Response_properties are
         calculated at the level of the individual response, and averaged at the
         Cell level, while cell_properties are calculated at the level of the
         cell.
+
+        Cells are analyzed independently, so with workers > 1 (or a given
+        concurrent.futures executor) they are spread across a process pool.
+        The results are identical to a serial run.
+
+        With profile=True, self.profiler records the calls and time of every
+        property and stage (see profiling.Profiler).
         """
-        mean_df=pd.DataFrame()
-        column_names = []
+        self.profiler = Profiler() if profile else None
+        df_list = self.run_cells(self.cells, workers, executor)
+        with profile_stage(self.profiler, 'aggregation'):
+            self.set_mean_df(df_list)
+        self.analyzed_sweeps_dict = self.create_analyzed_sweeps_dict()
+        self.cell_fingerprints = self.create_cell_fingerprints_dict()
+        return self.mean_df 
+
+    def run_incremental(self, cached_query, workers=None, executor=None):
+        """
+        Returns the same dataframe as self.run(), reusing the results of a
+        cached query with the same criteria and a subset of the properties.
+        Cells that are not in cached_query are analyzed fully. For cached
+        cells only the missing properties are calculated, and only for the
+        responses in cached_query.analyzed_sweeps_dict. Cached cells that are
+        not in this query are dropped, and cells whose .mat file has changed
+        are analyzed again. Columns are in the order of a full run.
+        """
+        cached_sweeps_dict = cached_query.analyzed_sweeps_dict
+        reusable_cell_names = self.reusable_cell_names(cached_query)
+        cached_cells = [cell for cell in self.cells 
+                if cell.calc_cell_name() in reusable_cell_names]
+        new_cells = [cell for cell in self.cells 
+                if cell.calc_cell_name() not in reusable_cell_names]
+
+        added_response_properties = [property_name for property_name in self.response_properties
+                if property_name not in cached_query.response_properties]
+        # descriptive properties are in every cached row
+        added_cell_properties = [property_name for property_name in self.cell_properties
+                if property_name not in cached_query.cell_properties + Cell.descriptive_cell_properties]
+
+        for cell in cached_cells:
+            cell.query = self
+            cell.analyzed_sweep_ids = cached_sweeps_dict[cell.calc_cell_name()]
+        cached_names = [cell.calc_cell_name() for cell in cached_cells]
+        cached_df = cached_query.mean_df.loc[cached_names]
+
+        if added_response_properties or added_cell_properties:
+            added_dfs = [cell.added_properties_df(added_response_properties, added_cell_properties) 
+                    for cell in cached_cells]
+            if added_dfs:
+                cached_df = pd.concat([cached_df, pd.concat(added_dfs)], axis=1)
+        df_list = [cached_df]
+        df_list += self.run_cells(new_cells, workers, executor)
+
+        self.set_mean_df(df_list)
+        self.analyzed_sweeps_dict = self.create_analyzed_sweeps_dict()
+        self.cell_fingerprints = self.create_cell_fingerprints_dict()
+        return self.mean_df
+
+    def run_cells(self, cells, workers=None, executor=None):
+        """
+        Runs the query on the given cells and returns their one row dataframes
+        (in the order of cells).
+        """
+        cell_results = self.map_run_cell(cells, workers, executor)
         df_list = []
-        for cell in self.cells: 
+        for cell, (cell_df, analyzed_sweep_ids, profiler) in zip(cells, cell_results):
             cell.query = self
-            cell_df = cell.run()
+            cell.analyzed_sweep_ids = analyzed_sweep_ids
             df_list.append(cell_df)
-            if len(cell_df.columns) > len(column_names):
-                column_names = cell_df.columns
+            if profiler is not None:
+                self.profiler.merge(profiler)
+        return df_list
+
+    def map_run_cell(self, cells, workers=None, executor=None):
+        """
+        Returns a list of run_cell results in the order of cells.
+        """
+        if executor is None and (workers is None or workers <= 1):
+            return [run_cell(cell, self) for cell in cells]
+
+        query = self.worker_query()
+        if executor is not None:
+            return list(executor.map(run_cell, cells, repeat(query)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run_cell, cells, repeat(query)))
+
+    def worker_query(self):
+        """
+        Returns a copy of the query to send to worker processes, which only
+        need the query parameters, not every cell of the query.
+        """
+        query = copy.copy(self)
+        query.cells = None
+        return query
+
+    def set_mean_df(self, df_list):
+        """
+        Combines one row dataframes into mean_df, with one row per cell in the
+        order of self.cells and columns in the order of ordered_columns, and
+        adds the requested "log" columns.
+        """
         mean_df = pd.concat(df_list)
+        cell_names = [cell.calc_cell_name() for cell in self.cells]
 
         # added to query so that can be accessed with re-loaded query
-        self.mean_df = mean_df[column_names]
+        self.mean_df = mean_df.loc[cell_names, self.ordered_columns(mean_df.columns)]
         self.process_log_parameter_values()
-        self.analyzed_sweeps_dict = self.create_analyzed_sweeps_dict()
-        return self.mean_df 
-    
+
+    def ordered_columns(self, columns):
+        """
+        Returns columns in a fixed order, whichever responses and cells they
+        came from (and whether they were calculated in one run or added to a
+        cached query): descriptive cell properties in the order of
+        Cell.descriptive_cell_properties, then cell_properties,
+        response_properties and "log" columns, each in the order of the
+        query, with the columns of an array property (e.g. APmax_vals0,
+        APmax_vals1, ...) in the order of its items.
+        """
+        descriptive_properties = Cell.descriptive_cell_properties
+        properties = self.cell_properties + self.response_properties
+        log_columns = ['log_' + property_name 
+                for property_name in self.log_response_properties + self.log_cell_properties]
+
+        def column_position(column):
+            if column in descriptive_properties:
+                return -1, descriptive_properties.index(column)
+            if column in log_columns:
+                return len(properties) + log_columns.index(column), -1
+            matches = [i for i, property_name in enumerate(properties) 
+                    if column == property_name or (column.startswith(property_name) 
+                        and column[len(property_name):].isdigit())]
+            if not matches:
+                # any other column (none in a query run) goes last
+                return len(properties) + len(log_columns), -1
+            i = max(matches, key=lambda i: len(properties[i]))
+            item = column[len(properties[i]):]
+            return i, int(item) if item else -1
+
+        return sorted(columns, key=column_position)
+
     def process_log_parameter_values(self):
         """
         Adds a column to mean_df with the log of each requested "log" property 
@@ -123,12 +430,49 @@ class Query(object):
         analyzed_sweeps_dict = dict(zip(cell_names, analyzed_sweep_ids))
         return analyzed_sweeps_dict
 
-    def query_properties(self):
+    def create_cell_fingerprints_dict(self):
         """
-        Returns a string that has all parameters that can be used to create a query.
+        Stores the fingerprint of the .mat file of each cell in the query, so a
+        re-loaded query can tell which cells have changed since.
+        """
+        return {cell.calc_cell_name(): cell.fingerprint() for cell in self.cells}
+
+    def reusable_cell_names(self, cached_query):
+        """
+        Returns the names of the cells of this query whose results in
+        cached_query are still valid: the cell is in cached_query and its
+        .mat file has not changed since.
+        """
+        cached_fingerprints = getattr(cached_query, 'cell_fingerprints', {})
+        return set(cell.calc_cell_name() for cell in self.cells 
+                if cell.calc_cell_name() in cached_fingerprints and 
+                cached_fingerprints[cell.calc_cell_name()] == cell.fingerprint())
+
+    def restore_analyzed_sweep_ids(self):
+        """
+        Sets the query and analyzed sweep ids of each cell from a re-loaded query.
+        """
+        for cell in self.cells:
+            cell.query = self
+            cell.analyzed_sweep_ids = self.analyzed_sweeps_dict[cell.calc_cell_name()]
+
+    def criteria_properties(self):
+        """
+        Returns a string with the criteria of the query. Cached queries with
+        the same criteria can be extended to other cells and properties.
         """
         cell_criteria = sorted(list(self.cell_criteria.items()))
         response_criteria = sorted(self.response_criteria)
+
+        return f"""analysis_version: {ANALYSIS_VERSION};
+        cell_criteria: {cell_criteria};
+        response_criteria: {response_criteria};
+        """
+
+    def query_properties(self):
+        """
+        Returns a string that has all parameters that can be used to create a query.
+        """
         cell_properties = sorted(self.cell_properties)
         response_properties = sorted(self.response_properties)
         response_property_spike_categories = sorted(self.response_property_spike_categories)
@@ -137,13 +481,20 @@ class Query(object):
             cell_names.append(cell.calc_cell_name())
 
         return f"""cell_names: {cell_names};
-        cell_criteria: {cell_criteria};
-        response_criteria: {response_criteria};
+        {self.criteria_properties()}
         cell_properties: {cell_properties};
         response_properties: {response_properties};
         spike_categories: {response_property_spike_categories}
         """
 
+    def criteria_id(self):
+        """
+        Creates an id shared by all queries with the same criteria.
+        """
+        q = hashlib.sha256()
+        q.update(bytes(str(self.criteria_properties()), encoding="ASCII"))
+        return q.hexdigest()
+
     def query_id(self):
         """
         Creates a unique query id based on all query properties.
@@ -152,34 +503,82 @@ class Query(object):
         q.update(bytes(str(self.query_properties()), encoding="ASCII"))
         return q.hexdigest()
 
+    def query_cache_subdir(self):
+        """
+        Queries with the same criteria are cached in the same directory.
+        """
+        return os.path.join(query_cache_dir, self.criteria_id())
+
+    def query_cache_path(self):
+        """
+        Generates the directory for storing the query results (see QueryStore).
+        """
+        return os.path.join(self.query_cache_subdir(), self.query_id())
+
     def query_cache_filename(self):
         """
-        Genetates a filename for storing the query.
+        Returns the manifest filename of the stored query.
+        """
+        return QueryStore.manifest_path(self.query_cache_path())
+
+    def find_cached_query(self):
+        """
+        Returns the cached query with the same criteria that has the most
+        reusable cells (see reusable_cell_names) and a subset of the
+        properties of this query, or None if there is no such query.
+        """
+        best_query = None
+        best_score = (0, 0, 0)
+        manifest_pattern = QueryStore.manifest_path(os.path.join(self.query_cache_subdir(), '*'))
+        for filename in sorted(glob.glob(manifest_pattern)):
+            # only the manifest is read; results are read if the query is used
+            cached_query = self.load_query(filename, self.property_store)
+            if not self.has_properties_of(cached_query):
+                continue
+            cached_names = set(cached_query.analyzed_sweeps_dict)
+            reusable_cell_names = self.reusable_cell_names(cached_query)
+            # most reusable cells first, then fewest cells to drop, then fewest properties to add
+            score = (len(reusable_cell_names), -len(cached_names - reusable_cell_names), 
+                    len(cached_query.response_properties) + len(cached_query.cell_properties))
+            if score[0] > 0 and (best_query is None or score > best_score):
+                best_query, best_score = cached_query, score
+        return best_query
+
+    def has_properties_of(self, other_query):
+        """
+        Returns True if every property of other_query is also a property of this query.
         """
-        return os.path.join(query_cache_dir, f"{self.query_id()}.pickle")
+        return (set(other_query.response_properties).issubset(self.response_properties) and 
+                set(other_query.cell_properties).issubset(self.cell_properties) and 
+                set(other_query.log_response_properties).issubset(self.log_response_properties) and 
+                set(other_query.log_cell_properties).issubset(self.log_cell_properties))
 
     def is_cached(self):
         return os.path.exists(self.query_cache_filename())
 
     def save_query(self):
-        assert hasattr(self, 'mean_df'), "query must be run before it can be saved"
-
-        filename = self.query_cache_filename()
-
-        cells = self.cells
+        assert self.mean_df is not None, "query must be run before it can be saved"
         self.analyzed_sweeps_dict = self.create_analyzed_sweeps_dict()
-        self.cells=None # remove cells to save filespace
-
-        with open(filename, 'wb') as f:
-            pickle.dump(self, f)
-
-        self.cells = cells # add cells back 
+        self.cell_fingerprints = self.create_cell_fingerprints_dict()
+        QueryStore.save(self.query_cache_path(), self)
    
     @classmethod
-    def load_query(cls, query_cache_filepath):
-        with open(query_cache_filepath, 'rb') as f:
-            query = pickle.load(f)
-            return query 
+    def load_query(cls, query_cache_filepath, property_store=None):
+        """
+        Loads a query saved with save_query() (query_cache_filepath is its
+        directory or manifest file). Only the manifest is read here; mean_df is
+        read when first used. Properties calculated with the loaded query are
+        read from and saved in property_store, if given.
+        """
+        if os.path.basename(query_cache_filepath) == QueryStore.manifest_filename:
+            query_cache_filepath = os.path.dirname(query_cache_filepath)
+        result_store = QueryStore(query_cache_filepath)
+        query = cls(None)
+        for attr, value in result_store.query_attributes().items():
+            setattr(query, attr, value)
+        query.property_store = property_store
+        query.result_store = result_store
+        return query 
 
     def describe(self):
         criteria = f"Cell: {self.cell_criteria}, Response: {self.response_criteria}"
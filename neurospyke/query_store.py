@@ -0,0 +1,113 @@
+from neurospyke.provenance import ANALYSIS_VERSION
+import json
+import numpy as np
+import os
+import pandas as pd
+import shutil
+
+# Query attributes saved in the manifest, which are enough to re-create the
+# query (without its cells) and to compare it with other queries.
+query_attributes = [
+        'cell_criteria',
+        'response_criteria',
+        'cell_properties',
+        'response_properties',
+        'response_property_spike_categories',
+        'log_cell_properties',
+        'log_response_properties',
+        'analyzed_sweeps_dict',
+        'cell_fingerprints']
+
+def to_json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value)} cannot be saved in a query store")
+
+class QueryStore(object):
+    """
+    Results of a query saved in a directory: a small JSON manifest with the
+    query parameters, analyzed sweeps and cell fingerprints, plus one file per
+    column of mean_df (.npy for numeric columns, .json for other columns).
+    Only the manifest is read when the store is opened; columns are read when
+    asked for, so a few columns of a wide result can be read on their own.
+    """
+    manifest_filename = 'manifest.json'
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self._manifest = None
+
+    @classmethod
+    def manifest_path(cls, store_dir):
+        return os.path.join(store_dir, cls.manifest_filename)
+
+    @classmethod
+    def is_saved(cls, store_dir):
+        return os.path.isfile(cls.manifest_path(store_dir))
+
+    @classmethod
+    def save(cls, store_dir, query):
+        """
+        Saves the parameters and mean_df of a query that has been run. The
+        manifest is written last, so an interrupted save is not reused.
+        """
+        shutil.rmtree(store_dir, ignore_errors=True)
+        os.makedirs(store_dir)
+        mean_df = query.mean_df
+
+        columns = []
+        for i, column_name in enumerate(mean_df.columns):
+            values = mean_df.iloc[:, i].values
+            if values.dtype.kind in 'biuf':
+                filename = f"column_{i}.npy"
+                np.save(os.path.join(store_dir, filename), values)
+            else:
+                filename = f"column_{i}.json"
+                with open(os.path.join(store_dir, filename), 'w') as f:
+                    json.dump(values.tolist(), f, default=to_json_value)
+            columns.append({'name': column_name, 'file': filename})
+
+        manifest = {attr: getattr(query, attr) for attr in query_attributes}
+        manifest['analyzed_sweeps_dict'] = {cell_name: [int(sweep_id) for sweep_id in sweep_ids]
+                for cell_name, sweep_ids in query.analyzed_sweeps_dict.items()}
+        manifest['analysis_version'] = ANALYSIS_VERSION
+        manifest['query_id'] = query.query_id()
+        manifest['index'] = list(mean_df.index)
+        manifest['columns'] = columns
+        with open(cls.manifest_path(store_dir), 'w') as f:
+            json.dump(manifest, f, default=to_json_value)
+
+    def manifest(self):
+        if self._manifest is None:
+            with open(self.manifest_path(self.store_dir)) as f:
+                self._manifest = json.load(f)
+        return self._manifest
+
+    def query_attributes(self):
+        """
+        Returns a dict with the saved values of query_attributes.
+        """
+        attributes = {attr: self.manifest()[attr] for attr in query_attributes}
+        attributes['response_criteria'] = [tuple(criterion)
+                for criterion in attributes['response_criteria']]
+        return attributes
+
+    def columns(self):
+        return [column['name'] for column in self.manifest()['columns']]
+
+    def read_column(self, column):
+        path = os.path.join(self.store_dir, column['file'])
+        if path.endswith('.npy'):
+            return np.load(path)
+        with open(path) as f:
+            return json.load(f)
+
+    def read_df(self, columns=None):
+        """
+        Returns the saved mean_df, or only the given columns of it.
+        """
+        if columns is None:
+            columns = self.columns()
+        saved_columns = {column['name']: column for column in self.manifest()['columns']}
+        data = {column_name: self.read_column(saved_columns[column_name]) for column_name in columns}
+        return pd.DataFrame(data, index=self.manifest()['index'], columns=columns)
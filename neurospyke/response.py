@@ -1,7 +1,36 @@
+from neurospyke.cache import PropertyCache
+from neurospyke.fitting import exponential
+from neurospyke.fitting import fit_exponentials
+from neurospyke.fitting import goodness_of_fit
+from neurospyke.plotting import pyplot
+from neurospyke.profiling import null_stage
+from neurospyke.segments import segment_argmax
+from neurospyke.segments import segment_argmin
+from neurospyke.segments import segment_nearest
+from neurospyke.segments import segment_searchsorted
+from neurospyke.spike_index import detect_crossings
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
+
+def meets_condition(value, condition):
+    """
+    Returns True if value meets condition, which is either a number (value
+    must be close to it) or a string such as '<150' or '>0'. Value can also be
+    an array, in which case an elementwise boolean array is returned.
+    """
+    if isinstance(condition, str):
+        condition_val_str = ''.join([s for s in condition if s.isdigit() or '.' in s or '-' in s])
+        condition_val = float(condition_val_str) 
+        if "<" in condition and ">" in condition:
+            raise Exception("TODO")   
+        elif "<" in condition:
+            return value < condition_val
+        elif ">" in condition:
+            return value > condition_val
+        else:
+            raise Exception(f"{condition} is invalid condition")
+    else:
+        return np.isclose(value, condition)
 
 class Response(object):
     def __init__(self, curr_inj_params, sweep):
@@ -11,7 +40,7 @@ class Response(object):
         self.offset_time = curr_inj_params['offset_time']
         self.amplitude = curr_inj_params['amplitude']
         self.sweep = sweep
-        self._cache = {}
+        self._cache = PropertyCache()
 
     def criteria_priority(self):
         """
@@ -30,33 +59,89 @@ class Response(object):
         return first_list + other_list
 
     def data(self):
-        return self.sweep.sweep_df['data']
+        return self.sweep.data()
 
     def time(self):
-        return self.sweep.sweep_df['time']
+        return self.sweep.time()
 
     def commands(self):
-        return self.sweep.sweep_df['commands']
+        return self.sweep.commands()
 
     def calc_or_read_from_cache(self, attr_name_with_args):
         """
         This method either calculates the given attribute or gets it from the
-        cache if it has already been calculated.
+        cache if it has already been calculated. Calls are recorded if the
+        cell has a profiler (see Query.run(profile=True)).
+        """
+        profiler = getattr(self.sweep.cell, 'profiler', None)
+        if profiler is None:
+            return self._calc_or_read_from_cache(attr_name_with_args)
+        hit = self.is_in_cache(attr_name_with_args)
+        with profiler.property_call(self.sweep.cell.calc_cell_name(), attr_name_with_args, hit):
+            return self._calc_or_read_from_cache(attr_name_with_args)
+
+    def profile_property(self, attr_name_with_args, hit):
         """
+        Returns a context manager that records a property call, as
+        calc_or_read_from_cache does, for values cached without it. It does
+        nothing if the cell has no profiler.
+        """
+        profiler = getattr(self.sweep.cell, 'profiler', None)
+        if profiler is None:
+            return null_stage()
+        return profiler.property_call(self.sweep.cell.calc_cell_name(), attr_name_with_args, hit)
+
+    def is_in_cache(self, attr_name_with_args):
+        return attr_name_with_args in self._cache
+
+    def _calc_or_read_from_cache(self, attr_name_with_args):
         attr_pieces = attr_name_with_args.split('__') 
         attr_name = attr_pieces[0]
         args = attr_pieces[1:]
 
-        if not attr_name in self._cache:
-            fn = getattr(self, f"calc_{attr_name}")
-            value = fn(*args)
-            self._cache[attr_name_with_args] = value
-        return self._cache[attr_name_with_args]
+        found, value = self._cache.lookup(attr_name_with_args)
+        if not found:
+            store_key = self.property_store_key(attr_name_with_args)
+            found, value = (False, None) if store_key is None else self.sweep.cell.property_store.get(store_key)
+            if not found:
+                fn = getattr(self, f"calc_{attr_name}")
+                value = fn(*args)
+                if store_key is not None:
+                    self.sweep.cell.property_store.put(store_key, value)
+            self._cache.put(attr_name_with_args, value)
+        return value
+
+    def property_store_key(self, attr_name_with_args):
+        """
+        Returns the key of this property in the cell's persistent property
+        store, or None if values of this response are not stored (no store,
+        or a response that is not a pulse of a sweep of the cell file).
+        """
+        cell = self.sweep.cell
+        if cell is None or getattr(cell, 'property_store', None) is None:
+            return None
+        sweep_index = self.sweep.sweep_index()
+        if np.isnan(sweep_index) or cell.fingerprint() is None:
+            return None
+        return cell.property_store.key(cell.fingerprint(), int(sweep_index), 
+                self.onset_pnt, self.offset_pnt, attr_name_with_args)
 
-    def debug_cache(self):
-        print(f"Cache has {len(self._cache)} items.")
-        for key, value in self._cache.items():
-            print(f"key: {key} value: {value}")
+    def cache_nbytes(self):
+        """
+        Returns the bytes held by a response backed by its own dataframe (an
+        averaged response), for the accounting of the cache it is kept in.
+        """
+        sweep_df = getattr(self.sweep, '_sweep_df', None)
+        if sweep_df is None:
+            return 0
+        return int(np.sum(sweep_df.memory_usage(deep=True)))
+
+    def cache_stats(self):
+        """
+        Returns a dict with the entries, bytes, hits, misses and evictions of
+        this response's property cache.
+        """
+        return self._cache.stats()
 
     def meets_criterion(self, criterion):
         """
@@ -64,32 +149,14 @@ class Response(object):
         """
         attr_name, condition = criterion
         value = self.calc_or_read_from_cache(attr_name)
-
-        if isinstance(condition, str):
-            condition_val_str = ''.join([s for s in condition if s.isdigit() or '.' in s or '-' in s])
-            condition_val = float(condition_val_str) 
-            if "<" in condition and ">" in condition:
-                raise Exception("TODO")   
-            elif "<" in condition:
-                #print(f"Sweep # {self.sweep.sweep_index()}")
-                #print(value, condition, value < condition_val)
-                return value < condition_val
-            elif ">" in condition:
-                #print(f"Sweep # {self.sweep.sweep_index()}")
-                #print(value, condition, value>condition_val)
-                return value > condition_val
-            else:
-                raise Exception(f"{condition} is invalid condition")
-        else:
-            #print(f"Sweep # {self.sweep.sweep_index()}")
-            #print(value, condition, np.isclose(value, condition))
-            return np.isclose(value, condition)
+        return meets_condition(value, condition)
 
     def meets_criteria(self):
         return all(self.meets_criterion(criterion)
                 for criterion in self.criteria_priority())
 
     def calc_properties(self, property_names):
+        self.prefetch_pct_APamp_idxs(property_names)
         property_dict = {}
         for property_name in property_names:
             property_value = self.calc_or_read_from_cache(property_name)
@@ -100,19 +167,21 @@ class Response(object):
             property_dict.update(tmp_dict)
         return property_dict 
 
-    def run(self):
+    def run(self, response_properties=None):
         """ 
-        Returns a one row dataframe with data for all response_properties.
+        Returns a one row dataframe with data for all response_properties (by
+        default those of the cell's query).
         """
-        response_properties = self.sweep.cell.query.response_properties 
+        if response_properties is None:
+            response_properties = self.sweep.cell.query.response_properties 
         results_dict = self.calc_properties(response_properties)
         return pd.DataFrame([results_dict], index=[self.sweep.sweep_index()])
 
-    def window(self, left_window=100, right_window=100):
+    def window_slice(self, left_window=100, right_window=100):
         """
-        Returns a dataframe of the sweep_df format with only the specified
-        response window.  Left and right are how far the window should extend
-        from the current injection (in ms)
+        Returns the slice of sweep points of the response window. Left and
+        right are how far the window should extend from the current injection
+        (in ms)
         """
         points_per_ms = self.calc_or_read_from_cache('points_per_ms')
         
@@ -121,12 +190,26 @@ class Response(object):
 
         if window_onset_pnt < 0:
             raise Exception("Left window too big")
-        if window_offset_pnt > len(self.sweep.sweep_df.index):
+        if window_offset_pnt > len(self.time()):
             raise Exception("Right window too big")
 
-        window_df = self.sweep.sweep_df[window_onset_pnt:window_offset_pnt]
-        window_df = window_df.reset_index(drop=True)
-        window_df['time'] = window_df['time'] - window_df['time'][0] 
+        return slice(window_onset_pnt, window_offset_pnt)
+
+    def window(self, left_window=100, right_window=100):
+        """
+        Returns a dataframe of the sweep_df format with only the specified
+        response window.  Left and right are how far the window should extend
+        from the current injection (in ms)
+        """
+        window = self.window_slice(left_window, right_window)
+        time = self.time().values[window]
+        window_df = pd.DataFrame(data = {
+            'sweep_index':self.sweep.sweep_index(),
+            'sweep_time':self.sweep.sweep_time(),
+            'time':time - time[0],
+            'data':self.data().values[window],
+            'commands':self.commands().values[window]
+            })
         
         return window_df
 
@@ -135,7 +218,7 @@ class Response(object):
 ###############################################################################
 
     def calc_sweep_time(self):
-        return self.sweep.sweep_df.sweep_time[0]
+        return self.sweep.sweep_time()
 
     def calc_sweep_index(self):
         return self.sweep.sweep_index()
@@ -171,45 +254,29 @@ class Response(object):
 
     def calc_spike_points(self):
         """ Calculates points where spikes occur (defined by voltage going  > -10 mV) """
-        thresh = -10
-        above_thresh = np.where(self.sweep.data()[1:] > thresh)           
-        below_thresh = np.where(self.sweep.data()[0:-1] <= thresh)
-        spike_points = np.intersect1d(above_thresh, below_thresh)
+        sweep_index = self.sweep.sweep_index()
+        if self.sweep.cell is not None and not np.isnan(sweep_index):
+            # slice the crossings already found for the whole cell
+            spike_index = self.sweep.cell.spike_index([int(sweep_index)])
+            return spike_index.points_between(int(sweep_index), self.onset_pnt, self.offset_pnt)
+        _, spike_points = detect_crossings(self.sweep.data().values)
         idx = np.where((spike_points > self.onset_pnt) & (spike_points < self.offset_pnt))
         return spike_points[idx] 
-        #all_spike_points_during_current_injection = all(spike_point 
-        #        in range(self.onset_pnt, self.offset_pnt) 
-        #        for spike_point in spike_points)
-        #if all_spike_points_during_current_injection: 
-        #    return spike_points
-        #else:
-        #    # if there are spikes outside of current injection, don't analyze
-        #    return []
      
     def calc_num_spikes(self):
         spike_points = self.calc_or_read_from_cache('spike_points')
         return len(spike_points)
    
     def calc_APmax_idx_and_val(self):
+        """
+        Finds the max data value between each spike point and the next spike
+        point (or current offset for the last spike), for all spikes at once.
+        """
         spike_points = self.calc_or_read_from_cache('spike_points')
-        num_spikes = self.calc_or_read_from_cache('num_spikes')
-        max_AP_idxs = []; max_AP_vals = []
-
-        for i in range(num_spikes):
-            if i < num_spikes-1:
-                stop_idx = spike_points[i+1]
-            else:
-                stop_idx = self.offset_pnt
-
-            # find max data value that occurs between spike point indices
-            start_idx = spike_points[i]; 
-            max_idx = np.argmax(self.sweep.data()[start_idx:stop_idx]) 
-            max_val = self.sweep.data()[max_idx]
-            
-            # append values
-            max_AP_vals.append(max_val)
-            max_AP_idxs.append(max_idx)
-        return np.array(max_AP_idxs), np.array(max_AP_vals)
+        data = self.data().values
+        stop_idxs = np.append(spike_points[1:], self.offset_pnt)
+        max_AP_idxs = segment_argmax(data, spike_points, stop_idxs)
+        return max_AP_idxs, data[max_AP_idxs]
 
     def calc_APmax_vals(self):
         _, vals = self.calc_or_read_from_cache('APmax_idx_and_val')
@@ -220,34 +287,23 @@ class Response(object):
         return np.array(idxs)
 
     def calc_AHP_idx_and_vals(self):
+        """
+        Finds the min voltage between each AP max and the next AP max, for all
+        spikes at once. For a single spike (rheobase calculations) the min is
+        taken up to current offset.
+        """
         num_spikes = self.calc_or_read_from_cache('num_spikes')
         APmax_idxs = self.calc_or_read_from_cache('APmax_idxs')
+        data = self.data().values
         
-        AHP_idxs = []; AHP_vals = []
         if num_spikes == 1:
-            # for rheobase calculations
-            start_idx = APmax_idxs[0]
-            stop_idx = self.offset_pnt
-            min_idx = np.argmin(self.sweep.data()[start_idx:stop_idx])
-            min_val = self.sweep.data()[min_idx]
-            AHP_vals.append(min_val)
-            AHP_idxs.append(min_idx)
+            AHP_idxs = segment_argmin(data, APmax_idxs, [self.offset_pnt])
+            return AHP_idxs, data[AHP_idxs]
         else:
-            for i in range(num_spikes-1):
-                # find min voltage that occurs between given AP max and next AP max
-                start_idx = APmax_idxs[i]
-                stop_idx = APmax_idxs[i+1]
-                min_idx = np.argmin(self.sweep.data()[start_idx:stop_idx])
-                min_val = self.sweep.data()[min_idx]
-                
-                # append values
-                AHP_vals.append(min_val)
-                AHP_idxs.append(min_idx)
+            AHP_idxs = segment_argmin(data, APmax_idxs[:-1], APmax_idxs[1:])
+            AHP_vals = data[AHP_idxs]
             # in order to have len(AHP_vals) and len(AHP_idxs) == num_spikes
-            AHP_vals.append(np.nan)
-            AHP_idxs.append(np.nan)
-
-        return np.array(AHP_idxs), np.array(AHP_vals)
+            return np.append(AHP_idxs, np.nan), np.append(AHP_vals, np.nan)
 
     def calc_AHP_vals(self):
         _, vals = self.calc_or_read_from_cache('AHP_idx_and_vals')
@@ -267,23 +323,15 @@ class Response(object):
         """
         num_spikes = self.calc_or_read_from_cache('num_spikes')
         dVdt = self.calc_or_read_from_cache('dVdt_mV_per_ms')
-        AP_max_idx = self.calc_or_read_from_cache('APmax_idxs')
-        AHP_idx = self.calc_or_read_from_cache('AHP_idxs')  
-        thresh_idxs = []; thresh_vals = [];
-
-        for i in range(num_spikes):
-            if i == 0:
-                start_idx = int(self.onset_pnt)
-            else: 
-                start_idx = int(AHP_idx[i-1])
-            stop_idx = int(AP_max_idx[i])
-
-            #TODO assert that monotonically increasing?
-            thresh_idx = start_idx + np.searchsorted(dVdt[start_idx:stop_idx], 15) - 1
-             
-            thresh_idxs.append(thresh_idx)
-            thresh_vals.append(self.sweep.data()[thresh_idx])
-        return np.array(thresh_idxs), np.array(thresh_vals)
+
+        # search the rising phase, from current onset (first spike) or the
+        # previous AHP up to the AP max
+        start_idxs = self.AP_start_idxs(num_spikes, 'rising')
+        stop_idxs = self.AP_stop_idxs(num_spikes, 'rising')
+
+        #TODO assert that monotonically increasing?
+        thresh_idxs = start_idxs + segment_searchsorted(dVdt, start_idxs, stop_idxs, 15) - 1
+        return thresh_idxs, self.data().values[thresh_idxs]
 
     def calc_threshold_idxs(self):
         idxs, _ = self.calc_or_read_from_cache('threshold_idx_and_vals')
@@ -318,100 +366,117 @@ class Response(object):
         amplitude_at_percent = thresh_vals + AP_amplitudes * percent/100
         return amplitude_at_percent
     
-    def calc_AP_width_and_idxs(self, percent):
+    def pct_APamp_idxs(self, percents, direction):
+        """
+        Returns, for each percent, the indices of the points closest to that
+        percent of AP amplitude on the rising or falling phase of each spike.
+        All levels that are not cached yet are found in one pass over the
+        spike segments.
+        """
+        percents = [int(percent) for percent in percents]
+        idxs_by_percent = {}
+        for percent in percents:
+            key = f"pct_APamp_idxs__{percent}__{direction}"
+            found, idxs = self._cache.lookup(key)
+            if found:
+                with self.profile_property(key, hit=True):
+                    idxs_by_percent[percent] = idxs
+        missing = [percent for percent in percents if percent not in idxs_by_percent]
+        if missing:
+            # the missing levels are found together, and profiled as one call
+            batch_key = f"pct_APamp_idxs__{'_'.join(str(percent) for percent in missing)}__{direction}"
+            with self.profile_property(batch_key, hit=False):
+                missing_idxs = self.find_pct_APamp_idxs(missing, direction)
+            for percent, percent_idxs in zip(missing, missing_idxs):
+                self._cache.put(f"pct_APamp_idxs__{percent}__{direction}", percent_idxs)
+                idxs_by_percent[percent] = percent_idxs
+        return [idxs_by_percent[percent] for percent in percents]
+
+    def find_pct_APamp_idxs(self, percents, direction):
+        """
+        Returns the indices for each of percents, found in one pass over the
+        spike segments.
+        """
         num_spikes = self.calc_or_read_from_cache('num_spikes')
-        rising_start_idxs = self.AP_start_idxs(num_spikes, 'rising')
-        rising_stop_idxs = self.AP_stop_idxs(num_spikes, 'rising')
-        falling_start_idxs = self.AP_start_idxs(num_spikes, 'falling')
-        falling_stop_idxs = self.AP_stop_idxs(num_spikes, 'falling')
-
-        amplitudes_at_percent = self.calc_val_pct_APamp(int(percent))
-        spike_widths = []; idxs_rising = []; idxs_falling = []
-        for i in range(num_spikes):
-            rising_start_idx = int(rising_start_idxs[i])
-            rising_stop_idx = int(rising_stop_idxs[i])
-            falling_start_idx = int(falling_start_idxs[i])
-            falling_stop_idx = int(falling_stop_idxs[i])
-            
-            rising_spike_data = self.sweep.data()[rising_start_idx:rising_stop_idx]
-            falling_spike_data = self.sweep.data()[falling_start_idx:falling_stop_idx]
-
-            amplitude_at_percent = amplitudes_at_percent[i]
-            idx_rising = np.argmin(abs(rising_spike_data-amplitude_at_percent))
-            idx_falling = np.argmin(abs(falling_spike_data-amplitude_at_percent))
-            spike_width = (idx_falling-idx_rising) * self.calc_or_read_from_cache('ms_per_point')
-            idxs_rising.append(int(idx_rising))
-            idxs_falling.append(int(idx_falling))
-            spike_widths.append(np.float(spike_width))
-
-
-        return idxs_rising, idxs_falling, np.array(spike_widths)
+        AP_amplitudes = self.calc_or_read_from_cache('AP_amplitudes')
+        thresh_vals = self.calc_or_read_from_cache('threshold_vals') 
+        amplitudes_at_percents = thresh_vals + AP_amplitudes * np.array(percents)[:, None]/100
+        return segment_nearest(self.data().values, 
+                self.AP_start_idxs(num_spikes, direction),
+                self.AP_stop_idxs(num_spikes, direction),
+                amplitudes_at_percents)
+
+    def prefetch_pct_APamp_idxs(self, property_names):
+        """
+        Finds the AP amplitude levels of all requested AP shape properties
+        (dVdt_pct_APamp, dVdt_pct_APamp_last_spike and AP_width) together, so
+        that requesting several of them shares one pass over the spikes.
+        """
+        percents = {'rising': set(), 'falling': set()}
+        for property_name in property_names:
+            attr_pieces = property_name.split('__')
+            attr_name = attr_pieces[0]
+            args = attr_pieces[1:]
+            if attr_name == 'AP_width':
+                percents['rising'].add(int(args[0]))
+                percents['falling'].add(int(args[0]))
+            elif attr_name == 'dVdt_pct_APamp' and args[0].isdigit():
+                percents[args[1]].add(int(args[0]))
+            elif attr_name == 'dVdt_pct_APamp_last_spike' and args[0].isdigit():
+                if self.calc_or_read_from_cache('num_spikes') == int(args[2]):
+                    percents[args[1]].add(int(args[0]))
+        for direction, direction_percents in percents.items():
+            if direction_percents:
+                self.pct_APamp_idxs(sorted(direction_percents), direction)
+
+    def calc_AP_width_and_idxs(self, percent):
+        idxs_rising, = self.pct_APamp_idxs([percent], 'rising')
+        idxs_falling, = self.pct_APamp_idxs([percent], 'falling')
+        spike_widths = (idxs_falling - idxs_rising) * self.calc_or_read_from_cache('ms_per_point')
+        return idxs_rising, idxs_falling, spike_widths.astype(float)
     
     def calc_AP_width(self, percent):
         _, _, spike_widths = self.calc_AP_width_and_idxs(int(percent))
         return spike_widths
 
     def AP_start_idxs(self, num_spikes, direction):
+        """
+        Rising phases start at current onset (first spike) or at the previous
+        AHP, falling phases start at the AP max.
+        """
         AP_max_idx = self.calc_or_read_from_cache('APmax_idxs')
         AHP_idx = self.calc_or_read_from_cache('AHP_idxs') 
-        start_idxs = []
-        for i in range(num_spikes):
-            if direction == 'rising':
-                if i == 0:
-                    start_idx = self.onset_pnt
-                else:
-                    start_idx = AHP_idx[i-1]
-            elif direction == 'falling':
-                start_idx = AP_max_idx[i]
-            start_idxs.append(int(start_idx))
-        return start_idxs
+        if direction == 'rising':
+            start_idxs = np.append(self.onset_pnt, AHP_idx[:num_spikes-1])[:num_spikes]
+        elif direction == 'falling':
+            start_idxs = AP_max_idx[:num_spikes]
+        return start_idxs.astype(int)
 
     def AP_stop_idxs(self, num_spikes, direction):
+        """
+        Rising phases stop at the AP max, falling phases stop at the AHP (or
+        current offset for the last spike).
+        """
         AP_max_idx = self.calc_or_read_from_cache('APmax_idxs')
         AHP_idx = self.calc_or_read_from_cache('AHP_idxs') 
-        stop_idxs = []
-        for i in range(num_spikes):
-            if direction == 'rising':
-                stop_idx = AP_max_idx[i]
-            elif direction == 'falling':
-                if i < num_spikes-1:
-                    stop_idx = AHP_idx[i] 
-                else:
-                    stop_idx = self.offset_pnt
-            stop_idxs.append(int(stop_idx))
-        return stop_idxs
+        if direction == 'rising':
+            stop_idxs = AP_max_idx[:num_spikes]
+        elif direction == 'falling':
+            stop_idxs = np.append(AHP_idx[:num_spikes-1], self.offset_pnt)[:num_spikes]
+        return stop_idxs.astype(int)
 
     def calc_dVdt_pct_APamp(self, percent, direction):
         num_spikes = self.calc_or_read_from_cache('num_spikes')
         dVdt = self.calc_or_read_from_cache('dVdt_mV_per_ms')
-        
-        if percent.isdigit():
-            amplitudes_at_percent = self.calc_val_pct_APamp(int(percent))
+        percent = str(percent)
 
-        dVdt_vals = []
-        
-        AP_start_idxs = self.AP_start_idxs(num_spikes, direction)
-        AP_stop_idxs = self.AP_stop_idxs(num_spikes, direction)
-
-        for i in range(num_spikes):
-            start_idx = AP_start_idxs[i]
-            stop_idx = AP_stop_idxs[i]
-            spike_data = self.sweep.data()[start_idx:stop_idx]
-            dVdt_data = dVdt[start_idx:stop_idx]
-
-            if percent.isdigit():
-                amplitude_at_percent = amplitudes_at_percent[i] 
-                idx = np.argmin(abs(spike_data-amplitude_at_percent))
-                dVdt_val = np.float(dVdt[idx])
-            elif percent == 'max':
-                dVdt_abs = np.abs(dVdt_data)
-                max_idx = np.argmax(dVdt_abs)
-                dVdt_val = np.float(dVdt_data[max_idx])
-                
-            # append value as float to dVdt_vals
-            dVdt_vals.append(dVdt_val)
-                
-        return np.array(dVdt_vals)
+        if percent.isdigit():
+            idxs, = self.pct_APamp_idxs([percent], direction)
+        elif percent == 'max':
+            idxs = segment_argmax(np.abs(dVdt), 
+                    self.AP_start_idxs(num_spikes, direction),
+                    self.AP_stop_idxs(num_spikes, direction))
+        return dVdt[idxs].astype(float)
 
     def calc_dVdt_pct_APamp_last_spike(self, percent, direction,  num_spikes):
         num_spikes = int(num_spikes)
@@ -450,8 +515,9 @@ class Response(object):
 ###############################################################################
 
     def calc_peak_sag_idx_and_val(self):
-        peak_sag_idx = np.argmin(self.sweep.data()[self.onset_pnt:self.offset_pnt])
-        peak_sag_val = self.sweep.data()[peak_sag_idx]
+        data = self.data().values
+        peak_sag_idx = self.onset_pnt + np.argmin(data[self.onset_pnt:self.offset_pnt])
+        peak_sag_val = data[peak_sag_idx]
         return peak_sag_idx, peak_sag_val
 
     def calc_peak_sag_idx(self):
@@ -492,40 +558,40 @@ class Response(object):
         steady_state_vals = self.data()[steady_state_onset_idx:steady_state_offset_idx]
         return np.mean(steady_state_vals)
        
-    def calc_sag_fit_amplitude(self):
+    def sag_fit_windows(self):
         """
-        Calculates sag amplitude based on an exponential fit from peak sag to sag offset. 
+        Returns x (time from peak sag, in s) and the two offsets of the data
+        from peak sag to sag offset that are fit for sag_fit_amplitude: shifted
+        to start at 0 (y_start0) and shifted to end at 0 (y_end0).
         """
-        assert self.calc_or_read_from_cache('sag_onset_time') < 80, "Fitting to no sag"
-        def exponential(x, a, b):
-            return a * np.exp(b*x) 
-
-        def goodness_of_fit(y, y_fit):
-            ss_res = np.sum((y - y_fit) ** 2)
-            ss_tot = np.sum((y - np.mean(y)) ** 2)
-            r2 = 1 - (ss_res / ss_tot)
-            return r2
-
         start_idx = self.calc_or_read_from_cache('peak_sag_idx')
         end_idx = self.calc_or_read_from_cache('sag_offset_idx')
 
-        x = self.time()[start_idx:end_idx] - self.time()[start_idx]
-        y = self.data()[start_idx:end_idx]
+        time = self.time().values
+        x = time[start_idx:end_idx] - time[start_idx]
+        y = self.data().values[start_idx:end_idx]
 
         y_start0 = y-np.min(y)
         y_end0 = y-np.max(y)
-        popt_vals = []; r2_vals = []; y_fit_vals = []
-        for y in y_start0, y_end0:
-            popt, _ = curve_fit(exponential, x, y)
-            y_fit = exponential(x, *popt)
-            r2 = goodness_of_fit(y, y_fit)
-           
-            popt_vals.append(popt)
-            r2_vals.append(r2)
-            y_fit_vals.append(y_fit)
+        return x, y_start0, y_end0
+
+    def calc_sag_fit_amplitude(self):
+        """
+        Calculates sag amplitude based on an exponential fit from peak sag to
+        sag offset. Both offsets of the data are fit in one batched call, and
+        the amplitude of the better fit (by R^2) is returned.
+        """
+        assert self.calc_or_read_from_cache('sag_onset_time') < 80, "Fitting to no sag"
+        x, y_start0, y_end0 = self.sag_fit_windows()
+        x_vals = np.vstack((x, x))
+        y_vals = np.vstack((y_start0, y_end0))
+
+        a_vals, b_vals = fit_exponentials(x_vals, y_vals)
+        y_fit_vals = exponential(x_vals, a_vals[:, None], b_vals[:, None])
+        r2_vals = goodness_of_fit(y_vals, y_fit_vals)
      
         best_fit_idx = np.argmax(r2_vals)
-        sag_amplitude = popt_vals[best_fit_idx][0]
+        sag_amplitude = a_vals[best_fit_idx]
 
         return sag_amplitude 
 
@@ -555,10 +621,10 @@ class Response(object):
         idx_array = (np.abs(array-value)).argmin()
         return pd_series.index[0] + idx_array
         
-    def calc_reb_delta_t(self):
+    def calc_reb_delta_t_pnts(self):
         """
-        Returns time to get from 20% to 80% of voltage change from steady state
-        to maximum repolarization within response window. 
+        Returns the points closest to 20% and 80% of the voltage change from
+        steady state to maximum repolarization within response window.
         """
         max_rebound_val = self.calc_or_read_from_cache('max_rebound_val')
         steady_state_avg_amp = self.calc_or_read_from_cache('sag_steady_state_avg_amp')
@@ -572,10 +638,14 @@ class Response(object):
                 twenty_percent_rebound_voltage)
         closest_pnt80 = self.find_nearest_pnt_series(reb_data, 
                 eighty_percent_rebound_voltage)
+        return closest_pnt20, closest_pnt80
 
-        self._cache['closest_pnt20'] = closest_pnt20
-        self._cache['closest_pnt80'] = closest_pnt80
-
+    def calc_reb_delta_t(self):
+        """
+        Returns time to get from 20% to 80% of voltage change from steady state
+        to maximum repolarization within response window. 
+        """
+        closest_pnt20, closest_pnt80 = self.calc_or_read_from_cache('reb_delta_t_pnts')
         reb_delta_t = (closest_pnt80-closest_pnt20)/self.calc_or_read_from_cache('points_per_ms')
         return reb_delta_t 
 
@@ -586,6 +656,7 @@ class Response(object):
     
     def plot_response(self, filepath=None, plotting_above=False, plot_commands=True, xscale='s'):
         #TODO: currently this creates a generator, so can't plot externally without a loop
+        plt = pyplot()
         fig = None; ax1 = None; ax2 = None
         if xscale == 'ms':
             time = self.time() * 1000
@@ -617,6 +688,7 @@ class Response(object):
 
     def plot_reb_time(self, filepath=None):
         """ Add line showing timing of peak rebound """
+        plt = pyplot()
         rebound_time_sec = self.calc_or_read_from_cache('max_rebound_time')/1000
 
         for fig, (ax1, ax2) in self.plot_response():
@@ -638,11 +710,8 @@ class Response(object):
         Adds annotations for reb_delta_t analysis to a figure object created
         with self.plot_response()
         """
-        self.calc_or_read_from_cache('reb_delta_t')
-
-        # These two values should be in cache when 'reb_delta_t' is in cache.
-        closest_pnt20 = self._cache['closest_pnt20']
-        closest_pnt80 = self._cache['closest_pnt80']
+        plt = pyplot()
+        closest_pnt20, closest_pnt80 = self.calc_or_read_from_cache('reb_delta_t_pnts')
 
         reb_calc_times = self.time()[closest_pnt20:closest_pnt80]
         reb_calc_data = self.data()[closest_pnt20:closest_pnt80]
@@ -678,6 +747,7 @@ class Response(object):
 
     def plot_spiking_properties(self, threshold=False, AHP=False, AP_width__50=False, 
             filepath=None, plot_commands=True, xscale='ms'):
+        plt = pyplot()
 
         if xscale == 'ms':
             scalar = 1000
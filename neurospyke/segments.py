@@ -0,0 +1,88 @@
+"""
+Reductions over many [start, stop) segments of a 1-D array at once, used to
+compute a value for every spike of a response (or of many responses) with a
+few array operations instead of a python loop over spikes. All returned
+indices are absolute indices into the array.
+"""
+import numpy as np
+
+def segment_ranges(starts, stops):
+    """
+    Returns the absolute indices of all segments concatenated, the offset of
+    each segment within them and the segment lengths.
+    """
+    starts = np.asarray(starts, dtype=int)
+    stops = np.asarray(stops, dtype=int)
+    lengths = stops - starts
+    assert np.all(lengths > 0), "segments must not be empty"
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    flat_idxs = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+    return flat_idxs, offsets, lengths
+
+def segment_first_match(is_match, offsets):
+    """
+    Returns the position (within the concatenated segments) of the first True
+    value of is_match in each segment. is_match can be 2-D, with the
+    concatenated segments along the last axis.
+    """
+    npositions = is_match.shape[-1]
+    positions = np.where(is_match, np.arange(npositions), npositions)
+    return np.minimum.reduceat(positions, offsets, axis=-1)
+
+def _segment_arg_extreme(values, starts, stops, reduce_fn):
+    if len(starts) == 0:
+        return np.array([], dtype=int)
+    flat_idxs, offsets, lengths = segment_ranges(starts, stops)
+    segment_values = values[flat_idxs]
+    extremes = reduce_fn.reduceat(segment_values, offsets)
+    is_extreme = segment_values == np.repeat(extremes, lengths)
+    return flat_idxs[segment_first_match(is_extreme, offsets)]
+
+def segment_argmax(values, starts, stops):
+    """
+    Returns the index of the (first) maximum of each values[start:stop].
+    Nan values are skipped, as pandas does.
+    """
+    return _segment_arg_extreme(values, starts, stops, np.fmax)
+
+def segment_argmin(values, starts, stops):
+    """
+    Returns the index of the (first) minimum of each values[start:stop].
+    Nan values are skipped, as pandas does.
+    """
+    return _segment_arg_extreme(values, starts, stops, np.fmin)
+
+def segment_searchsorted(values, starts, stops, level):
+    """
+    Returns np.searchsorted(values[start:stop], level) for every segment
+    (relative to start), running the binary searches of all segments side by
+    side. On a rising segment this is the first point at or above level.
+    """
+    starts = np.asarray(starts, dtype=int)
+    lo = np.zeros(len(starts), dtype=int)
+    hi = np.asarray(stops, dtype=int) - starts
+    active = lo < hi
+    while np.any(active):
+        mid = (lo + hi) // 2
+        mid_vals = values[starts + np.where(active, mid, 0)]
+        below = mid_vals < level
+        lo = np.where(active & below, mid + 1, lo)
+        hi = np.where(active & ~below, mid, hi)
+        active = lo < hi
+    return lo
+
+def segment_nearest(values, starts, stops, levels):
+    """
+    Returns the index of the point closest to a level in each
+    values[start:stop], for several levels per segment at once. levels has
+    shape (number of levels, number of segments), and so does the result.
+    The segment values are gathered only once for all levels.
+    """
+    levels = np.atleast_2d(levels)
+    if len(starts) == 0:
+        return np.zeros(levels.shape, dtype=int)
+    flat_idxs, offsets, lengths = segment_ranges(starts, stops)
+    distances = np.abs(values[flat_idxs] - np.repeat(levels, lengths, axis=1))
+    min_distances = np.fmin.reduceat(distances, offsets, axis=1)
+    is_nearest = distances == np.repeat(min_distances, lengths, axis=1)
+    return flat_idxs[segment_first_match(is_nearest, offsets)]
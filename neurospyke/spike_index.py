@@ -0,0 +1,108 @@
+import numpy as np
+
+SPIKE_THRESHOLD = -10
+
+def detect_crossings(data, thresh=SPIKE_THRESHOLD):
+    """
+    Finds every upward crossing of thresh for all rows of a 2-D (sweeps x
+    points) array in one pass. A crossing at point i means data[i] <= thresh
+    and data[i+1] > thresh. Returns a CSR-style (indptr, indices) pair, where
+    the crossings of row n are indices[indptr[n]:indptr[n+1]].
+    """
+    data = np.atleast_2d(data)
+    crossings = (data[:, :-1] <= thresh) & (data[:, 1:] > thresh)
+    rows, indices = np.nonzero(crossings)
+    counts = np.bincount(rows, minlength=data.shape[0])
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+    return indptr, indices
+
+
+class SpikeIndex(object):
+    """
+    Ragged index of all spike points (voltage going > -10 mV) for the sweeps
+    of a cell, computed once and sliced by each Response. Row n of the index
+    holds the spike points of sweep sweep_indices[n] (sorted; by default every
+    sweep of the cell), and indexes of different sweeps can be merged.
+    """
+    def __init__(self, indptr, indices, npoints, sweep_indices=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.npoints = npoints
+        if sweep_indices is None:
+            sweep_indices = np.arange(len(indptr) - 1)
+        self.sweep_indices = np.asarray(sweep_indices, dtype=np.int64)
+
+    @classmethod
+    def from_data(cls, data, thresh=SPIKE_THRESHOLD, sweep_indices=None):
+        data = np.atleast_2d(data)
+        indptr, indices = detect_crossings(data, thresh)
+        return cls(indptr, indices, data.shape[1], sweep_indices)
+
+    def nsweeps(self):
+        return len(self.indptr) - 1
+
+    def has_sweeps(self, sweep_indices):
+        """
+        Returns a boolean array, True for each sweep that is in the index.
+        """
+        sweep_indices = np.asarray(sweep_indices, dtype=np.int64)
+        if self.nsweeps() == 0:
+            return np.zeros(len(sweep_indices), dtype=bool)
+        rows = np.minimum(np.searchsorted(self.sweep_indices, sweep_indices), self.nsweeps() - 1)
+        return self.sweep_indices[rows] == sweep_indices
+
+    def rows(self, sweep_indices):
+        """
+        Returns the row of each sweep in the index.
+        """
+        sweep_indices = np.asarray(sweep_indices, dtype=np.int64)
+        assert np.all(self.has_sweeps(sweep_indices)), "sweeps are not in the spike index"
+        return np.searchsorted(self.sweep_indices, sweep_indices)
+
+    def merge(self, other):
+        """
+        Returns an index with the sweeps of self and of other (which must not
+        share any sweeps), ordered by sweep.
+        """
+        assert self.npoints == other.npoints
+        sweep_indices = np.concatenate((self.sweep_indices, other.sweep_indices))
+        counts = np.concatenate((np.diff(self.indptr), np.diff(other.indptr)))
+        indices = np.concatenate((self.indices, other.indices))
+        starts = np.concatenate((self.indptr[:-1], other.indptr[:-1] + len(self.indices)))
+
+        order = np.argsort(sweep_indices, kind='stable')
+        assert np.all(np.diff(sweep_indices[order]) > 0), "spike indexes share sweeps"
+        indptr = np.concatenate(([0], np.cumsum(counts[order])))
+        positions = np.arange(indptr[-1]) + np.repeat(starts[order] - indptr[:-1], counts[order])
+        return SpikeIndex(indptr, indices[positions], self.npoints, sweep_indices[order])
+
+    def sweep_points(self, sweep_index):
+        """
+        Returns all spike points of the given sweep.
+        """
+        row = self.rows([sweep_index])[0]
+        return self.indices[self.indptr[row]:self.indptr[row+1]]
+
+    def points_between(self, sweep_index, onset_pnt, offset_pnt):
+        """
+        Returns spike points of the given sweep with onset_pnt < point < offset_pnt.
+        """
+        points = self.sweep_points(sweep_index)
+        start = np.searchsorted(points, onset_pnt, side='right')
+        stop = np.searchsorted(points, offset_pnt, side='left')
+        return points[start:stop]
+
+    def count_between(self, sweep_indices, onset_pnts, offset_pnts):
+        """
+        Returns the number of spike points with onset_pnt < point < offset_pnt
+        for arrays of sweep indices and onset/offset points, without a loop
+        over sweeps.
+        """
+        sweep_rows = self.rows(sweep_indices)
+        rows = np.repeat(np.arange(self.nsweeps(), dtype=np.int64), np.diff(self.indptr))
+        # flattened (sweep, point) keys are sorted across the whole index
+        keys = rows * self.npoints + self.indices
+        row_offsets = sweep_rows * self.npoints
+        stop = np.searchsorted(keys, row_offsets + np.asarray(offset_pnts), side='left')
+        start = np.searchsorted(keys, row_offsets + np.asarray(onset_pnts), side='right')
+        return stop - start
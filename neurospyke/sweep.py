@@ -1,11 +1,35 @@
+from neurospyke.pulse_index import detect_current_injections
+from neurospyke.pulse_index import pulse_columns
 from neurospyke.response import Response
 import pandas as pd
 
 class Sweep(object):
-    def __init__(self, sweep_df, cell=None):
-        self.sweep_df = sweep_df
+    """
+    A single sweep, either backed by a dataframe (e.g. an averaged sweep) or
+    by zero-copy views into the SweepStore of its cell.
+    """
+    def __init__(self, sweep_df=None, cell=None, sweep_index=None):
+        assert sweep_df is not None or sweep_index is not None, \
+                "Sweep requires either a sweep_df or a sweep_index of its cell"
+        self._sweep_df = sweep_df
+        self._sweep_index = sweep_index
         self.cell = cell
 
+    @property
+    def sweep_df(self):
+        if self._sweep_df is None:
+            self._sweep_df = self.cell.sweep_df(self._sweep_index)
+        return self._sweep_df
+
+    def column(self, name):
+        """
+        Returns a sweep column as a series, without copying store-backed data.
+        """
+        if self._sweep_df is None:
+            values = self.cell.sweep_store().sweep_view(name, self._sweep_index)
+            return pd.Series(values, name=name, copy=False)
+        return self._sweep_df[name]
+
     def run(self):
         """
         Returns a dataframe with one row for each response meeting the
@@ -21,60 +45,31 @@ class Sweep(object):
         return results_df
 
     def time(self):
-        return self.sweep_df['time']
+        return self.column('time')
 
     def data(self):
-        return self.sweep_df['data']
+        return self.column('data')
 
     def commands(self):
-        return self.sweep_df['commands']
+        return self.column('commands')
 
     def sweep_index(self):
+        if self._sweep_index is not None:
+            return self._sweep_index
         return self.sweep_df['sweep_index'][0]
 
+    def sweep_time(self):
+        if self._sweep_index is not None:
+            return self.cell.sweep_time(self._sweep_index)
+        return self.sweep_df['sweep_time'][0]
+
     def current_inj_waveforms(self):
         """
         Returns a list with n dictionaries  where n = number of current injections.
         """
-        assert self.commands()[0] == 0
-        
-        # Removes nan from the commands. Perhaps this should be done at an
-        # earlier step, with more data checks. 
-        commands = self.commands().dropna()
-             
-        delta_curr = commands.diff()
-
-        delta_curr[0] = 0
-        non_zero = delta_curr.nonzero()[0]
-        num_commands = int(len(non_zero))
-        assert num_commands % 2 == 0 # should have even number of command steps 
-        
-        curr_inj_waveform_list = []
-        
-        for i in range(0, num_commands, 2): # verify these are symmetrical square waves pulses
-            this_val = delta_curr.iloc[non_zero].values[i] 
-            next_val = delta_curr.iloc[non_zero].values[i+1]
-
-            if this_val == -next_val:
-                onset = non_zero[i]; offset = non_zero[i+1] 
-
-                onset_time = self.time().iloc[onset] 
-                offset_time = self.time().iloc[offset]
-                wave_amplitude = commands.iloc[onset]
-                sweep_index = self.sweep_index() 
-    
-                # Now that have all the values, append to list 
-                tmp_dict = {
-                        'sweep_index':sweep_index,
-                        'onset_pnt':onset,
-                        'offset_pnt':offset,
-                        'onset_time':onset_time, 
-                        'offset_time':offset_time,
-                        'amplitude':wave_amplitude
-                        }
-                curr_inj_waveform_list.append(tmp_dict)
-    
-        return curr_inj_waveform_list
+        pulses = detect_current_injections(
+                self.commands().values, self.time().values, [self.sweep_index()])
+        return [dict(zip(pulse_columns, pulse)) for pulse in pulses.tolist()]
 
     def responses(self): 
         return [Response(curr_inj_params, self) 
@@ -83,7 +78,7 @@ class Sweep(object):
     def plot(self, filepath=None, ylim_data=None, ylim_commands=[-450, 250], ylim_output=[-150, 50]):
 
         for fig, (ax1, ax2) in self.cell.sweep_plot_setup(filepath, ylim_commands=ylim_commands, ylim_output=ylim_output):
-            ax1.plot(self.sweep_df.time, self.sweep_df.data, 'k')
-            ax2.plot(self.sweep_df.time, self.sweep_df.commands, 'k')
-            ax1.set(title = f"sweep #{self.sweep_df.sweep_index[0]}")
-            ax1.set_xlim([0, max(self.sweep_df.time)]); 
+            ax1.plot(self.time(), self.data(), 'k')
+            ax2.plot(self.time(), self.commands(), 'k')
+            ax1.set(title = f"sweep #{self.sweep_index()}")
+            ax1.set_xlim([0, max(self.time())]); 
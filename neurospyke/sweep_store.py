@@ -0,0 +1,91 @@
+import numpy as np
+import os
+import pandas as pd
+
+def as_sweep_array(values):
+    if isinstance(values, (np.ndarray, list)):
+        return np.ascontiguousarray(values)
+    return values
+
+class SweepStore(object):
+    """
+    Columnar storage for all sweeps of a cell. The time, data and commands
+    of every sweep are kept as contiguous (sweeps x points) arrays, and the
+    per-sweep scalars (sweep_index, sweep_time) live in a small separate
+    table, so single sweeps can be handed out as views instead of copies.
+    Sweep arrays can also be lazy (see mat_file.LazySweepArray), in which
+    case sweeps are only read when they are used.
+    """
+    columns = ('time', 'data', 'commands')
+
+    def __init__(self, time, data, commands, sweep_times):
+        self.time = as_sweep_array(time)
+        self.data = as_sweep_array(data)
+        self.commands = as_sweep_array(commands)
+        self.sweep_table = pd.DataFrame({
+            'sweep_index': np.arange(len(sweep_times)),
+            'sweep_time': np.asarray(sweep_times).flatten()
+            })
+
+    @classmethod
+    def from_mat_cell(cls, mat_cell):
+        """
+        Creates a store from the 'Cell' struct of a MATLAB file, in which each
+        sweep is a column. MATLAB arrays are loaded in Fortran order, so the
+        transposed arrays are already contiguous and are not copied.
+        """
+        return cls(
+                time=mat_cell['time'][0, 0].T,
+                data=mat_cell['data'][0, 0].T,
+                commands=mat_cell['commands'][0, 0].T,
+                sweep_times=mat_cell['sweep_time'][0, 0])
+
+    @classmethod
+    def open(cls, store_dir, mmap_mode='r'):
+        """
+        Opens a store saved with self.save(). The sweep arrays are memory
+        mapped, so only the sweeps that are actually read get paged in.
+        """
+        arrays = {column: np.load(os.path.join(store_dir, f"{column}.npy"), mmap_mode=mmap_mode)
+                for column in cls.columns + ('sweep_time',)}
+        return cls(arrays['time'], arrays['data'], arrays['commands'], arrays['sweep_time'])
+
+    def save(self, store_dir):
+        """
+        Saves each sweep array as a raw .npy file in store_dir.
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        for column in self.columns:
+            np.save(os.path.join(store_dir, f"{column}.npy"), np.asarray(getattr(self, column)))
+        np.save(os.path.join(store_dir, "sweep_time.npy"), self.sweep_times())
+
+    def nsweeps(self):
+        return len(self.sweep_table.index)
+
+    def sweep_times(self):
+        return self.sweep_table['sweep_time'].values
+
+    def sweep_time(self, sweep_index):
+        return self.sweep_times()[sweep_index]
+
+    def sweep_view(self, column, sweep_index):
+        """
+        Returns a zero-copy view of one sweep of 'time', 'data' or 'commands'
+        (for lazy sweep arrays, the sweep as read from the file).
+        """
+        assert column in self.columns, f"{column} is not a sweep column"
+        return getattr(self, column)[sweep_index]
+
+    def sweep_rows(self, column, sweep_indices):
+        """
+        Returns a 2-D (sweeps x points) array of 'time', 'data' or 'commands'
+        with only the given sweeps.
+        """
+        assert column in self.columns, f"{column} is not a sweep column"
+        values = getattr(self, column)
+        sweep_indices = np.asarray(sweep_indices, dtype=int)
+        if hasattr(values, 'rows'):
+            return values.rows(sweep_indices)
+        if np.array_equal(sweep_indices, np.arange(self.nsweeps())):
+            return values
+        return values[sweep_indices]
@@ -2,37 +2,57 @@ from neurospyke.cell import Cell
 import glob 
 import os
 import pandas as pd
-import pickle 
+import warnings
 
 cache_dir = 'cached_data/'
 cell_cache_dir = cache_dir + 'cells/'
 query_cache_dir = cache_dir + 'queries/'
 
-os.makedirs(query_cache_dir, exist_ok=True)
-os.makedirs(cell_cache_dir, exist_ok=True)
+# cache directories are created when something is first saved in them
 
-def calc_pickle_cell_path(mat_cell_path):
-    # Cell files have unique names
+def calc_cell_cache_path(mat_cell_path, cells_dir=None):
+    """
+    Returns the cache directory of a cell file in cells_dir (by default
+    cell_cache_dir). Cells are cached by file name.
+    """
+    if cells_dir is None:
+        cells_dir = cell_cache_dir
     mat_name = os.path.basename(os.path.normpath(mat_cell_path))
-    pickle_name = mat_name.replace('.mat', '.pickle')
-    return cell_cache_dir + pickle_name 
-
-def load_cell(mat_cell_path, to_pickle=True):
-    pickle_cell_path = calc_pickle_cell_path(mat_cell_path)
-    try: 
-        with open(pickle_cell_path, 'rb') as f:
-            cell = pickle.load(f)
+    return os.path.join(cells_dir, mat_name.replace('.mat', ''))
+
+def deprecated_to_pickle(to_cache, to_pickle):
+    """
+    Returns the value of to_cache, which replaced the to_pickle argument
+    (still accepted, with a warning) when cells stopped being pickled.
+    """
+    if to_pickle is None:
+        return to_cache
+    warnings.warn("to_pickle is deprecated, use to_cache", DeprecationWarning, stacklevel=3)
+    return to_pickle
+
+def load_cell(mat_cell_path, to_cache=True, to_pickle=None, cells_dir=None):
+    """
+    Loads a cell from its on-disk cache if it was cached from this .mat file
+    and the file has not changed since, otherwise from the .mat file (and
+    then caches it as memory-mappable arrays plus metadata). Cells are cached
+    in cells_dir, by default cell_cache_dir.
+    """
+    to_cache = deprecated_to_pickle(to_cache, to_pickle)
+    cell_cache_path = calc_cell_cache_path(mat_cell_path, cells_dir)
+    if Cell.is_saved(cell_cache_path):
+        cell = Cell.open(cell_cache_path)
+        if cell.is_current(mat_cell_path):
             return cell
-    except:
-        cell = Cell(mat_cell_path)
-        if to_pickle:
-            with open(pickle_cell_path, 'wb') as f:
-                pickle.dump(cell, f)
-        return cell
-
-def load_cells(data_dir_path, to_pickle=True):
+        print(f"{mat_cell_path} has changed or is not the cached file, reloading")
+    cell = Cell(mat_cell_path)
+    if to_cache:
+        cell.save(cell_cache_path)
+    return cell
+
+def load_cells(data_dir_path, to_cache=True, to_pickle=None, cells_dir=None):
+    to_cache = deprecated_to_pickle(to_cache, to_pickle)
     paths = glob.glob(data_dir_path)
-    cells = [load_cell(path, to_pickle) for path in paths]
+    cells = [load_cell(path, to_cache, cells_dir=cells_dir) for path in paths]
     assert len(cells)>0, f"no cells were found in {data_dir_path}"
     return cells
 
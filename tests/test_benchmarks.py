@@ -0,0 +1,17 @@
+from benchmarks.properties import compare
+from benchmarks.properties import run_benchmarks
+from neurospyke.utils import load_cells
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+cells = load_cells(data_dir_path)
+
+def test_run_and_compare_benchmarks():
+    results = {'benchmarks': run_benchmarks(cells, repeats=1)}
+    assert 'response.spiking.threshold_vals' in results['benchmarks']
+    assert 'cell.hyperpolarizing.average_response' in results['benchmarks']
+    for timing in results['benchmarks'].values():
+        assert timing['repeats'] == 1 and timing['min'] >= 0
+
+    comparison = compare(results, results)
+    assert list(comparison.index) == sorted(results['benchmarks'])
+    assert (comparison['ratio'] == 1).all()
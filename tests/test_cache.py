@@ -0,0 +1,78 @@
+from neurospyke.cache import CacheBudget
+from neurospyke.cache import PropertyCache
+from neurospyke.query import Query
+from neurospyke.response import Response
+from neurospyke.sweep import Sweep
+from neurospyke.utils import load_cells
+import gc
+import numpy as np
+import pickle
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+cells = load_cells(data_dir_path)
+query1 = Query(cells, response_criteria = [('curr_duration',.3), ('sweep_time', '>0')])
+query1.run()
+cell1 = query1.cells[0]
+
+# cell_name = 010417-1, sweep_idx = 16, 5 APs
+sweep_obj_5AP = Sweep(cell1.sweep_df(16), cell=cell1) 
+
+def test_parameterized_keys():
+    response_obj = Response(sweep_obj_5AP.current_inj_waveforms()[0], sweep_obj_5AP)
+    rising = response_obj.calc_or_read_from_cache('dVdt_pct_APamp__20__rising')
+    falling = response_obj.calc_or_read_from_cache('dVdt_pct_APamp__20__falling')
+    assert not np.allclose(rising, falling)
+    misses = response_obj.cache_stats()['misses']
+    assert np.allclose(response_obj.calc_or_read_from_cache('dVdt_pct_APamp__20__rising'), rising)
+    stats = response_obj.cache_stats()
+    assert stats['misses'] == misses
+    assert stats['hits'] > 0
+    assert stats['nbytes'] > 0
+
+def test_eviction_of_large_values():
+    budget = CacheBudget(max_bytes=3500, min_evictable_bytes=1000)
+    cache = PropertyCache(budget=budget)
+    cache.put('small', 1.0)
+    for i in range(3):
+        cache.put(f"trace__{i}", np.zeros(200))
+    assert 'small' in cache
+    assert 'trace__0' not in cache
+    assert 'trace__1' in cache and 'trace__2' in cache
+    assert cache.stats()['evictions'] == 1
+
+    # a lookup makes trace__1 the most recently used entry
+    cache.lookup('trace__1')
+    cache.put('trace__3', np.zeros(200))
+    assert 'trace__1' in cache and 'trace__2' not in cache
+    assert budget.stats()['evictable_nbytes'] == 2 * 1600
+
+def test_budget_is_shared_and_released():
+    budget = CacheBudget(max_bytes=None, min_evictable_bytes=1000)
+    caches = [PropertyCache(budget=budget) for _ in range(2)]
+    for cache in caches:
+        cache.put('trace', np.zeros(200))
+    assert budget.stats()['evictable_nbytes'] == 2 * 1600
+    del cache
+    caches.pop()
+    gc.collect()
+    assert budget.stats()['evictable_nbytes'] == 1600
+
+def test_pickled_cache():
+    cache = PropertyCache()
+    cache.put('num_spikes', 5)
+    cache.lookup('num_spikes')
+    unpickled_cache = pickle.loads(pickle.dumps(cache))
+    assert unpickled_cache.get('num_spikes') == 5
+    assert unpickled_cache.stats()['hits'] == 1
+
+def test_response_with_small_budget():
+    budget = CacheBudget(max_bytes=0, min_evictable_bytes=1000)
+    response_obj = Response(sweep_obj_5AP.current_inj_waveforms()[0], sweep_obj_5AP)
+    response_obj._cache = PropertyCache(budget=budget)
+    # values are calculated, not read from a property store
+    cell1.property_store = None
+    assert response_obj.property_store_key('AP_amplitudes') is None
+    response_obj.calc_properties(['AP_amplitudes', 'dVdt_pct_APamp__20__rising'])
+    assert 'dVdt_mV_per_ms' not in response_obj._cache
+    assert 'threshold_vals' in response_obj._cache
+    assert response_obj.cache_stats()['evictions'] > 0
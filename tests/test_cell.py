@@ -96,6 +96,41 @@ def test_response_properties_df():
     assert len(APmax_columns) == 5
     assert len(results_df.index) == 7 # 7 sweeps with 5 APs
 
+def test_valid_responses_are_selected_once():
+    data_dir_path = "tests/data/initial_examples/*.mat"
+    cells = load_cells(data_dir_path)
+    query = Query(cells, response_criteria=[('curr_duration', .3), ('num_spikes', 5)],
+            response_properties=['APmax_vals'])
+    query.run()
+    cell1 = query.cells[0]
+    analyzed_sweep_ids = list(cell1.analyzed_sweep_ids)
+    assert len(analyzed_sweep_ids) == 7 # 7 sweeps with 5 APs
+
+    hits = cell1.cache_stats()['hits']
+    responses = list(cell1.valid_responses())
+    assert cell1.cache_stats()['hits'] == hits + 1
+    assert [response.sweep.sweep_index() for response in responses] == analyzed_sweep_ids
+    assert all(response.calc_or_read_from_cache('num_spikes') == 5 for response in responses)
+
+    # consuming responses of some sweeps does not change the analyzed sweeps
+    assert len(list(cell1.valid_responses(sweep_ids=analyzed_sweep_ids[:2]))) == 2
+    assert cell1.analyzed_sweep_ids == analyzed_sweep_ids
+
+def test_criteria_properties_are_calculated_once():
+    data_dir_path = "tests/data/initial_examples/*.mat"
+    cells = load_cells(data_dir_path)
+    # doublet_index is not in the pulse index, so it is checked on each response
+    query = Query(cells, response_criteria=[('curr_duration', .3), ('num_spikes', 5), 
+        ('doublet_index', '>0')], response_properties=['doublet_index'])
+    query.run(profile=True)
+    cell1 = query.cells[0]
+    assert list(cell1.valid_responses())[0] is next(cell1.valid_responses())
+
+    # the values calculated to check the criterion are used for the results
+    doublet_index_calls = query.profiler.property_table().loc['doublet_index']
+    assert doublet_index_calls['misses'] == doublet_index_calls['hits']
+    assert doublet_index_calls['misses'] == sum(len(cell.analyzed_sweep_ids) for cell in cells)
+
 ####################################################################################################
 #################################   SAG/REBOUND PROPERTIES    ######################################
 ####################################################################################################
@@ -135,3 +170,26 @@ def test_average_response():
 
     response_sweep_df = response_obj.sweep.sweep_df
     assert np.isclose(response_sweep_df['sweep_time'][0], 174.43)
+
+def test_average_response_is_memoized():
+    data_dir_path = "tests/data/more_cells/*.mat"
+    response_criteria = [('curr_duration', .12), ('curr_amplitude', -400)]
+    # cells of this test only, and no property store, so that values are
+    # calculated here rather than read from earlier queries
+    cells = load_cells(data_dir_path)
+    query = Query(cells, response_criteria=response_criteria,
+            cell_properties=['sag_fit_amplitude', 'reb_delta_t'], property_store_path=None)
+    query.run()
+    assert query.property_store is None
+    reb_ex_cell = query.cells[0]
+
+    response_obj = reb_ex_cell.average_response()
+    assert reb_ex_cell.average_response() is response_obj
+    assert reb_ex_cell.average_response(right_window=230) is not response_obj
+    # sag/rebound properties are calculated on the shared average response
+    assert 'sag_fit_amplitude' in response_obj._cache
+    assert 'reb_delta_t' in response_obj._cache
+
+    # a query with other criteria has its own average response
+    reb_ex_cell.query = Query(cells, response_criteria=response_criteria + [('sweep_time', '>0')])
+    assert reb_ex_cell.average_response() is not response_obj
@@ -0,0 +1,38 @@
+from neurospyke.classify_cell import classifier_df
+from neurospyke.classify_cell import classifier_spike_counts
+from neurospyke.classify_cell import classify_cell
+from neurospyke.classify_cell import classify_cells
+from neurospyke.classify_cell import lda_parameters
+from neurospyke.classify_cell import spike_count_variables
+from neurospyke.utils import load_cells
+from sklearn.discriminant_analysis import LinearDiscriminantAnalysis as LDA
+import numpy as np
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+cells = load_cells(data_dir_path)
+scores_df = classify_cells(cells)
+
+def test_classify_cells():
+    assert len(scores_df) == len(cells) * len(classifier_spike_counts)
+    assert set(scores_df['cell_name']) == {cell.calc_cell_name() for cell in cells}
+    assert scores_df['spike_count_type'].dropna().isin([1, 3]).all()
+    assert scores_df['cell_type'].dropna().isin([1, 2, 3]).all()
+    # the final type is the same on all rows of a cell
+    assert (scores_df.groupby('cell_name')['cell_ID'].nunique() == 1).all()
+
+def test_scores_match_lda():
+    cell_df = classifier_df(cells)
+    for row in scores_df.dropna(subset=['score']).itertuples():
+        parameters = lda_parameters().loc[(row.ca_buffer, row.num_spikes)]
+        lda = LDA()
+        lda.coef_ = parameters['coef'].values[None, :]
+        lda.intercept_ = np.array([parameters['intercept']])
+        X = cell_df.loc[[row.cell_name], spike_count_variables(row.num_spikes)].values.astype(float)
+        Xs = (X - parameters['mean'].values)/parameters['std'].values
+        assert np.isclose(-lda.decision_function(Xs)[0], row.score)
+
+def test_classify_cell():
+    cell = cells[0]
+    cell_type = classify_cell(cell, plot=False)
+    cell_scores = scores_df[scores_df.cell_name == cell.calc_cell_name()]
+    assert np.isclose(cell_type, cell_scores['cell_type'].values[0], equal_nan=True)
@@ -0,0 +1,32 @@
+from neurospyke.fitting import exponential
+from neurospyke.fitting import fit_exponentials
+from neurospyke.fitting import goodness_of_fit
+from neurospyke.fitting import log_linear_guess
+import numpy as np
+
+x = np.arange(0, .1, .00005)
+
+def test_log_linear_guess():
+    y = exponential(x, -4, -30)
+    a, b = log_linear_guess(x[None, :], y[None, :], np.ones((1, len(x)), dtype=bool))
+    assert np.allclose([a[0], b[0]], [-4, -30])
+
+def test_fit_exponentials():
+    noise = np.random.RandomState(0).normal(scale=.2, size=len(x))
+    y = exponential(x, -4, -30) + noise
+    a, b = fit_exponentials(x, y)
+    assert np.isclose(a[0], -4, atol=.1)
+    assert np.isclose(b[0], -30, atol=2)
+
+def test_fit_exponentials_batch():
+    params = [(-4, -30), (2, 10), (-1, -50)]
+    x_vals = np.tile(x, (len(params), 1))
+    y_vals = np.vstack([exponential(x, a, b) for a, b in params])
+    # windows of different lengths, padded to the longest one
+    mask = np.arange(len(x)) < np.array([len(x), 1000, 1500])[:, None]
+    y_vals[~mask] = 0
+    a_vals, b_vals = fit_exponentials(x_vals, y_vals, mask)
+    assert np.allclose(a_vals, [a for a, _ in params])
+    assert np.allclose(b_vals, [b for _, b in params])
+    r2_vals = goodness_of_fit(y_vals, exponential(x_vals, a_vals[:, None], b_vals[:, None]), mask)
+    assert np.allclose(r2_vals, 1)
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_in_clean_process(code, cwd):
+    env = dict(os.environ, PYTHONPATH=package_dir)
+    return subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env, 
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+def test_import_has_no_side_effects():
+    cwd = tempfile.mkdtemp()
+    result = run_in_clean_process("""
+from contextlib import redirect_stdout
+import io
+import sys
+output = io.StringIO()
+with redirect_stdout(output):
+    import neurospyke.classify_cell, neurospyke.query, neurospyke.utils
+# pandas < 1.0 imports matplotlib itself, but not pyplot
+heavy_modules = ['matplotlib.pyplot', 'sklearn', 'h5py', 'tkinter']
+print(repr(output.getvalue()), [module for module in heavy_modules if module in sys.modules])
+""", cwd)
+    assert result.returncode == 0, result.stderr
+    # nothing is printed and no heavy module is imported
+    assert result.stdout.strip() == "'' []"
+    assert os.listdir(cwd) == []
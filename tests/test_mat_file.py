@@ -0,0 +1,58 @@
+from neurospyke.cell import Cell
+from neurospyke.mat_file import is_hdf5_mat
+from neurospyke.mat_file import LazySweepArray
+import glob
+import h5py
+import numpy as np
+import os
+import scipy.io
+import tempfile
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+mat_path = sorted(glob.glob(data_dir_path))[0]
+mat_cell = scipy.io.loadmat(mat_path)['Cell']
+
+def char_codes(string):
+    return np.array([[ord(character) for character in string]], dtype=np.uint16)
+
+def save_hdf5_mat(path):
+    """
+    Saves the example cell the way MATLAB saves a v7.3 file: an HDF5 file
+    after a 512 byte header, with transposed arrays and strings as char codes.
+    """
+    with h5py.File(path, 'w', userblock_size=512) as f:
+        cell_group = f.create_group('Cell')
+        for field in ['time', 'data', 'commands', 'sweep_time']:
+            cell_group.create_dataset(field, data=mat_cell[field][0, 0].T, chunks=True)
+        for field in ['name', 'CaBuffer']:
+            dataset = cell_group.create_dataset(field, data=char_codes(mat_cell[field][0, 0][0]))
+            dataset.attrs['MATLAB_class'] = b'char'
+    with open(path, 'r+b') as f:
+        f.write(b'MATLAB 7.3 MAT-file'.ljust(128))
+
+hdf5_path = os.path.join(tempfile.mkdtemp(), os.path.basename(mat_path))
+save_hdf5_mat(hdf5_path)
+
+def test_is_hdf5_mat():
+    assert is_hdf5_mat(hdf5_path)
+    assert not is_hdf5_mat(mat_path)
+
+def test_hdf5_cell_reads_sweeps_lazily():
+    v5_cell = Cell(mat_path)
+    hdf5_cell = Cell(hdf5_path)
+    assert hdf5_cell.calc_cell_name() == v5_cell.calc_cell_name()
+    assert hdf5_cell.calc_ca_buffer() == v5_cell.calc_ca_buffer()
+    assert np.array_equal(hdf5_cell.sweep_times(), v5_cell.sweep_times())
+
+    data = hdf5_cell.data()
+    assert isinstance(data, LazySweepArray)
+    assert data.shape == v5_cell.data().shape
+    assert np.array_equal(hdf5_cell.sweep(16).data().values, v5_cell.sweep(16).data().values)
+    assert sorted(data._rows) == [16]
+
+def test_hdf5_cell_pulse_index():
+    v5_cell = Cell(mat_path)
+    hdf5_cell = Cell(hdf5_path)
+    assert hdf5_cell.pulse_index([5, 10]).equals(v5_cell.pulse_index([5, 10]))
+    assert sorted(hdf5_cell.commands()._rows) == [5, 10]
+    assert hdf5_cell.pulse_index().equals(v5_cell.pulse_index())
@@ -0,0 +1,66 @@
+from neurospyke.online import OnlineAnalyzer
+from neurospyke.online import default_online_properties
+from neurospyke.online import replay_cell
+from neurospyke.sweep import Sweep
+from neurospyke.utils import load_cells
+import numpy as np
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+cells = load_cells(data_dir_path)
+cell1 = cells[0]
+
+def spiking_sweep_index(cell):
+    """
+    Returns the first sweep whose first pulse evokes several spikes, as found
+    by the offline analysis.
+    """
+    for sweep_index in cell.sweep_index_iter():
+        responses = Sweep(cell=cell, sweep_index=sweep_index).responses()
+        if responses and responses[0].calc_or_read_from_cache('num_spikes') > 1:
+            return sweep_index
+
+spiking_sweep_idx = spiking_sweep_index(cell1)
+
+def offline_rows(cell, sweep_index, response_properties):
+    sweep = Sweep(cell=cell, sweep_index=sweep_index)
+    return [response.calc_properties(response_properties) for response in sweep.responses()]
+
+def assert_rows_match(rows, expected_rows):
+    assert len(rows) == len(expected_rows)
+    for row, expected_row in zip(rows, expected_rows):
+        for name, value in expected_row.items():
+            assert np.isclose(row[name], value, equal_nan=True), name
+
+def test_replay_matches_offline_responses():
+    response_properties = default_online_properties + ['AP_width__50', 'baseline']
+    expected_rows = offline_rows(cell1, spiking_sweep_idx, response_properties)
+    assert expected_rows[0]['num_spikes'] > 1
+    # chunk boundaries fall anywhere, e.g. between the points of a crossing
+    for chunk_size in [7, 997, 100000]:
+        analyzer = OnlineAnalyzer(response_properties)
+        rows = list(replay_cell(cell1, [spiking_sweep_idx], chunk_size, analyzer))
+        assert_rows_match(rows, expected_rows)
+        assert all(row['sweep_index'] == spiking_sweep_idx for row in rows)
+
+def test_rows_are_emitted_when_pulse_ends():
+    sweep = Sweep(cell=cell1, sweep_index=spiking_sweep_idx)
+    offset_pnt = sweep.current_inj_waveforms()[0]['offset_pnt']
+    time, data, commands = sweep.time().values, sweep.data().values, sweep.commands().values
+
+    analyzer = OnlineAnalyzer()
+    analyzer.start_sweep(spiking_sweep_idx, cell1.sweep_time(spiking_sweep_idx))
+    stop = offset_pnt + 1
+    assert analyzer.feed(time[:stop], data[:stop], commands[:stop]) == []
+    rows = analyzer.feed(time[stop:stop+1], data[stop:stop+1], commands[stop:stop+1])
+    assert len(rows) == 1
+    assert rows[0]['offset_pnt'] == offset_pnt
+    assert analyzer.end_sweep() == []
+
+def test_response_criteria():
+    analyzer = OnlineAnalyzer(['num_spikes'], response_criteria=[('curr_amplitude', '>0')])
+    rows = list(replay_cell(cell1, chunk_size=5000, analyzer=analyzer))
+    assert len(rows) > 0
+    assert all(row['amplitude'] > 0 for row in rows)
+    results_df = analyzer.results_df()
+    assert len(results_df) == len(rows)
+    assert 'num_spikes' in results_df
@@ -0,0 +1,58 @@
+from neurospyke.profiling import Profiler
+from neurospyke.query import Query
+from neurospyke.utils import load_cells
+import os
+import tempfile
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+cells = load_cells(data_dir_path)
+
+response_criteria = [('curr_duration', .3), ('num_spikes', 5)]
+response_properties = ['APmax_vals', 'dVdt_pct_APamp__20__rising', 'delta_thresh']
+
+def test_profiler_stacks():
+    profiler = Profiler()
+    with profiler.frame('cell'):
+        with profiler.stage('response_properties'):
+            with profiler.property_call('cell', 'APmax_vals', hit=False):
+                with profiler.property_call('cell', 'spike_points', hit=False):
+                    pass
+            with profiler.property_call('cell', 'APmax_vals', hit=True):
+                pass
+    assert profiler.property_records[('cell', 'APmax_vals')][:3] == [2, 1, 1]
+    stack_names = [line.rsplit(' ', 1)[0] for line in profiler.collapsed_stacks()]
+    assert stack_names == ['cell', 'cell;response_properties', 
+            'cell;response_properties;APmax_vals', 
+            'cell;response_properties;APmax_vals;spike_points']
+    assert list(profiler.stage_table().index) == ['response_properties']
+
+def test_profiled_query_run():
+    query = Query(cells, response_criteria=response_criteria, 
+            response_properties=response_properties)
+    df = query.run(profile=True)
+    profiler = query.profiler
+    assert df.equals(Query(cells, response_criteria=response_criteria, 
+            response_properties=response_properties).run())
+
+    property_table = profiler.property_table()
+    assert {'APmax_vals', 'spike_points', 'threshold_vals'}.issubset(property_table.index)
+    # AP amplitude levels are cached by pct_APamp_idxs, not calc_or_read_from_cache
+    assert 'pct_APamp_idxs__20__rising' in property_table.index
+    assert (property_table['calls'] == property_table['hits'] + property_table['misses']).all()
+    by_cell = profiler.property_table(by_cell=True)
+    assert set(by_cell.index.get_level_values('cell')) == set(df.index)
+    assert {'load', 'pulse_detection', 'criteria_filtering', 'response_properties', 
+            'cell_properties', 'aggregation'}.issubset(profiler.stage_table().index)
+
+    path = os.path.join(tempfile.mkdtemp(), 'query.stacks')
+    profiler.save_collapsed_stacks(path)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert all(int(line.rsplit(' ', 1)[1]) >= 0 for line in lines)
+
+def test_parallel_profiled_query_run():
+    query = Query(cells, response_criteria=response_criteria, 
+            response_properties=response_properties)
+    query.run(workers=2, profile=True)
+    assert set(query.profiler.property_table(by_cell=True).index.get_level_values('cell')) == \
+            set(query.mean_df.index)
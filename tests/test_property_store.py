@@ -0,0 +1,67 @@
+from neurospyke.property_store import PropertyStore
+from neurospyke.query import Query
+from neurospyke.utils import load_cells
+import numpy as np
+import os
+import tempfile
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+cells = load_cells(data_dir_path)
+
+def test_put_and_get():
+    store = PropertyStore(os.path.join(tempfile.mkdtemp(), 'properties.sqlite'))
+    key = store.key('cell_file', 16, 2000, 8000, 'APmax_vals')
+    assert store.get(key) == (False, None)
+    store.put(key, [1.0, 2.0])
+    assert store.get(key) == (True, [1.0, 2.0])
+    assert len(store) == 1
+
+def test_put_does_not_lock_store():
+    path = os.path.join(tempfile.mkdtemp(), 'properties.sqlite')
+    store = PropertyStore(path)
+    store.put(store.key('cell_file', 16, 2000, 8000, 'APmax_vals'), [1.0, 2.0])
+    assert not store.connection().in_transaction
+    # another process can write right away
+    other_store = PropertyStore(path)
+    other_store.connection().execute("PRAGMA busy_timeout = 0")
+    other_store.put(other_store.key('cell_file', 17, 2000, 8000, 'APmax_vals'), [3.0])
+    assert len(store) == 2
+
+def test_large_arrays_are_not_stored():
+    store = PropertyStore(os.path.join(tempfile.mkdtemp(), 'properties.sqlite'))
+    key = store.key('cell_file', 16, 2000, 8000, 'dVdt')
+    store.put(key, np.zeros(store.max_value_size + 1))
+    assert store.get(key) == (False, None)
+
+def test_query_reads_stored_values():
+    response_criteria = [('curr_duration', .3), ('num_spikes', 5)]
+    response_properties = ['APmax_vals', 'doublet_index']
+    path = os.path.join(tempfile.mkdtemp(), 'properties.sqlite')
+    query1 = Query(cells, response_criteria=response_criteria, 
+            response_properties=response_properties, property_store_path=path)
+    df1 = query1.run()
+    num_stored = len(query1.property_store)
+    assert num_stored > 0
+
+    # different criteria selecting the same responses
+    query2 = Query(cells, response_criteria=response_criteria + [('doublet_index', '>0')], 
+            response_properties=['doublet_index'], property_store_path=path)
+    for cell in cells:
+        cell._cache.clear()
+    df2 = query2.run()
+    assert np.allclose(df1['doublet_index'], df2['doublet_index'])
+
+def test_store_is_opt_in():
+    query = Query(cells, response_criteria=[('curr_duration', .3), ('num_spikes', 5)], 
+            response_properties=['APmax_vals'])
+    assert query.property_store is None
+    query.run()
+    assert all(cell.property_store is None for cell in cells)
+
+def test_descriptive_cell_property_in_cell_properties():
+    path = os.path.join(tempfile.mkdtemp(), 'properties.sqlite')
+    for _ in range(2):
+        query = Query(cells, response_criteria=[('curr_duration', .3), ('num_spikes', 5)], 
+                cell_properties=['ca_buffer'], property_store_path=path)
+        df = query.run()
+        assert list(df.columns).count('ca_buffer') == 1
@@ -0,0 +1,59 @@
+from neurospyke.provenance import file_fingerprint
+from neurospyke.provenance import is_current
+from neurospyke.utils import load_cell
+import glob
+import os
+import shutil
+import tempfile
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+mat_path = sorted(glob.glob(data_dir_path))[0]
+
+def test_file_fingerprint():
+    path = os.path.join(tempfile.mkdtemp(), 'cell.mat')
+    assert file_fingerprint(path) is None
+    with open(path, 'wb') as f:
+        f.write(b'sweeps')
+    fingerprint = file_fingerprint(path)
+    content_fingerprint = file_fingerprint(path, content_hash=True)
+    assert fingerprint.startswith('cell.mat:6:')
+    assert content_fingerprint.startswith(fingerprint)
+    assert is_current(fingerprint, path) and is_current(content_fingerprint, path)
+
+    with open(path, 'wb') as f:
+        f.write(b'new sweeps')
+    assert not is_current(fingerprint, path)
+    assert not is_current(content_fingerprint, path)
+
+def copy_mat_file():
+    tmp_mat_path = os.path.join(tempfile.mkdtemp(), os.path.basename(mat_path))
+    shutil.copy(mat_path, tmp_mat_path)
+    return tmp_mat_path
+
+def test_changed_mat_file_is_reloaded():
+    # a private cache, so the shared cache of the test cells is not touched
+    cells_dir = tempfile.mkdtemp()
+    tmp_mat_path = copy_mat_file()
+
+    cell = load_cell(tmp_mat_path, cells_dir=cells_dir)
+    assert load_cell(tmp_mat_path, cells_dir=cells_dir).fingerprint() == cell.fingerprint()
+
+    stat = os.stat(tmp_mat_path)
+    os.utime(tmp_mat_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert not cell.is_current()
+    reloaded_cell = load_cell(tmp_mat_path, cells_dir=cells_dir)
+    assert reloaded_cell.fingerprint() != cell.fingerprint()
+    assert reloaded_cell.is_current()
+
+    os.remove(tmp_mat_path)
+    assert not reloaded_cell.is_current()
+
+def test_file_with_same_name_is_not_read_from_cache():
+    cells_dir = tempfile.mkdtemp()
+    tmp_mat_path = copy_mat_file()
+    other_mat_path = copy_mat_file()
+    cell = load_cell(tmp_mat_path, cells_dir=cells_dir)
+    assert not cell.is_current(other_mat_path)
+    other_cell = load_cell(other_mat_path, cells_dir=cells_dir)
+    assert other_cell.file_path == other_mat_path
+    assert other_cell.is_current(other_mat_path)
@@ -0,0 +1,99 @@
+from neurospyke.pulse_index import criteria_mask
+from neurospyke.pulse_index import detect_current_injections
+from neurospyke.query import Query
+from neurospyke.response import Response
+from neurospyke.utils import load_cells
+import numpy as np
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+cells = load_cells(data_dir_path)
+response_criteria = [('sweep_time', '<150'), ('curr_duration', .3), ('num_spikes', 5)]
+query = Query(cells, response_criteria=response_criteria, response_properties=['num_spikes'])
+query.run()
+cell1 = query.cells[0]; cell2 = query.cells[1]
+
+def test_detect_current_injections():
+    commands = np.zeros((3, 30))
+    commands[0, 5:10] = 3; commands[0, 20:] = np.nan
+    commands[1, 3:8] = np.nan; commands[1, 10:15] = -4
+    commands[1, 15:18] = np.nan; commands[1, 18:22] = -4
+    commands[2, 2:6] = 5; commands[2, 6:9] = 7; commands[2, 9:12] = 2 # not symmetrical
+    time = np.tile(np.arange(30)/10, (3, 1))
+    pulses = detect_current_injections(commands, time)
+    assert list(pulses['sweep_index']) == [0, 1]
+    # points are counted after dropping nan, as for a single sweep
+    assert list(pulses['onset_pnt']) == [5, 5]
+    assert list(pulses['offset_pnt']) == [10, 14]
+    assert list(pulses['amplitude']) == [3, -4]
+
+def sweep_current_injections(sweep):
+    """
+    The per-sweep detection that detect_current_injections replaced, kept
+    as a reference.
+    """
+    assert sweep.commands()[0] == 0
+    commands = sweep.commands().dropna()
+    delta_curr = commands.diff().fillna(0).values
+    non_zero = np.nonzero(delta_curr)[0]
+    assert len(non_zero) % 2 == 0
+    pulses = []
+    for i in range(0, len(non_zero), 2):
+        onset = non_zero[i]; offset = non_zero[i+1]
+        if delta_curr[onset] == -delta_curr[offset]:
+            pulses.append({
+                'onset_pnt': onset,
+                'offset_pnt': offset,
+                'onset_time': sweep.time().iloc[onset],
+                'offset_time': sweep.time().iloc[offset],
+                'amplitude': commands.iloc[onset]})
+    return pulses
+
+def test_detect_current_injections_matches_sweeps():
+    pulses = detect_current_injections(cell2.commands(), cell2.time())
+    known_pulses = [pulse for sweep in cell2.sweeps() for pulse in sweep_current_injections(sweep)]
+    assert len(pulses) == len(known_pulses)
+    for pulse, known_pulse in zip(pulses, known_pulses):
+        for column in known_pulse:
+            assert pulse[column] == known_pulse[column]
+
+def test_pulse_index_matches_responses():
+    pulse_index = cell2.pulse_index()
+    for pulse in pulse_index.to_dict('records'):
+        sweep = cell2.sweep(int(pulse['sweep_index']))
+        response = Response(pulse, sweep)
+        assert np.isclose(pulse['sweep_time'], response.calc_sweep_time())
+        assert np.isclose(pulse['curr_duration'], response.calc_curr_duration())
+        assert pulse['curr_amplitude'] == response.calc_curr_amplitude()
+        assert pulse['num_spikes'] == response.calc_num_spikes()
+
+def test_pulse_index_has_all_pulses():
+    num_pulses = sum(len(sweep_current_injections(sweep)) for sweep in cell2.sweeps())
+    assert len(cell2.pulse_index().index) == num_pulses
+
+def test_criteria_mask():
+    criteria = [('curr_duration', .3), ('doublet_index', '>1')]
+    mask, remaining_criteria = criteria_mask(cell1.pulse_index(), criteria)
+    assert remaining_criteria == [('doublet_index', '>1')]
+    assert mask.dtype == bool
+    assert mask.sum() == np.isclose(cell1.pulse_index()['curr_duration'], .3).sum()
+
+def test_valid_responses_match_meets_criteria():
+    known_ids = []
+    for sweep in cell1.sweeps():
+        for response in sweep.responses():
+            if response.meets_criteria():
+                known_ids.append(sweep.sweep_index())
+    valid_ids = [response.calc_sweep_index() for response in cell1.valid_responses()]
+    assert valid_ids == known_ids
+
+def test_pulse_index_of_some_sweeps():
+    cell = load_cells(data_dir_path)[0]
+    some_pulses = cell.pulse_index([12, 3])
+    assert set(some_pulses['sweep_index']) <= {3, 12}
+    # as many sweeps as are indexed, but not the same ones
+    assert set(cell.pulse_index([3, 3])['sweep_index']) <= {3}
+    assert list(cell.spike_index().sweep_indices) == list(range(cell.nsweeps()))
+    all_pulses = cell.pulse_index()
+    assert all_pulses.equals(cell1.pulse_index())
+    assert some_pulses.reset_index(drop=True).equals(
+            all_pulses[all_pulses['sweep_index'].isin([3, 12])].reset_index(drop=True))
@@ -165,3 +165,104 @@ def test_query_with_calculated_cell_properties():
     pass
 
 
+
+def test_parallel_run():
+    serial_query = Query(cells, response_criteria=response_criteria, 
+            response_properties=response_properties)
+    serial_df = serial_query.run()
+    parallel_query = Query(cells, response_criteria=response_criteria, 
+            response_properties=response_properties)
+    parallel_df = parallel_query.run(workers=2)
+    assert list(parallel_df.columns) == list(serial_df.columns)
+    assert parallel_df.equals(serial_df)
+    assert parallel_query.analyzed_sweeps_dict == serial_query.analyzed_sweeps_dict
+
+def test_create_or_load_from_cache_adds_new_cells():
+    query_kwargs = dict(response_criteria = [('curr_duration', .3), ('num_spikes', 4)],
+            response_properties=['num_spikes', 'delta_thresh'])
+    Query.create_or_load_from_cache(cells[:1], overwrite=True, **query_kwargs)
+
+    extended_query = Query.create_or_load_from_cache(cells, **query_kwargs)
+    full_query = Query(cells, **query_kwargs)
+    full_df = full_query.run()
+    assert list(extended_query.mean_df.index) == list(full_df.index)
+    assert extended_query.mean_df.equals(full_df)
+    assert extended_query.analyzed_sweeps_dict == full_query.analyzed_sweeps_dict
+
+    reduced_query = Query.create_or_load_from_cache(cells[1:], **query_kwargs)
+    assert list(reduced_query.mean_df.index) == [cells[1].calc_cell_name()]
+    assert list(reduced_query.analyzed_sweeps_dict) == [cells[1].calc_cell_name()]
+
+def test_create_or_load_from_cache_adds_new_properties():
+    query_criteria = dict(response_criteria = [('curr_duration', .3), ('num_spikes', 6)])
+    Query.create_or_load_from_cache(cells, overwrite=True, 
+            response_properties=['APmax_vals'], **query_criteria)
+
+    # the added property comes before the cached one in a full run
+    extended_query = Query.create_or_load_from_cache(cells, 
+            response_properties=['num_spikes', 'APmax_vals'], **query_criteria)
+    full_df = Query(cells, response_properties=['num_spikes', 'APmax_vals'], **query_criteria).run()
+    extended_df = extended_query.mean_df
+    assert list(extended_df.columns) == list(full_df.columns)
+    assert extended_df.equals(full_df)
+
+def test_extended_query_columns_match_full_run():
+    # responses with different spike counts, so cells have different APmax_vals columns
+    query_criteria = dict(response_criteria = [('curr_duration', .3), ('num_spikes', '>2')])
+    Query.create_or_load_from_cache(cells[:1], overwrite=True, 
+            response_properties=['APmax_vals'], **query_criteria)
+
+    query_kwargs = dict(response_properties=['num_spikes', 'APmax_vals'], 
+            cell_properties=['ca_buffer'], **query_criteria)
+    extended_query = Query.create_or_load_from_cache(cells, **query_kwargs)
+    full_df = Query(cells, **query_kwargs).run()
+    extended_df = extended_query.mean_df
+    assert list(full_df.columns[:3]) == Cell.descriptive_cell_properties
+    assert list(extended_df.columns) == list(full_df.columns)
+    assert extended_df.equals(full_df)
+
+def test_run_many():
+    kwargs_list = [
+            dict(response_criteria=response_criteria, response_properties=response_properties),
+            dict(response_criteria=[('curr_duration', .3), ('num_spikes', 4)], 
+                response_properties=['num_spikes', 'doublet_index']),
+            dict(response_criteria=[('curr_duration', .12), ('curr_amplitude', -400)], 
+                cell_properties=['sag_fit_amplitude', 'reb_delta_t'])]
+    separate_queries = [Query(cells, **kwargs) for kwargs in kwargs_list]
+    separate_dfs = [query.run() for query in separate_queries]
+    queries = [Query(cells, **kwargs) for kwargs in kwargs_list]
+    many_dfs = Query.run_many(queries)
+    for query, separate_query, many_df, separate_df in zip(
+            queries, separate_queries, many_dfs, separate_dfs):
+        assert many_df.equals(separate_df)
+        assert query.mean_df is many_df
+        assert query.analyzed_sweeps_dict == separate_query.analyzed_sweeps_dict
+
+def test_create_or_load_many_from_cache():
+    kwargs_list = [
+            dict(response_criteria=[('curr_duration', .3), ('num_spikes', 3)], 
+                response_properties=['num_spikes']),
+            dict(response_criteria=[('curr_duration', .3), ('num_spikes', 7)], 
+                response_properties=['num_spikes'])]
+    queries = Query.create_or_load_many_from_cache(cells, kwargs_list, overwrite=True)
+    loaded_queries = Query.create_or_load_many_from_cache(cells, kwargs_list)
+    for query, loaded_query in zip(queries, loaded_queries):
+        assert loaded_query.is_cached()
+        assert loaded_query.mean_df.equals(query.mean_df)
+
+def test_spike_categories_match_expanded_properties():
+    response_criteria = [('sweep_time', '<150'), ('curr_duration', .3)]
+    spike_categories = ['doublet_index_by_num_spikes', 'delta_thresh_last_spike', 
+            'dVdt_pct_APamp_last_spike__20__rising']
+    category_query = Query(cells, response_criteria=response_criteria, 
+            response_property_spike_categories=spike_categories)
+    category_df = category_query.run()
+    assert set(category_query.response_properties).issubset(category_df.columns)
+
+    # the same properties requested one by one are evaluated on every response
+    expanded_df = Query(cells, response_criteria=response_criteria, 
+            response_properties=category_query.response_properties).run()
+    for column in category_query.response_properties:
+        if column in expanded_df.columns:
+            assert np.allclose(category_df[column].astype(float), 
+                    expanded_df[column].astype(float), equal_nan=True)
@@ -0,0 +1,37 @@
+from neurospyke.query import Query
+from neurospyke.query_store import QueryStore
+from neurospyke.utils import load_cells
+import os
+import tempfile
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+cells = load_cells(data_dir_path)
+
+response_criteria = [('curr_duration', .3), ('num_spikes', 5)]
+response_properties = ['num_spikes', 'APmax_vals', 'log_doublet_index']
+query = Query(cells, response_criteria=response_criteria, 
+        response_properties=response_properties)
+query.run()
+store_dir = os.path.join(tempfile.mkdtemp(), query.query_id())
+QueryStore.save(store_dir, query)
+
+def test_read_df():
+    store = QueryStore(store_dir)
+    assert store.columns() == list(query.mean_df.columns)
+    assert store.read_df().equals(query.mean_df)
+
+def test_read_some_columns():
+    store = QueryStore(store_dir)
+    df = store.read_df(['APmax_vals0', 'genetic_marker'])
+    assert list(df.columns) == ['APmax_vals0', 'genetic_marker']
+    assert df.equals(query.mean_df[['APmax_vals0', 'genetic_marker']])
+
+def test_load_query_reads_results_lazily():
+    loaded_query = Query.load_query(store_dir)
+    assert loaded_query._mean_df is None
+    assert loaded_query.response_criteria == response_criteria
+    assert loaded_query.log_response_properties == ['doublet_index']
+    assert loaded_query.analyzed_sweeps_dict == query.analyzed_sweeps_dict
+    assert loaded_query.read_columns(['num_spikes']).equals(query.mean_df[['num_spikes']])
+    assert loaded_query._mean_df is None
+    assert loaded_query.mean_df.equals(query.mean_df)
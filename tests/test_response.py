@@ -173,6 +173,17 @@ def test_calc_dVdt_rising_pct_APamplitude():
     known_vals = [-81.0667, -52.7333, -56.6667, -59.60000, -59.5333]
     assert np.allclose(calc_vals, known_vals)
 
+def test_prefetch_pct_APamp_idxs():
+    response_obj = Response(sweep_obj_5AP.current_inj_waveforms()[0], sweep_obj_5AP)
+    response_obj.prefetch_pct_APamp_idxs(
+            ['dVdt_pct_APamp__20__rising', 'dVdt_pct_APamp__50__rising', 'AP_width__50'])
+    for key in ['pct_APamp_idxs__20__rising', 'pct_APamp_idxs__50__rising', 
+            'pct_APamp_idxs__50__falling']:
+        assert key in response_obj._cache
+    assert np.allclose(response_obj.calc_AP_width(50), response_obj_5AP.calc_AP_width(50))
+    assert np.allclose(response_obj.calc_dVdt_pct_APamp('20', 'rising'), 
+            response_obj_5AP.calc_dVdt_pct_APamp('20', 'rising'))
+
 def test_calc_dVdt_pct_APamp_last_spike():
     calc_val = response_obj_5AP.calc_dVdt_pct_APamp_last_spike(
             percent=20, direction='rising', num_spikes=5)
@@ -0,0 +1,39 @@
+from neurospyke.segments import segment_argmax
+from neurospyke.segments import segment_argmin
+from neurospyke.segments import segment_nearest
+from neurospyke.segments import segment_ranges
+from neurospyke.segments import segment_searchsorted
+import numpy as np
+
+values = np.array([0, 3, 1, 5, 5, 2, -1, 4, 0, 7], dtype=float)
+starts = np.array([0, 3, 6])
+stops = np.array([3, 6, 10])
+
+def test_segment_ranges():
+    flat_idxs, offsets, lengths = segment_ranges([2, 7], [4, 10])
+    assert list(flat_idxs) == [2, 3, 7, 8, 9]
+    assert list(offsets) == [0, 2]
+    assert list(lengths) == [2, 3]
+
+def test_segment_argmax():
+    known_idxs = [start + np.argmax(values[start:stop]) for start, stop in zip(starts, stops)]
+    assert list(segment_argmax(values, starts, stops)) == known_idxs == [1, 3, 9]
+
+def test_segment_argmin():
+    known_idxs = [start + np.argmin(values[start:stop]) for start, stop in zip(starts, stops)]
+    assert list(segment_argmin(values, starts, stops)) == known_idxs == [0, 5, 6]
+
+def test_segment_searchsorted():
+    rising = np.array([0, 5, 10, 20, 0, 1, 16, 30])
+    for level in [-1, 5, 15, 100]:
+        known = [np.searchsorted(rising[start:stop], level) for start, stop in [(0, 4), (4, 8), (2, 2)]]
+        assert list(segment_searchsorted(rising, [0, 4, 2], [4, 8, 2], level)) == known
+
+def test_segment_nearest():
+    levels = np.array([[2, 0, 3], [5, 5, -2]])
+    idxs = segment_nearest(values, starts, stops, levels)
+    assert idxs.shape == (2, 3)
+    for i, level_row in enumerate(levels):
+        known_idxs = [start + np.argmin(abs(values[start:stop] - level)) 
+                for start, stop, level in zip(starts, stops, level_row)]
+        assert list(idxs[i]) == known_idxs
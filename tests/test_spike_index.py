@@ -0,0 +1,48 @@
+from neurospyke.spike_index import detect_crossings
+from neurospyke.spike_index import SpikeIndex
+from neurospyke.utils import load_cells
+import numpy as np
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+cells = load_cells(data_dir_path)
+cell1 = cells[0]
+
+def test_detect_crossings():
+    data = np.array([
+        [-60, -5, -60, -10, 0, -60],
+        [-60, -60, -60, -60, -60, -60],
+        [-20, 10, 20, -30, -9, -60]])
+    indptr, indices = detect_crossings(data)
+    assert list(indptr) == [0, 2, 2, 4]
+    assert list(indices[indptr[0]:indptr[1]]) == [0, 3]
+    assert list(indices[indptr[2]:indptr[3]]) == [0, 3]
+
+def test_spike_index_matches_sweep_scan():
+    spike_index = cell1.spike_index()
+    assert spike_index.nsweeps() == cell1.nsweeps()
+    for sweep_index in cell1.sweep_index_iter():
+        data = cell1.data()[sweep_index, :]
+        above_thresh = np.where(data[1:] > -10)
+        below_thresh = np.where(data[0:-1] <= -10)
+        known_points = np.intersect1d(above_thresh, below_thresh)
+        assert np.array_equal(spike_index.sweep_points(sweep_index), known_points)
+
+def test_points_between():
+    spike_index = SpikeIndex.from_data(np.array([[-60, 0, -60, 0, -60, 0, -60]]))
+    assert list(spike_index.points_between(0, 0, 4)) == [2]
+    assert list(spike_index.count_between([0, 0], [-1, 0], [6, 4])) == [3, 1]
+
+def test_spike_index_is_reused():
+    assert cell1.spike_index() is cell1.spike_index()
+
+def test_merge_spike_indexes():
+    data = cell1.data()
+    even_sweeps = np.arange(0, cell1.nsweeps(), 2)
+    odd_sweeps = np.arange(1, cell1.nsweeps(), 2)
+    merged = SpikeIndex.from_data(data[odd_sweeps], sweep_indices=odd_sweeps).merge(
+            SpikeIndex.from_data(data[even_sweeps], sweep_indices=even_sweeps))
+    full = SpikeIndex.from_data(data)
+    assert np.array_equal(merged.sweep_indices, full.sweep_indices)
+    assert np.array_equal(merged.indptr, full.indptr)
+    assert np.array_equal(merged.indices, full.indices)
+    assert list(merged.has_sweeps([0, 1, cell1.nsweeps()])) == [True, True, False]
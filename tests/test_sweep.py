@@ -1,6 +1,7 @@
 from neurospyke.query import Query
 from neurospyke.sweep import Sweep
 from neurospyke.utils import load_cells
+import numpy as np
 import pandas as pd
 
 response_criteria = [('curr_duration', .3), ('num_spikes', 5)]
@@ -40,3 +41,10 @@ def test_run():
     result_df = ex_5APsweep.run()
     assert isinstance(result_df, pd.DataFrame)
     print(f"\nThe result of the sweep is \n{result_df}")
+
+def test_store_backed_sweep():
+    sweep = cell1.sweep(16)
+    assert sweep.sweep_index() == 16
+    assert sweep.sweep_time() == ex_5APsweep.sweep_time()
+    assert np.shares_memory(sweep.data().values, cell1.data())
+    assert sweep.current_inj_waveforms() == ex_5APsweep.current_inj_waveforms()
@@ -0,0 +1,33 @@
+from neurospyke.mat_file import read_mat_cell
+from neurospyke.sweep_store import SweepStore
+from neurospyke.utils import load_cells
+import numpy as np
+
+data_dir_path = "tests/data/initial_examples/*.mat"
+cells = load_cells(data_dir_path)
+cell1 = cells[0]
+store = cell1.sweep_store()
+
+# the sweeps as read from the .mat file, without the cell cache
+_, mat_store = read_mat_cell(cell1.file_path)
+nsweeps, npoints = np.shape(np.asarray(mat_store.data))
+sweep_idx = nsweeps // 2
+
+def test_store_columns_are_contiguous():
+    for column in SweepStore.columns:
+        values = getattr(store, column)
+        assert isinstance(values, np.ndarray)
+        assert values.flags['C_CONTIGUOUS']
+        assert np.shape(values) == (nsweeps, npoints)
+
+def test_sweep_table():
+    assert list(store.sweep_table.columns) == ['sweep_index', 'sweep_time']
+    assert len(store.sweep_table.index) == store.nsweeps() == nsweeps
+    assert store.sweep_time(sweep_idx) == cell1.sweep_df(sweep_idx)['sweep_time'][0]
+    assert store.sweep_time(sweep_idx) == mat_store.sweep_time(sweep_idx)
+
+def test_sweep_view_is_not_a_copy():
+    view = store.sweep_view('data', sweep_idx)
+    assert np.shares_memory(view, store.data)
+    assert np.array_equal(view, cell1.sweep_df(sweep_idx)['data'].values)
+    assert np.array_equal(view, np.asarray(mat_store.data)[sweep_idx])
@@ -1 +1,27 @@
+from neurospyke.cell import Cell
+from neurospyke.utils import calc_cell_cache_path
+from neurospyke.utils import load_cell
+import glob
+import numpy as np
+import pytest
 
+data_dir_path = "tests/data/initial_examples/*.mat"
+mat_path = sorted(glob.glob(data_dir_path))[0]
+
+def test_load_cell_from_cache():
+    mat_cell = Cell(mat_path)
+    load_cell(mat_path)
+    assert Cell.is_saved(calc_cell_cache_path(mat_path))
+
+    cached_cell = load_cell(mat_path)
+    assert cached_cell.store_dir == calc_cell_cache_path(mat_path)
+    assert cached_cell._sweep_store is None # sweeps not read until needed
+    assert cached_cell.calc_cell_name() == mat_cell.calc_cell_name()
+    assert cached_cell.calc_ca_buffer() == mat_cell.calc_ca_buffer()
+    assert np.array_equal(cached_cell.data(), mat_cell.data())
+    assert np.array_equal(cached_cell.sweep_times(), mat_cell.sweep_times())
+
+def test_load_cell_accepts_to_pickle():
+    with pytest.warns(DeprecationWarning):
+        cell = load_cell(mat_path, to_pickle=False)
+    assert cell.calc_cell_name() == Cell(mat_path).calc_cell_name()